@@ -2,7 +2,8 @@
 MCP服务HTTP REST API接口
 """
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from typing import Dict, List, Any, Optional
@@ -12,6 +13,8 @@ from contextlib import asynccontextmanager
 from pathlib import Path
 from dotenv import load_dotenv, dotenv_values
 import os
+import hashlib
+import json
 
 from .config import MCPServerConfig
 from .manager import get_mcp_manager, initialize_mcp_manager
@@ -154,11 +157,15 @@ async def health_check(manager=Depends(get_manager)):
 
 
 @app.get("/tools", response_model=List[ToolInfo], summary="获取工具列表", description="获取所有可用工具的信息")
-async def list_tools(manager=Depends(get_manager)):
-    """获取工具列表"""
+async def list_tools(request: Request, manager=Depends(get_manager)):
+    """获取工具列表（带ETag，客户端缓存的列表未变化时返回304）"""
     try:
-        tools_info = manager.list_tools()
-        return [ToolInfo(**tool) for tool in tools_info]
+        tools_info = [ToolInfo(**tool) for tool in manager.list_tools()]
+        body = json.dumps(jsonable_encoder(tools_info), ensure_ascii=False, sort_keys=True)
+        etag = '"' + hashlib.sha1(body.encode('utf-8')).hexdigest() + '"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(content=body, media_type="application/json", headers={"ETag": etag})
     except Exception as e:
         logger.error(f"获取工具列表失败: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"获取工具列表失败: {str(e)}")
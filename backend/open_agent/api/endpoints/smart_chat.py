@@ -197,11 +197,14 @@ async def smart_query(
 @router.get("/conversation/{conversation_id}/context", response_model=ConversationContextResponse)
 async def get_conversation_context(
     conversation_id: int,
+    before_id: Optional[int] = None,
     current_user = Depends(AuthService.get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     获取对话上下文信息，包括已使用的文件和历史查询
+
+    历史消息默认只返回最近N轮，传入 before_id 继续加载更早的消息
     """
     try:
         # 获取对话上下文
@@ -221,13 +224,12 @@ async def get_conversation_context(
             )
         
         # 获取对话历史
-        history = await conversation_context_service.get_conversation_history(conversation_id)
-        context['message_history'] = history
+        history = await conversation_context_service.get_conversation_history(conversation_id, before_id=before_id)
         
         return ConversationContextResponse(
             success=True,
             message="获取对话上下文成功",
-            data=context
+            data={**context, 'message_history': history}  # 上下文对象在缓存中共享，不直接修改
         )
         
     except HTTPException:
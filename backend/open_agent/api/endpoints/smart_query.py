@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, status
 from fastapi.security import HTTPBearer
 from sqlalchemy.orm import Session
 from typing import Optional, Dict, Any, List
@@ -9,17 +9,29 @@ import tempfile
 from open_agent.utils.schemas import BaseResponse
 from open_agent.services.smart_query import (
     SmartQueryService,
-    ExcelAnalysisService,
     DatabaseQueryService
 )
 from open_agent.services.excel_metadata_service import ExcelMetadataService
+from open_agent.services.columnar_store import ColumnarStore
+from open_agent.services.excel_ingestion import (
+    save_upload,
+    ingest_file,
+    UploadTooLargeError,
+    FileEncodingError
+)
+from open_agent.core.config import get_settings
+from open_agent.services.dataframe_cache import get_dataframe_cache
+from open_agent.services.generated_code_cache import get_generated_code_cache
+from open_agent.services.result_store import get_result_store, ResultNotFoundError
+from open_agent.core.executor import get_executor_pools
+from open_agent.utils.exceptions import ExecutorOverloadedError
 
 import uuid
 from pathlib import Path
 from open_agent.utils.file_utils import FileUtils
 
 from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, FileResponse
 from sqlalchemy.orm import Session
 from typing import Optional, AsyncGenerator
 import json
@@ -28,7 +40,7 @@ from datetime import datetime
 from open_agent.db.database import get_db
 from open_agent.services.auth import AuthService
 from open_agent.services.smart_workflow import SmartWorkflowManager
-from open_agent.services.conversation_context import ConversationContextService
+from open_agent.services.conversation_context import conversation_context_service
 import logging
 from pydantic import BaseModel
 
@@ -90,14 +102,15 @@ async def upload_excel(
                 detail="不支持的文件格式，请上传 .xlsx, .xls 或 .csv 文件"
             )
         
-        # 验证文件大小 (10MB)
-        content = await file.read()
-        file_size = len(content)
-        if file_size > 10 * 1024 * 1024:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="文件大小不能超过 10MB"
-            )
+        # 验证文件大小
+        smart_query_settings = get_settings().smart_query
+        max_bytes = smart_query_settings.upload_max_mb * 1024 * 1024
+        size_error = HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"文件大小不能超过 {smart_query_settings.upload_max_mb}MB"
+        )
+        if file.size is not None and file.size > max_bytes:
+            raise size_error
         
         # 创建持久化目录结构
         backend_dir = Path(__file__).parent.parent.parent.parent  # 获取backend目录
@@ -113,53 +126,62 @@ async def upload_excel(
         new_filename = f"{file_id}_{safe_filename}"
         file_path = excel_user_dir / new_filename
         
-        # 保存文件
-        with open(file_path, 'wb') as f:
-            f.write(content)
+        # 按块写入磁盘，不在内存中保留完整上传内容
+        try:
+            file_size = await save_upload(file, file_path, max_bytes)
+        except UploadTooLargeError:
+            raise size_error
         
-        # 使用Excel元信息服务提取并保存元信息
+        # 单遍解析：分块转换为列式存储，同时计算元信息、预览和列统计（在共享CPU线程池中执行）
+        artifact_dir = ColumnarStore.artifact_dir(file_path)
+        try:
+            ingestion = await get_executor_pools().run_cpu(
+                ingest_file, file_path, file.filename, artifact_dir, smart_query_settings.ingest_chunk_rows
+            )
+        except FileEncodingError as e:
+            os.remove(file_path)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+        except ExecutorOverloadedError:
+            os.remove(file_path)
+            raise
+        except Exception as e:
+            os.remove(file_path)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"文件读取失败: {str(e)}"
+            )
+
+        # 保存元信息（包括各sheet列式存储路径），不再重新解析文件
         metadata_service = ExcelMetadataService(db)
         excel_file = metadata_service.save_file_metadata(
             file_path=str(file_path),
             original_filename=file.filename,
             user_id=current_user.id,
-            file_size=file_size
+            file_size=file_size,
+            sheet_artifacts={
+                sheet_name: str(artifact_dir / sheet_info['file'])
+                for sheet_name, sheet_info in ingestion['manifest']['sheets'].items()
+            },
+            metadata=ingestion['metadata']
         )
-        
-        # 为了兼容现有前端，仍然创建pickle文件
+
+        # 生成工作表描述的检索向量（失败不影响上传，提问时再补齐）
         try:
-            if file_extension == '.csv':
-                df = pd.read_csv(file_path, encoding='utf-8')
-            else:
-                df = pd.read_excel(file_path)
-        except UnicodeDecodeError:
-            if file_extension == '.csv':
-                df = pd.read_csv(file_path, encoding='gbk')
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="文件编码错误，请确保文件为UTF-8或GBK编码"
-                )
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"文件读取失败: {str(e)}"
-            )
-        
-        # 保存pickle文件到同一目录
-        pickle_filename = f"{file_id}_{safe_filename}.pkl"
-        pickle_path = excel_user_dir / pickle_filename
-        df.to_pickle(pickle_path)
-        
-        # 数据预处理和分析（保持兼容性）
-        excel_service = ExcelAnalysisService()
-        analysis_result = excel_service.analyze_dataframe(df, file.filename)
+            await get_executor_pools().run_io(metadata_service.index_file_schema, excel_file)
+        except ExecutorOverloadedError:
+            logger.warning(f"I/O线程池繁忙，跳过文件 {excel_file.id} 的检索向量生成")
+
+        # 数据分析结果在解析过程中已增量计算
+        analysis_result = ingestion['analysis']
         
         # 添加数据库文件信息
         analysis_result.update({
             'file_id': str(excel_file.id),
             'database_id': excel_file.id,
-            'temp_file_path': str(pickle_path),  # 更新为新的pickle路径
+            'temp_file_path': str(artifact_dir),  # 列式存储目录
             'original_filename': file.filename,
             'file_size_mb': excel_file.file_size_mb,
             'sheet_names': excel_file.sheet_names,
@@ -172,7 +194,7 @@ async def upload_excel(
             data=analysis_result
         )
         
-    except HTTPException:
+    except (HTTPException, ExecutorOverloadedError):
         raise
     except Exception as e:
         raise HTTPException(
@@ -373,7 +395,6 @@ async def stream_smart_query(
 
             # 初始化服务
             workflow_manager = SmartWorkflowManager(db)
-            conversation_context_service = ConversationContextService()
 
             # 处理对话上下文
             conversation_id = request.conversation_id
@@ -445,13 +466,8 @@ async def stream_smart_query(
             logger.error(f"流式智能查询异常: {e}", exc_info=True)
             yield f"data: {json.dumps({'type': 'error', 'message': f'查询执行失败: {str(e)}'}, ensure_ascii=False)}\n\n"
 
-        finally:
-            # 清理资源
-            if workflow_manager:
-                try:
-                    workflow_manager.excel_workflow.executor.shutdown(wait=False)
-                except:
-                    pass
+    # 共享执行器繁忙时直接返回429，不建立流
+    get_executor_pools().check_admission()
 
     return StreamingResponse(
         generate_stream(),
@@ -496,7 +512,6 @@ async def execute_database_query(
             
             # 初始化服务
             workflow_manager = SmartWorkflowManager(db)
-            conversation_context_service = ConversationContextService()
             
             # 处理对话上下文
             conversation_id = request.conversation_id
@@ -566,15 +581,10 @@ async def execute_database_query(
         except Exception as e:
             logger.error(f"流式数据库查询异常: {e}", exc_info=True)
             yield f"data: {json.dumps({'type': 'error', 'message': f'查询执行失败: {str(e)}'}, ensure_ascii=False)}\n\n"
-        
-        finally:
-            # 清理资源
-            if workflow_manager:
-                try:
-                    workflow_manager.database_workflow.executor.shutdown(wait=False)
-                except:
-                    pass
-    
+
+    # 共享执行器繁忙时直接返回429，不建立流
+    get_executor_pools().check_admission()
+
     return StreamingResponse(
         generate_stream(),
         media_type="text/plain",
@@ -751,4 +761,79 @@ async def get_file_info(
         return QueryResponse(
             success=False,
             message=f"获取文件信息失败: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+
+@router.get("/results/{handle}", response_model=QueryResponse)
+async def get_query_result_page(
+    handle: str,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    current_user = Depends(AuthService.get_current_user)
+):
+    """
+    分页读取服务端保存的查询结果（SSE最终结果中只包含第一页）
+    """
+    result_store = get_result_store()
+    if result_store is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="查询结果存储未启用")
+    try:
+        page = await get_executor_pools().run_io(result_store.page, handle, current_user.id, offset, limit)
+    except ResultNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return QueryResponse(
+        success=True,
+        message="获取查询结果成功",
+        data=page
+    )
+
+
+@router.get("/results/{handle}/arrow")
+async def download_query_result(
+    handle: str,
+    current_user = Depends(AuthService.get_current_user)
+):
+    """
+    以Arrow IPC文件格式下载完整查询结果
+    """
+    result_store = get_result_store()
+    if result_store is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="查询结果存储未启用")
+    try:
+        path = result_store.get_path(handle, current_user.id)
+    except ResultNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return FileResponse(
+        path,
+        media_type="application/vnd.apache.arrow.file",
+        filename=f"query_result_{handle}.arrow"
+    )
+
+
+@router.get("/dataframe-cache/stats", response_model=QueryResponse)
+async def get_dataframe_cache_stats(
+    current_user = Depends(AuthService.get_current_user)
+):
+    """
+    获取DataFrame缓存的命中率和内存指标
+    """
+    return QueryResponse(
+        success=True,
+        message="获取缓存指标成功",
+        data=get_dataframe_cache().get_stats()
+    )
+
+
+@router.get("/code-cache/stats", response_model=QueryResponse)
+async def get_code_cache_stats(
+    current_user = Depends(AuthService.get_current_user)
+):
+    """
+    获取生成代码缓存的命中率指标
+    """
+    code_cache = get_generated_code_cache()
+    return QueryResponse(
+        success=True,
+        message="获取缓存指标成功",
+        data=code_cache.get_stats() if code_cache else {'enabled': False}
+    )
@@ -1,7 +1,7 @@
 """工作流管理API"""
 
 from typing import List, Optional, AsyncGenerator
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
@@ -15,8 +15,10 @@ from ...schemas.workflow import (
 )
 from ...models.workflow import WorkflowStatus as ModelWorkflowStatus
 from ...services.workflow_engine import get_workflow_engine
+from ...services.workflow_runner import get_workflow_runner
 from ...services.auth import AuthService
 from ...models.user import User
+from ...utils.exceptions import ExecutorOverloadedError
 from ...utils.logger import get_logger
 
 logger = get_logger("workflow_api")
@@ -470,6 +472,24 @@ async def get_workflow_execution(
         )
 
 
+def _format_sse_event(event: dict) -> str:
+    """格式化SSE事件，带序号的事件附加id行以支持断线重连"""
+    data = json.dumps(event, ensure_ascii=False)
+    if 'seq' in event:
+        return f"id: {event['seq']}\ndata: {data}\n\n"
+    return f"data: {data}\n\n"
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Content-Type": "text/event-stream",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*",
+    "Access-Control-Allow-Methods": "*"
+}
+
+
 @router.post("/{workflow_id}/execute-stream")
 async def execute_workflow_stream(
     workflow_id: int,
@@ -477,11 +497,13 @@ async def execute_workflow_stream(
     db: Session = Depends(get_db),
     current_user: User = Depends(AuthService.get_current_user)
 ):
-    """流式执行工作流，实时推送节点执行状态"""
+    """流式执行工作流，实时推送节点执行状态
+
+    工作流在后台执行器中运行，客户端断开不会中断执行；
+    可通过 /executions/{execution_id}/events?since=N 重新接入。
+    """
     
     async def generate_stream() -> AsyncGenerator[str, None]:
-        workflow_engine = None
-        
         try:
             from ...models.workflow import Workflow
             
@@ -494,45 +516,95 @@ async def execute_workflow_stream(
             ).first()
             
             if not workflow:
-                yield f"data: {json.dumps({'type': 'error', 'message': '工作流不存在'}, ensure_ascii=False)}\n\n"
+                yield _format_sse_event({'type': 'error', 'message': '工作流不存在'})
                 return
             
             if workflow.status != ModelWorkflowStatus.PUBLISHED:
-                yield f"data: {json.dumps({'type': 'error', 'message': '工作流未激活，无法执行'}, ensure_ascii=False)}\n\n"
+                yield _format_sse_event({'type': 'error', 'message': '工作流未激活，无法执行'})
                 return
             
-            # 发送开始信号
-            yield f"data: {json.dumps({'type': 'workflow_start', 'workflow_id': workflow_id, 'workflow_name': workflow.name, 'timestamp': datetime.now().isoformat()}, ensure_ascii=False)}\n\n"
-            
-            # 获取工作流引擎
-            workflow_engine = get_workflow_engine()
-            
-            # 执行工作流（流式版本）
-            async for step_data in workflow_engine.execute_workflow_stream(
-                workflow=workflow,
+            # 提交到后台执行器
+            runner = get_workflow_runner()
+            execution_id = await runner.submit(
+                workflow_id=workflow.id,
                 input_data=request.input_data,
-                user_id=current_user.id,
-                db=db
-            ):
-                # 推送工作流步骤
-                yield f"data: {json.dumps(step_data, ensure_ascii=False)}\n\n"
+                user_id=current_user.id
+            )
+            
+            async for event in runner.stream_events(execution_id):
+                yield _format_sse_event(event)
             
-            # 发送完成信号
-            yield f"data: {json.dumps({'type': 'workflow_complete', 'message': '工作流执行完成', 'timestamp': datetime.now().isoformat()}, ensure_ascii=False)}\n\n"
+        except ExecutorOverloadedError as e:
+            yield _format_sse_event({'type': 'error', 'message': e.message})
             
         except Exception as e:
             logger.error(f"流式工作流执行异常: {e}", exc_info=True)
-            yield f"data: {json.dumps({'type': 'error', 'message': f'工作流执行失败: {str(e)}'}, ensure_ascii=False)}\n\n"
+            yield _format_sse_event({'type': 'error', 'message': f'工作流执行失败: {str(e)}'})
+    
+    # 后台执行器已满时直接返回429，不建立流
+    get_workflow_runner().check_admission()
+
+    return StreamingResponse(
+        generate_stream(),
+        media_type="text/plain",
+        headers=SSE_HEADERS
+    )
+
+
+@router.get("/executions/{execution_id}/events")
+async def stream_workflow_execution_events(
+    execution_id: int,
+    since: int = Query(0, ge=0, description="只返回序号大于该值的事件"),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(AuthService.get_current_user)
+):
+    """接入（或重新接入）后台工作流执行的事件流"""
+    from ...models.workflow import WorkflowExecution, Workflow
+    
+    execution = db.query(WorkflowExecution).join(
+        Workflow, WorkflowExecution.workflow_id == Workflow.id
+    ).filter(
+        and_(
+            WorkflowExecution.id == execution_id,
+            Workflow.owner_id == current_user.id
+        )
+    ).first()
+    
+    if not execution:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="执行记录不存在"
+        )
+    
+    # 浏览器EventSource重连时通过Last-Event-ID携带最后收到的序号
+    if last_event_id and last_event_id.isdigit():
+        since = max(since, int(last_event_id))
+    
+    runner = get_workflow_runner()
+    buffer = runner.get_buffer(execution_id)
+    
+    async def generate_stream() -> AsyncGenerator[str, None]:
+        if buffer is None:
+            # 事件已过期（或服务重启），只返回数据库中的最终状态
+            yield _format_sse_event({
+                'type': 'workflow_status',
+                'execution_id': execution.id,
+                'status': execution.status.value,
+                'data': {
+                    'output_data': execution.output_data,
+                    'error_message': execution.error_message,
+                    'completed_at': execution.completed_at
+                },
+                'timestamp': datetime.now().isoformat()
+            })
+            return
+        
+        async for event in buffer.subscribe(since):
+            yield _format_sse_event(event)
     
     return StreamingResponse(
         generate_stream(),
         media_type="text/plain",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Content-Type": "text/event-stream",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Allow-Methods": "*"
-        }
-    )
\ No newline at end of file
+        headers=SSE_HEADERS
+    )
@@ -2,7 +2,7 @@
 
 import logging
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.responses import JSONResponse
@@ -14,6 +14,9 @@ from .logging import setup_logging
 from .middleware import UserContextMiddleware
 from ..api.routes import router
 from ..db.database import init_db
+from .executor import init_executor_pools, get_executor_pools, shutdown_executor_pools
+from .simple_permissions import require_super_admin
+from ..utils.exceptions import ExecutorOverloadedError, chat_agent_exception_handler
 from ..api.endpoints import table_metadata
 
 
@@ -24,11 +27,25 @@ async def lifespan(app: FastAPI):
     logging.info("Starting up openAgent application...")
     await init_db()
     logging.info("Database initialized")
+    init_executor_pools()
+    from ..services.code_sandbox import get_code_sandbox
+    code_sandbox = get_code_sandbox()
+    if code_sandbox:
+        code_sandbox.start()
     
     yield
     
     # Shutdown
     logging.info("Shutting down openAgent application...")
+    from ..services.workflow_runner import get_workflow_runner
+    await get_workflow_runner().shutdown()
+    from ..services.code_sandbox import shutdown_code_sandbox
+    shutdown_code_sandbox()
+    from ..services.mcp.datasource_pool import shutdown_datasource_pools
+    shutdown_datasource_pools()
+    from ..services.mcp.mcp_client import shutdown_mcp_client
+    await shutdown_mcp_client()
+    shutdown_executor_pools()
 
 
 def create_app(settings: Settings = None) -> FastAPI:
@@ -71,6 +88,18 @@ def create_app(settings: Settings = None) -> FastAPI:
     async def health_check():
         return {"status": "healthy", "version": settings.app_version}
     
+    # Executor metrics endpoint (super admin only: pool stats include datasource keys and connection errors)
+    @app.get("/health/executors", dependencies=[Depends(require_super_admin)])
+    async def executor_stats():
+        from ..services.code_sandbox import get_code_sandbox
+        from ..services.mcp.datasource_pool import get_datasource_pools
+        stats = get_executor_pools().get_stats()
+        stats['datasource_pools'] = get_datasource_pools().get_stats()
+        code_sandbox = get_code_sandbox()
+        if code_sandbox:
+            stats['sandbox'] = code_sandbox.get_stats()
+        return stats
+    
     # Root endpoint
     @app.get("/")
     async def root():
@@ -110,6 +139,9 @@ def setup_middleware(app: FastAPI, settings: Settings) -> None:
 def setup_exception_handlers(app: FastAPI) -> None:
     """Setup global exception handlers."""
     
+    # 共享执行器队列已满时返回429
+    app.add_exception_handler(ExecutorOverloadedError, chat_agent_exception_handler)
+    
     @app.exception_handler(StarletteHTTPException)
     async def http_exception_handler(request, exc):
         return JSONResponse(
@@ -41,6 +41,16 @@ class ToolSetings(BaseSettings):
     # Tavily搜索配置
     tavily_api_key: Optional[str] = Field(default=None)
     weather_api_key: Optional[str] = Field(default=None)
+    # MCP服务配置
+    mcp_server_url: Optional[str] = Field(default=None)  # 未配置时读取环境变量 MCP_SERVER_URL
+    mcp_timeout_seconds: float = Field(default=30.0)  # 工具调用默认超时
+    mcp_connect_timeout_seconds: float = Field(default=5.0)
+    mcp_tool_timeouts: Dict[str, float] = Field(default_factory=dict)  # 按工具名单独配置的超时
+    mcp_max_retries: int = Field(default=2)  # 连接失败或服务暂时不可用（502/503）时的重试次数
+    mcp_retry_backoff_seconds: float = Field(default=0.5)  # 重试间隔，按次数指数增长
+    mcp_tools_cache_ttl_seconds: float = Field(default=300.0)  # 工具列表缓存时间，过期后按ETag重新验证
+    mcp_max_connections: int = Field(default=20)  # 共享HTTP连接池大小
+    mcp_http2: bool = Field(default=True)  # 安装h2时启用HTTP/2
     model_config = {
         "env_file": ".env",
         "env_file_encoding": "utf-8",
@@ -358,6 +368,104 @@ class ChatSettings(BaseSettings):
     max_response_tokens: int = Field(default=1000)
 
 
+class WorkflowSettings(BaseSettings):
+    """Workflow execution configuration."""
+    max_concurrent_executions: int = Field(default=20)  # 后台同时运行的工作流数量上限，达到上限时新的执行返回429
+    event_buffer_size: int = Field(default=1000)  # 每次执行保留的事件条数（环形缓冲区）
+    event_retention_seconds: int = Field(default=600)  # 执行结束后事件保留时长，供断线重连
+    
+    model_config = {
+        "env_file": ".env",
+        "env_file_encoding": "utf-8",
+        "case_sensitive": False,
+        "extra": "ignore"
+    }
+
+
+class DatasourcePoolSettings(BaseSettings):
+    """Per-datasource connection pool configuration."""
+    max_size: int = Field(default=5)  # 每个数据源的最大连接数
+    checkout_timeout_seconds: float = Field(default=30.0)  # 连接池已满时等待可用连接的时间
+    idle_timeout_seconds: float = Field(default=300.0)  # 空闲超过该时间的连接被关闭
+    max_lifetime_seconds: float = Field(default=3600.0)  # 连接最长存活时间，0表示不限制
+    pre_ping_idle_seconds: float = Field(default=30.0)  # 空闲超过该时间的连接取出前先探活
+    per_user_limit: int = Field(default=3)  # 每个用户同时执行的数据库操作数
+    connect_timeout_seconds: int = Field(default=10)  # 建立连接超时
+    credential_revalidate_seconds: float = Field(default=60.0)  # 缓存的数据源连接信息超过该时间后校验配置版本
+    
+    model_config = {
+        "env_file": ".env",
+        "env_file_encoding": "utf-8",
+        "case_sensitive": False,
+        "extra": "ignore"
+    }
+
+
+class ExecutorSettings(BaseSettings):
+    """Shared executor pool configuration."""
+    cpu_workers: int = Field(default=0)  # CPU密集型（pandas）线程数，0表示按CPU核数
+    cpu_queue_limit: int = Field(default=64)  # CPU池排队上限，超出返回429
+    io_workers: int = Field(default=32)  # 阻塞I/O（数据库、LLM调用、文件读取）线程数
+    io_queue_limit: int = Field(default=256)  # I/O池排队上限，超出返回429
+    db_workers: int = Field(default=16)  # 数据源连接池（MySQL/PostgreSQL驱动）专用线程数
+    db_queue_limit: int = Field(default=128)  # 数据库池排队上限，超出返回429
+    
+    model_config = {
+        "env_file": ".env",
+        "env_file_encoding": "utf-8",
+        "case_sensitive": False,
+        "extra": "ignore"
+    }
+
+
+class SmartQuerySettings(BaseSettings):
+    """Smart query (Excel/database) configuration."""
+    dataframe_cache_max_mb: int = Field(default=1024)  # 进程内DataFrame缓存的内存上限（MB），仅未启用代码沙箱时使用
+    upload_max_mb: int = Field(default=100)  # 上传Excel/CSV文件大小上限（MB）
+    ingest_chunk_rows: int = Field(default=50000)  # 上传文件分块解析的行数
+    prompt_max_columns: int = Field(default=50)  # 提示词中每个数据集最多列出的列数
+    prompt_max_chars: int = Field(default=4000)  # 提示词中每个数据集描述的最大字符数
+    schema_retrieval_enabled: bool = Field(default=True)  # 文件/表较多时先按向量相似度预选候选再交给LLM选择
+    schema_retrieval_top_n: int = Field(default=8)  # 交给LLM选择的候选文件/表数量
+    schema_query_cache_size: int = Field(default=512)  # 问题向量LRU缓存条数
+    code_cache_enabled: bool = Field(default=True)  # 缓存生成的代码，同一用户在相同结构下的重复问题跳过LLM
+    code_cache_max_entries: int = Field(default=1000)
+    code_cache_ttl_seconds: int = Field(default=86400)
+    code_cache_similarity: float = Field(default=1.0)  # 近似问题匹配阈值，1.0表示只匹配归一化后相同的问题
+    result_cache_enabled: bool = Field(default=False)  # 按数据版本缓存执行结果
+    result_cache_max_entries: int = Field(default=200)
+    sql_cache_enabled: bool = Field(default=True)  # 缓存生成的SQL，同一数据源下重复（或仅字面量不同）的问题跳过LLM
+    sql_cache_max_entries: int = Field(default=1000)
+    sql_cache_ttl_seconds: int = Field(default=86400)
+    sql_result_cache_ttl_seconds: int = Field(default=0)  # 按(数据源, SQL)缓存查询结果的时间，0表示不缓存
+    sql_guard_enabled: bool = Field(default=True)  # 执行生成的SQL前检查只读并用EXPLAIN估算代价
+    sql_max_estimated_cost: float = Field(default=1000000)  # EXPLAIN估算总代价上限，0表示不检查
+    sql_max_full_scan_rows: int = Field(default=5000000)  # 单表全表扫描行数上限，0表示不检查
+    sql_guard_max_retries: int = Field(default=2)  # SQL被拒绝后带执行计划重新生成的次数
+    sql_statement_timeout_seconds: int = Field(default=30)  # 查询超时（statement_timeout / MAX_EXECUTION_TIME），0表示不限制
+    result_store_enabled: bool = Field(default=True)  # 查询结果保存在服务端，SSE只返回第一页和结果句柄
+    result_store_dir: str = Field(default="./data/results")
+    result_store_ttl_seconds: int = Field(default=3600)
+    result_page_size: int = Field(default=100)  # SSE中第一页及分页接口默认的行数
+    result_max_page_size: int = Field(default=1000)  # 分页接口单页最大行数
+    sandbox_enabled: bool = Field(default=True)  # 生成的代码在独立进程沙箱中执行
+    sandbox_workers: int = Field(default=2)  # 预热的沙箱工作进程数
+    sandbox_cpu_seconds: int = Field(default=30)  # 单次执行CPU时间上限
+    sandbox_memory_mb: int = Field(default=2048)  # 单个工作进程常驻内存上限（MB，不含内存映射的数据文件）
+    sandbox_timeout_seconds: int = Field(default=60)  # 单次执行墙钟超时
+    sandbox_max_tasks_per_worker: int = Field(default=100)  # 工作进程执行多少次后回收重建
+    context_cache_max_entries: int = Field(default=2000)  # 应用级对话上下文缓存条数（LRU）
+    context_cache_ttl_seconds: int = Field(default=1800)  # 对话上下文缓存时间，过期后从上下文快照重新加载
+    context_history_turns: int = Field(default=10)  # 上下文快照及历史消息默认加载的最近轮数
+    
+    model_config = {
+        "env_file": ".env",
+        "env_file_encoding": "utf-8",
+        "case_sensitive": False,
+        "extra": "ignore"
+    }
+
+
 class Settings(BaseSettings):
     """Main application settings."""
     
@@ -383,6 +491,10 @@ class Settings(BaseSettings):
     cors: CORSSettings = Field(default_factory=CORSSettings)
     chat: ChatSettings = Field(default_factory=ChatSettings)
     tool: ToolSetings = Field(default_factory=ToolSetings)
+    workflow: WorkflowSettings = Field(default_factory=WorkflowSettings)
+    smart_query: SmartQuerySettings = Field(default_factory=SmartQuerySettings)
+    executor: ExecutorSettings = Field(default_factory=ExecutorSettings)
+    datasource_pool: DatasourcePoolSettings = Field(default_factory=DatasourcePoolSettings)
     model_config = {
         "env_file": ".env",
         "env_file_encoding": "utf-8",
@@ -428,6 +540,10 @@ class Settings(BaseSettings):
         settings_kwargs['cors'] = CORSSettings(**(config_data.get('cors', {})))
         settings_kwargs['chat'] = ChatSettings(**(config_data.get('chat', {})))
         settings_kwargs['tool'] = ToolSetings(**(config_data.get('tool', {})))
+        settings_kwargs['workflow'] = WorkflowSettings(**(config_data.get('workflow', {})))
+        settings_kwargs['smart_query'] = SmartQuerySettings(**(config_data.get('smart_query', {})))
+        settings_kwargs['executor'] = ExecutorSettings(**(config_data.get('executor', {})))
+        settings_kwargs['datasource_pool'] = DatasourcePoolSettings(**(config_data.get('datasource_pool', {})))
         
         # 添加顶级配置
         for key, value in config_data.items():
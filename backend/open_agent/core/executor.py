@@ -0,0 +1,194 @@
+"""Application-scoped executor pools."""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, Optional
+
+from .config import get_settings
+from ..utils.exceptions import ExecutorOverloadedError
+from ..utils.logger import get_logger
+
+logger = get_logger("executor")
+
+
+class BoundedPool:
+    """带准入控制的线程池
+
+    同时在执行和排队的任务数超过 ``max_workers + queue_limit`` 时直接拒绝，
+    避免请求在线程池队列里无限堆积。
+    """
+
+    def __init__(self, name: str, max_workers: int, queue_limit: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-pool")
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_seconds = 0.0
+        self._run_seconds = 0.0
+
+    def has_capacity(self) -> bool:
+        """是否还能接收新任务"""
+        with self._lock:
+            return self._active + self._queued < self.max_workers + self.queue_limit
+
+    def check_admission(self) -> None:
+        """队列已满时抛出 ExecutorOverloadedError（对应HTTP 429）"""
+        if not self.has_capacity():
+            with self._lock:
+                self._rejected += 1
+            raise ExecutorOverloadedError(self.name)
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """提交任务（不等待结果），记录排队/执行耗时"""
+        with self._lock:
+            if self._active + self._queued >= self.max_workers + self.queue_limit:
+                self._rejected += 1
+                raise ExecutorOverloadedError(self.name)
+            self._queued += 1
+            self._submitted += 1
+
+        submitted_at = time.monotonic()
+        context = contextvars.copy_context()
+
+        def task():
+            started_at = time.monotonic()
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+                self._wait_seconds += started_at - submitted_at
+            try:
+                return context.run(func, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+                    self._run_seconds += time.monotonic() - started_at
+
+        future = self._executor.submit(task)
+
+        def on_done(f: Future) -> None:
+            # 排队中被取消的任务不会进入task，需要在这里归还排队计数
+            if f.cancelled():
+                with self._lock:
+                    self._queued -= 1
+
+        future.add_done_callback(on_done)
+        return future
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在池中执行阻塞函数并等待结果"""
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """利用率指标"""
+        with self._lock:
+            finished = self._completed or 1
+            return {
+                'max_workers': self.max_workers,
+                'queue_limit': self.queue_limit,
+                'active': self._active,
+                'queued': self._queued,
+                'utilization': round(self._active / self.max_workers, 4),
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'avg_wait_ms': round(self._wait_seconds / finished * 1000, 2),
+                'avg_run_ms': round(self._run_seconds / finished * 1000, 2)
+            }
+
+    def shutdown(self) -> None:
+        """关闭线程池，取消尚未开始的任务"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ExecutorPools:
+    """应用级共享执行器
+
+    - cpu: pandas计算等CPU密集型任务，线程数默认等于CPU核数
+    - io: 数据库查询、LLM调用、文件读取等阻塞I/O任务
+    - db: 用户数据源（MySQL/PostgreSQL）连接池上的驱动调用，与io池隔离，
+      慢查询不会占满其他I/O任务的线程
+    """
+
+    def __init__(self, cpu_workers: int, cpu_queue_limit: int, io_workers: int, io_queue_limit: int,
+                 db_workers: int = 16, db_queue_limit: int = 128):
+        self.cpu = BoundedPool("cpu", cpu_workers or os.cpu_count() or 4, cpu_queue_limit)
+        self.io = BoundedPool("io", io_workers, io_queue_limit)
+        self.db = BoundedPool("db", db_workers, db_queue_limit)
+
+    async def run_cpu(self, func: Callable, *args, **kwargs) -> Any:
+        """在CPU池中执行"""
+        return await self.cpu.run(func, *args, **kwargs)
+
+    async def run_io(self, func: Callable, *args, **kwargs) -> Any:
+        """在I/O池中执行"""
+        return await self.io.run(func, *args, **kwargs)
+
+    async def run_db(self, func: Callable, *args, **kwargs) -> Any:
+        """在数据库池中执行"""
+        return await self.db.run(func, *args, **kwargs)
+
+    def check_admission(self) -> None:
+        """请求进入前检查两个池是否都还有余量"""
+        self.cpu.check_admission()
+        self.io.check_admission()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'cpu': self.cpu.get_stats(),
+            'io': self.io.get_stats(),
+            'db': self.db.get_stats()
+        }
+
+    def shutdown(self) -> None:
+        self.cpu.shutdown()
+        self.io.shutdown()
+        self.db.shutdown()
+
+
+# 全局实例
+_executor_pools: Optional[ExecutorPools] = None
+
+
+def init_executor_pools() -> ExecutorPools:
+    """创建共享执行器（应用启动时调用）"""
+    global _executor_pools
+    if _executor_pools is None:
+        executor_settings = get_settings().executor
+        _executor_pools = ExecutorPools(
+            cpu_workers=executor_settings.cpu_workers,
+            cpu_queue_limit=executor_settings.cpu_queue_limit,
+            io_workers=executor_settings.io_workers,
+            io_queue_limit=executor_settings.io_queue_limit,
+            db_workers=executor_settings.db_workers,
+            db_queue_limit=executor_settings.db_queue_limit
+        )
+        logger.info(
+            f"共享执行器已创建: cpu={_executor_pools.cpu.max_workers}, io={_executor_pools.io.max_workers}, "
+            f"db={_executor_pools.db.max_workers}"
+        )
+    return _executor_pools
+
+
+def get_executor_pools() -> ExecutorPools:
+    """获取共享执行器实例"""
+    return _executor_pools or init_executor_pools()
+
+
+def shutdown_executor_pools() -> None:
+    """关闭共享执行器（应用关闭时调用）"""
+    global _executor_pools
+    if _executor_pools is not None:
+        _executor_pools.shutdown()
+        _executor_pools = None
+        logger.info("共享执行器已关闭")
@@ -8,7 +8,7 @@ from .agent_config import AgentConfig
 from .excel_file import ExcelFile
 from .permission import Role, UserRole
 from .llm_config import LLMConfig
-from .workflow import Workflow, WorkflowExecution, NodeExecution
+from .workflow import Workflow, WorkflowExecution, NodeExecution, NodeResultCache
 
 __all__ = [
     "User",
@@ -23,5 +23,6 @@ __all__ = [
     "LLMConfig",
     "Workflow",
     "WorkflowExecution",
-    "NodeExecution"
+    "NodeExecution",
+    "NodeResultCache"
 ]
\ No newline at end of file
@@ -1,6 +1,6 @@
 """Conversation model."""
 
-from sqlalchemy import Column, String, Integer, ForeignKey, Text, Boolean
+from sqlalchemy import Column, String, Integer, ForeignKey, Text, Boolean, JSON
 from sqlalchemy.orm import relationship
 
 from ..db.base import BaseModel
@@ -19,6 +19,7 @@ class Conversation(BaseModel):
     temperature = Column(String(10), nullable=False, default="0.7")
     max_tokens = Column(Integer, nullable=False, default=2048)
     is_archived = Column(Boolean, default=False, nullable=False)
+    context_snapshot = Column(JSON, nullable=True)  # Smart query context: file_list, selected_files, recent query_history
     
     # Relationships removed to eliminate foreign key constraints
     
@@ -1,6 +1,6 @@
 """Excel file models for smart query."""
 
-from sqlalchemy import Column, String, Integer, Text, Boolean, JSON, DateTime
+from sqlalchemy import Column, String, Integer, Text, Boolean, JSON, DateTime, Index
 from sqlalchemy.sql import func
 
 from ..db.base import BaseModel
@@ -10,7 +10,9 @@ class ExcelFile(BaseModel):
     """Excel file model for storing file metadata."""
     
     __tablename__ = "excel_files"
-    
+    __table_args__ = (
+        Index('ix_excel_files_created_by_original_filename', 'created_by', 'original_filename'),
+    )
 
     
     # Basic file information
@@ -33,6 +35,12 @@ class ExcelFile(BaseModel):
     total_rows = Column(JSON, nullable=True)  # 每个sheet的总行数：{sheet_name: row_count}
     total_columns = Column(JSON, nullable=True)  # 每个sheet的总列数：{sheet_name: column_count}
     
+    # Columnar artifacts
+    sheet_artifacts = Column(JSON, nullable=True)  # 每个sheet的列式存储文件路径：{sheet_name: path}
+    
+    # Schema retrieval
+    schema_embedding = Column(JSON, nullable=True)  # 每个sheet描述的向量：{model, vectors: {sheet_name: {hash, vector}}}
+    
     # Processing status
     is_processed = Column(Boolean, default=True, nullable=False)  # 是否已处理
     processing_error = Column(Text, nullable=True)  # 处理错误信息
@@ -25,12 +25,14 @@ class TableMetadata(BaseModel):
     
     # 示例数据
     sample_data = Column(JSON, nullable=True)    # 前5条示例数据
-    row_count = Column(Integer, default=0)       # 总行数
+    row_count = Column(Integer, default=0)       # 总行数（数据库统计信息估算值）
+    schema_hash = Column(String(64), nullable=True)  # 表结构版本哈希，结构未变化时重新收集不再读取示例数据
     
     # 问答相关
     is_enabled_for_qa = Column(Boolean, default=True)  # 是否启用问答
     qa_description = Column(Text, nullable=True)       # 问答描述
     business_context = Column(Text, nullable=True)     # 业务上下文
+    schema_embedding = Column(JSON, nullable=True)     # 表描述向量：{model, vectors: {table_name: {hash, vector}}}
 
     last_synced_at = Column(DateTime(timezone=True), nullable=True)  # 最后同步时间
     
@@ -1,6 +1,6 @@
 """Workflow models."""
 
-from sqlalchemy import Column, String, Text, Boolean, Integer, JSON, ForeignKey, Enum
+from sqlalchemy import Column, String, Text, Boolean, Integer, JSON, ForeignKey, Enum, DateTime
 from sqlalchemy.orm import relationship
 from typing import Dict, Any, Optional, List
 import enum
@@ -25,6 +25,7 @@ class NodeType(enum.Enum):
     CODE = "code"            # 代码执行节点
     HTTP = "http"            # HTTP请求节点
     TOOL = "tool"            # 工具节点
+    MAP = "map"              # 列表映射节点（对每个元素执行子图）
 
 
 class ExecutionStatus(enum.Enum):
@@ -172,4 +173,19 @@ class NodeExecution(BaseModel):
             'error_message': self.error_message
         })
         
-        return data
\ No newline at end of file
+        return data
+
+
+class NodeResultCache(BaseModel):
+    """节点执行结果缓存（按节点配置、输入和模型版本记忆化）"""
+    
+    __tablename__ = "node_result_cache"
+    
+    cache_key = Column(String(64), nullable=False, unique=True, index=True, comment="缓存键(SHA256)")
+    node_type = Column(String(20), nullable=False, comment="节点类型")
+    output_data = Column(JSON, nullable=True, comment="节点输出")
+    expires_at = Column(DateTime, nullable=False, index=True, comment="过期时间")
+    hit_count = Column(Integer, default=0, nullable=False, comment="命中次数")
+    
+    def __repr__(self):
+        return f"<NodeResultCache(id={self.id}, node_type='{self.node_type}', expires_at='{self.expires_at}')>"
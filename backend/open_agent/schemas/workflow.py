@@ -23,6 +23,7 @@ class NodeType(str, Enum):
     CODE = "code"
     HTTP = "http"
     TOOL = "tool"
+    MAP = "map"
 
 
 class ExecutionStatus(str, Enum):
@@ -83,6 +84,7 @@ class LLMNodeConfig(NodeConfig):
     max_tokens: Optional[int] = Field(default=None, gt=0)
     prompt: str = Field(..., min_length=1)
     enable_variable_substitution: bool = True  # 是否启用变量替换
+    early_stop_pattern: Optional[str] = None  # 正则表达式，流式输出匹配后提前结束生成（如分类标签）
 
 
 class ConditionNodeConfig(NodeConfig):
@@ -98,6 +100,15 @@ class LoopNodeConfig(NodeConfig):
     iterable: Optional[str] = Field(None, description="可迭代对象（当loop_type为foreach时）")
 
 
+class MapNodeConfig(NodeConfig):
+    """Map节点配置"""
+    items_variable: Optional[str] = Field(None, description="列表来源变量，如 node_id.field")
+    node: Optional[Dict[str, Any]] = Field(None, description="对每个元素执行的单个节点定义")
+    sub_workflow: Optional[Dict[str, Any]] = Field(None, description="对每个元素执行的子图定义（nodes/connections）")
+    concurrency: int = Field(default=5, ge=1, le=100)
+    failure_policy: str = Field(default="fail_fast", pattern="^(fail_fast|continue|skip)$")
+
+
 class CodeNodeConfig(NodeConfig):
     """代码执行节点配置"""
     language: str = Field(..., pattern="^(python|javascript)$")
@@ -125,7 +136,7 @@ class WorkflowNode(BaseModel):
     name: str
     description: Optional[str] = None
     position: NodePosition
-    config: Optional[Dict[str, Any]] = None
+    config: Optional[Dict[str, Any]] = None  # 可包含 cache_enabled / cache_ttl_seconds 开启结果缓存
     parameters: Optional[NodeInputOutput] = None  # 节点输入输出参数定义
 
 
@@ -51,7 +51,7 @@ class ToolParameter:
 class ToolResult(BaseModel):
     """Tool execution result."""
     success: bool = Field(description="Whether the tool execution was successful")
-    result: Any = Field(description="The result data")
+    result: Any = Field(default=None, description="The result data")
     error: Optional[str] = Field(default=None, description="Error message if failed")
     metadata: Optional[Dict[str, Any]] = Field(default=None, description="Additional metadata")
 
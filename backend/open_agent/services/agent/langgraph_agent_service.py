@@ -1,7 +1,7 @@
 """LangGraph Agent service with tool calling capabilities."""
 
 import asyncio
-from typing import List, Dict, Any, Optional, AsyncGenerator
+from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.tools import tool
 from langchain.chat_models import init_chat_model
@@ -14,10 +14,13 @@ from ..postgresql_tool_manager import get_postgresql_tool
 from ...core.config import get_settings
 from ...utils.logger import get_logger
 from ..agent_config import AgentConfigService
-from open_agent.services.mcp.mcp_dynamic_tools import load_mcp_tools
+from open_agent.services.mcp.mcp_dynamic_tools import aload_mcp_tools
 
 logger = get_logger("langgraph_agent_service")
 
+# 模型请求了未注册的工具（不用异常类型区分，避免与工具自身抛出的异常混淆）
+_UNKNOWN_TOOL = object()
+
 
 
 class LangGraphAgentConfig(BaseModel):
@@ -57,13 +60,12 @@ class LangGraphAgentService:
         self._create_react_agent()
         
     def _initialize_tools(self):
-        """Initialize available tools."""
-        try:
-            dynamic_tools = load_mcp_tools()
-        except Exception as e:
-            logger.warning(f"加载 MCP 动态工具失败，使用本地工具回退: {e}")
-            dynamic_tools = []
+        """Initialize local tools; MCP tools are loaded asynchronously on the first request."""
+        self._mcp_tool_names: Optional[List[str]] = None
+        self._apply_tools([])
 
+    def _apply_tools(self, dynamic_tools: List[Any]) -> None:
+        """Use MCP dynamic tools when available, otherwise fall back to local tools."""
         # Always keep DateTimeTool locally
         base_tools = [DateTimeTool()]
 
@@ -78,8 +80,26 @@ class LangGraphAgentService:
             ] + base_tools
             logger.info("MCP 不可用，已回退到本地 Weather/Search 工具")
 
+    async def _refresh_tools(self) -> None:
+        """Load MCP tools on the async client (list is cached by the client) and rebind when they change."""
+        try:
+            dynamic_tools = await aload_mcp_tools()
+        except Exception as e:
+            logger.warning(f"加载 MCP 动态工具失败，使用本地工具回退: {e}")
+            dynamic_tools = []
+
+        names = [t.name for t in dynamic_tools]
+        if names == self._mcp_tool_names:
+            return
+        self._mcp_tool_names = names
+        self._apply_tools(dynamic_tools)
+        if getattr(self, "model", None) is not None:
+            try:
+                self.bound_model = self.model.bind_tools(self.tools)
+            except Exception as e:
+                logger.warning(f"Failed to bind tools to model, tool calling may not work: {e}")
+                self.bound_model = self.model
 
-            
     def _load_config(self):
         """Load configuration from database if available."""
         if self.config_service:
@@ -129,34 +149,34 @@ class LangGraphAgentService:
                 messages: Annotated[List[BaseMessage], add_messages]
 
             # Node: call the model
-            def agent_node(state: AgentState) -> AgentState:
+            async def agent_node(state: AgentState) -> AgentState:
                 messages = state["messages"]
                 # Optionally include a system instruction at the start for first turn
                 if messages and messages[0].__class__.__name__ != 'SystemMessage':
                     # Keep user history untouched; rely on upstream to include system if desired
                     pass
-                ai = self.bound_model.invoke(messages)
+                ai = await self.bound_model.ainvoke(messages)
                 return {"messages": [ai]}
 
-            # Node: execute tools requested by the last AI message
-            def tools_node(state: AgentState) -> AgentState:
+            # Node: execute tools requested by the last AI message (concurrently)
+            async def tools_node(state: AgentState) -> AgentState:
                 messages = state["messages"]
                 last = messages[-1]
                 outputs: List[ToolMessage] = []
                 try:
                     tool_calls = getattr(last, 'tool_calls', []) or []
-                    tool_map = {t.name: t for t in self.tools}
+                    calls = []
                     for call in tool_calls:
                         name = call.get('name') if isinstance(call, dict) else getattr(call, 'name', None)
                         args = call.get('args') if isinstance(call, dict) else getattr(call, 'args', {})
                         call_id = call.get('id') if isinstance(call, dict) else getattr(call, 'id', '')
-                        if name in tool_map:
-                            try:
-                                result = tool_map[name].invoke(args)
-                            except Exception as te:
-                                result = f"Tool {name} execution error: {te}"
-                        else:
+                        calls.append((name, args, call_id))
+                    results = await self._invoke_tool_calls([(name, args) for name, args, _ in calls])
+                    for (name, _, call_id), result in zip(calls, results):
+                        if result is _UNKNOWN_TOOL:
                             result = f"Unknown tool: {name}"
+                        elif isinstance(result, Exception):
+                            result = f"Tool {name} execution error: {result}"
                         outputs.append(ToolMessage(content=str(result), tool_call_id=call_id))
                 except Exception as e:
                     outputs.append(ToolMessage(content=f"Tool execution error: {e}", tool_call_id=""))
@@ -199,6 +219,22 @@ class LangGraphAgentService:
             
 
         
+    async def _invoke_tool_calls(self, calls: List[Tuple[str, Dict[str, Any]]]) -> List[Any]:
+        """并行执行模型同一轮提出的多个工具调用
+
+        MCP工具通过共享的异步HTTP客户端调用，不阻塞事件循环；本地工具由LangChain放到线程中执行。
+        按调用顺序返回结果，失败的调用返回异常对象，未知工具返回 _UNKNOWN_TOOL。
+        """
+        tool_map = {t.name: t for t in self.tools}
+
+        async def invoke(name: str, args: Dict[str, Any]) -> Any:
+            tool_obj = tool_map.get(name)
+            if tool_obj is None:
+                return _UNKNOWN_TOOL
+            return await tool_obj.ainvoke(args)
+
+        return await asyncio.gather(*(invoke(name, args) for name, args in calls), return_exceptions=True)
+
     def _format_tools_info(self) -> str:
         """Format tools information for the prompt."""
         tools_info = []
@@ -222,6 +258,7 @@ class LangGraphAgentService:
         """Process a chat message using LangGraph."""
         try:
             logger.info(f"Starting chat with message: {message[:100]}...")
+            await self._refresh_tools()
             
             # Convert chat history to messages
             messages = []
@@ -268,6 +305,7 @@ class LangGraphAgentService:
         """Process a chat message using LangGraph with streaming."""
         try:
             logger.info(f"Starting streaming chat with message: {message[:100]}...")
+            await self._refresh_tools()
 
             # Convert chat history to messages
             messages = []
@@ -505,14 +543,14 @@ class LangGraphAgentService:
             current_step: int
             step_results: List[str]
 
-        def planner_node(state: PlanState) -> PlanState:
+        async def planner_node(state: PlanState) -> PlanState:
             messages = state.get("messages", [])
             plan_prompt = (
                 "你是规划助手。基于对话内容生成可执行计划，" 
                 "用 JSON 数组返回，每个元素是一条明确且可操作的步骤。" 
                 "仅输出 JSON，不要额外解释。"
             )
-            ai_plan = self.model.invoke(messages + [HumanMessage(content=plan_prompt)])
+            ai_plan = await self.model.ainvoke(messages + [HumanMessage(content=plan_prompt)])
             steps: List[str] = []
             try:
                 parsed = json.loads(ai_plan.content)
@@ -528,7 +566,7 @@ class LangGraphAgentService:
                 "step_results": []
             }
 
-        def executor_node(state: PlanState) -> PlanState:
+        async def executor_node(state: PlanState) -> PlanState:
             idx = state.get("current_step", 0)
             steps = state.get("plan_steps", [])
             msgs = state.get("messages", [])
@@ -540,33 +578,28 @@ class LangGraphAgentService:
                 f"请执行计划的第{idx+1}步：{step_text}。" 
                 "需要用工具时创建工具调用；完成后给出该步的结果。"
             )
-            ai_exec = self.bound_model.invoke(msgs + [HumanMessage(content=exec_prompt)])
+            ai_exec = await self.bound_model.ainvoke(msgs + [HumanMessage(content=exec_prompt)])
 
             new_messages: List[BaseMessage] = [ai_exec]
             step_result_content = None
 
-            # 处理工具调用
-            tool_map = {t.name: t for t in self.tools}
+            # 处理工具调用（同一步的多个工具调用并行执行）
             tool_msgs: List[ToolMessage] = []
             tool_calls = getattr(ai_exec, "tool_calls", []) or (ai_exec.additional_kwargs.get("tool_calls") if hasattr(ai_exec, "additional_kwargs") else [])
             if tool_calls:
-                for call in tool_calls:
+                results = await self._invoke_tool_calls([(call.get("name"), call.get("args", {})) for call in tool_calls])
+                for call, result in zip(tool_calls, results):
                     name = call.get("name")
-                    args = call.get("args", {})
-                    tool_obj = tool_map.get(name)
-                    if tool_obj:
-                        try:
-                            result = tool_obj.invoke(args)
-                        except Exception as e:
-                            result = f"工具执行失败: {e}"
-                    else:
+                    if result is _UNKNOWN_TOOL:
                         result = f"未找到工具: {name}"
+                    elif isinstance(result, Exception):
+                        result = f"工具执行失败: {result}"
                     tool_call_id = call.get("id") or call.get("tool_call_id") or call.get("call_id") or f"tool_{name}"
                     tool_msgs.append(ToolMessage(content=str(result), tool_call_id=tool_call_id, name=name or "tool"))
                 new_messages.extend(tool_msgs)
                 # 基于工具输出总结该步结果
                 summarize_step = "请基于上述工具输出，总结该步骤的结果，给出结构化要点与可读说明。"
-                ai_step = self.bound_model.invoke(msgs + [ai_exec] + tool_msgs + [HumanMessage(content=summarize_step)])
+                ai_step = await self.bound_model.ainvoke(msgs + [ai_exec] + tool_msgs + [HumanMessage(content=summarize_step)])
                 step_result_content = ai_step.content
                 new_messages.append(ai_step)
             else:
@@ -590,7 +623,7 @@ class LangGraphAgentService:
             total = len(state.get("plan_steps", []))
             return "executor" if cur < total else "summarize"
 
-        def summarize_node(state: PlanState) -> PlanState:
+        async def summarize_node(state: PlanState) -> PlanState:
             import json as _json
             msgs = state.get("messages", [])
             steps = state.get("plan_steps", [])
@@ -604,7 +637,7 @@ class LangGraphAgentService:
                 f"步骤结果: {_json.dumps(results, ensure_ascii=False)}\n"
                 f"{final_prompt}"
             ))
-            ai_final = self.model.invoke(msgs + [context_msg])
+            ai_final = await self.model.ainvoke(msgs + [context_msg])
             return {"messages": [ai_final]}
 
         graph = StateGraph(PlanState)
@@ -659,6 +692,7 @@ class LangGraphAgentService:
     async def chat_stream_plan_execute(self, message: str, chat_history: Optional[List[Dict[str, str]]] = None) -> AsyncGenerator[Dict[str, Any], None]:
         """Streamed Plan-and-Execute chat."""
         import asyncio as _asyncio
+        await self._refresh_tools()
         if not hasattr(self, "plan_execute_agent"):
             self._create_plan_execute_agent()
 
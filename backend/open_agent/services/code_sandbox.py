@@ -0,0 +1,308 @@
+"""Multi-process sandbox for LLM-generated pandas code."""
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Set
+
+import pandas as pd
+
+from ..core.config import get_settings
+from ..core.executor import get_executor_pools
+from ..utils.exceptions import ExecutorOverloadedError
+from ..utils.logger import get_logger
+from .code_sandbox_worker import worker_main, decode_result
+from .columnar_store import ColumnarStore
+
+logger = get_logger("code_sandbox")
+
+
+class CodeSandboxError(Exception):
+    """沙箱执行失败（超时、CPU/内存超限、工作进程异常退出）"""
+    pass
+
+
+# 执行期间检查工作进程内存的间隔（秒）
+MEMORY_POLL_SECONDS = 0.2
+# I/O线程池已满时重试补充工作进程的间隔（秒）
+RESPAWN_RETRY_SECONDS = 1.0
+
+
+class SandboxWorker:
+    """单个沙箱工作进程"""
+
+    def __init__(self, context, memory_mb: int):
+        self.memory_mb = memory_mb
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main,
+            args=(child_conn,),
+            name="code-sandbox",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks_done = 0
+
+    def call(self, task: Dict[str, Any], timeout: float):
+        """发送任务并等待结果（阻塞，在I/O线程池中调用），等待期间按常驻内存检查内存上限"""
+        self.conn.send(('run', task))
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise CodeSandboxError(f"代码执行超时（{timeout}秒）")
+            if not self.conn.poll(min(remaining, MEMORY_POLL_SECONDS)):
+                if self.memory_exceeded():
+                    raise CodeSandboxError("代码执行内存超过限制")
+                continue
+            message = self.conn.recv()
+            # 跳过进程启动完成时发送的就绪消息
+            if message[0] != 'ready':
+                return message
+
+    def rss_mb(self) -> float:
+        """工作进程常驻内存（MB），不含内存映射Arrow文件的页（可由内核回收的文件页）"""
+        rss = anon = None
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss = int(line.split()[1]) / 1024
+                    elif line.startswith("RssAnon:"):
+                        anon = int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return anon if anon is not None else (rss or 0.0)
+
+    def memory_exceeded(self) -> bool:
+        return self.memory_mb > 0 and self.rss_mb() >= self.memory_mb
+
+    def kill(self) -> None:
+        """立即结束工作进程（超时、超限或需要回收时）"""
+        self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+    def stop(self) -> None:
+        """停止工作进程"""
+        try:
+            self.conn.send(('stop',))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=1)
+        self.conn.close()
+
+
+class CodeSandbox:
+    """生成代码的多进程沙箱
+
+    预先启动若干已导入pandas/numpy/pyarrow的工作进程；数据集以Arrow文件路径传递，
+    由工作进程内存映射读取（不经过进程间拷贝）。每个任务限制CPU时间，父进程在执行期间轮询工作进程的
+    常驻内存，超时、超限或异常退出的进程会被回收并补充新进程，结果以Arrow record batch返回。
+    """
+
+    def __init__(self, workers: int, cpu_seconds: int, memory_mb: int,
+                 timeout_seconds: int, max_tasks_per_worker: int):
+        self.workers = workers
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.timeout_seconds = timeout_seconds
+        self.max_tasks_per_worker = max_tasks_per_worker
+        # spawn: 工作进程不继承API进程的线程、连接和锁
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: Optional[asyncio.Queue] = None
+        self._all: List[SandboxWorker] = []
+        self._respawning: Set[asyncio.Task] = set()
+        self.frame_files = FrameFileCache()
+
+    def start(self) -> None:
+        """启动并预热工作进程"""
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        for _ in range(self.workers):
+            self._idle.put_nowait(self._spawn())
+        logger.info(f"代码沙箱已启动 {self.workers} 个工作进程")
+
+    def _spawn(self) -> SandboxWorker:
+        worker = SandboxWorker(self._context, self.memory_mb)
+        self._all.append(worker)
+        return worker
+
+    def _retire(self, worker: SandboxWorker) -> None:
+        """回收工作进程，结束进程和补充新进程在后台进行，不阻塞事件循环和当前请求"""
+        if worker in self._all:
+            self._all.remove(worker)
+        task = asyncio.create_task(self._respawn(worker))
+        self._respawning.add(task)
+        task.add_done_callback(self._respawning.discard)
+
+    def _replace(self, worker: SandboxWorker) -> SandboxWorker:
+        """结束工作进程并启动替代进程（阻塞，在I/O线程池中调用）"""
+        worker.kill()
+        return SandboxWorker(self._context, self.memory_mb)
+
+    async def _respawn(self, worker: SandboxWorker) -> None:
+        """在I/O线程池中替换工作进程，完成后放回空闲队列"""
+        idle = self._idle
+        while True:
+            try:
+                replacement = await get_executor_pools().run_io(self._replace, worker)
+                break
+            except ExecutorOverloadedError:
+                await asyncio.sleep(RESPAWN_RETRY_SECONDS)
+            except Exception as e:
+                logger.error(f"补充沙箱工作进程失败: {e}")
+                return
+        if self._idle is not idle:
+            # 补充期间沙箱已关闭
+            await get_executor_pools().run_io(replacement.stop)
+            return
+        self._all.append(replacement)
+        idle.put_nowait(replacement)
+
+    async def run(self, code: str, datasets: Dict[str, Dict[str, Any]]) -> Any:
+        """在沙箱中执行代码
+
+        Args:
+            code: 生成的Python代码
+            datasets: 变量名到 {'path': Arrow文件路径, 'columns': 列或None} 的映射
+
+        Returns:
+            代码结果（DataFrame、Series、标量或文本），语义与PythonAstREPLTool一致
+        """
+        self.start()
+        worker = await self._idle.get()
+        task = {'code': code, 'datasets': datasets, 'cpu_seconds': self.cpu_seconds}
+
+        healthy = False
+        try:
+            message = await get_executor_pools().run_io(worker.call, task, self.timeout_seconds)
+            worker.tasks_done += 1
+            if message[0] == 'error':
+                raise CodeSandboxError(message[1])
+            healthy = True
+            return decode_result(message[1])
+        except (EOFError, OSError) as e:
+            raise CodeSandboxError(f"沙箱工作进程异常退出: {e}")
+        finally:
+            if (healthy and worker.process.is_alive()
+                    and worker.tasks_done < self.max_tasks_per_worker
+                    and not worker.memory_exceeded()):
+                self._idle.put_nowait(worker)
+            else:
+                self._retire(worker)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'workers': len(self._all),
+            'idle': self._idle.qsize() if self._idle is not None else 0,
+            'rss_mb': {worker.process.pid: round(worker.rss_mb(), 1) for worker in self._all}
+        }
+
+    def shutdown(self) -> None:
+        """停止全部工作进程"""
+        for task in list(self._respawning):
+            task.cancel()
+        for worker in self._all:
+            worker.stop()
+        self._all.clear()
+        self._idle = None
+        self.frame_files.clear()
+
+
+class FrameFileCache:
+    """旧版内存数据集（pickle或原始文件）转换出的Arrow文件
+
+    沙箱只接收Arrow文件路径，没有列式存储的旧文件按 (源文件, 修改时间) 转换一次后复用，
+    不在每次查询时重写；按文件数LRU淘汰。
+    """
+
+    def __init__(self, max_files: int = 32):
+        self.max_files = max_files
+        self._directory: Optional[str] = None
+        self._paths: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_write(self, key: Hashable, df: pd.DataFrame) -> str:
+        """返回数据对应的Arrow文件路径，不存在时写入（阻塞，在CPU线程池中调用）"""
+        with self._lock:
+            path = self._paths.get(key)
+            if path is not None and os.path.exists(path):
+                self._paths.move_to_end(key)
+                return path
+            if self._directory is None:
+                self._directory = tempfile.mkdtemp(prefix="code-sandbox-")
+            directory = self._directory
+
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        os.close(fd)
+        try:
+            ColumnarStore.write_frame(df, temp_path)
+            path = os.path.join(directory, hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".arrow")
+            # 并发写入同一数据时原子替换，读到的总是完整文件
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            self._paths[key] = path
+            self._paths.move_to_end(key)
+            while len(self._paths) > self.max_files:
+                _, evicted = self._paths.popitem(last=False)
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+        return path
+
+    def clear(self) -> None:
+        """删除全部转换文件"""
+        with self._lock:
+            self._paths.clear()
+            directory, self._directory = self._directory, None
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+# 全局实例
+_code_sandbox: Optional[CodeSandbox] = None
+
+
+def get_code_sandbox() -> Optional[CodeSandbox]:
+    """获取代码沙箱实例，未启用时返回None"""
+    global _code_sandbox
+    if _code_sandbox is None:
+        smart_query_settings = get_settings().smart_query
+        if not smart_query_settings.sandbox_enabled:
+            return None
+        _code_sandbox = CodeSandbox(
+            workers=smart_query_settings.sandbox_workers,
+            cpu_seconds=smart_query_settings.sandbox_cpu_seconds,
+            memory_mb=smart_query_settings.sandbox_memory_mb,
+            timeout_seconds=smart_query_settings.sandbox_timeout_seconds,
+            max_tasks_per_worker=smart_query_settings.sandbox_max_tasks_per_worker
+        )
+    return _code_sandbox
+
+
+def shutdown_code_sandbox() -> None:
+    """关闭代码沙箱（应用关闭时调用）"""
+    global _code_sandbox
+    if _code_sandbox is not None:
+        _code_sandbox.shutdown()
+        _code_sandbox = None
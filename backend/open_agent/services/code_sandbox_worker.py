@@ -0,0 +1,171 @@
+"""Worker process for the generated-code sandbox.
+
+进程以spawn方式启动，按模块路径 open_agent.services.code_sandbox_worker 导入本模块，
+因此会执行 open_agent 和 open_agent.services 两个包的 __init__（两者都不导入其他模块）；
+本模块只依赖标准库与pandas/numpy/pyarrow，不加载应用配置和数据库。
+"""
+
+import ast
+import os
+import re
+import resource
+import signal
+from contextlib import redirect_stdout
+from io import StringIO
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+# 返回给父进程的结果类型
+RESULT_DATAFRAME = "dataframe"
+RESULT_SERIES = "series"
+RESULT_VALUE = "value"
+
+SERIES_COLUMN = "__series__"
+
+
+class CpuTimeExceeded(Exception):
+    """单次任务CPU时间超限"""
+    pass
+
+
+def _on_cpu_limit(signum, frame):
+    raise CpuTimeExceeded("代码执行CPU时间超过限制")
+
+
+def _set_cpu_budget(cpu_seconds: int) -> None:
+    """按本次任务设置CPU时间软限制（累计用量 + 预算），超限时收到SIGXCPU"""
+    soft = resource.RLIM_INFINITY
+    if cpu_seconds > 0:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, resource.RLIM_INFINITY))
+
+
+def _read_frame(path: str, columns: Optional[List[str]]) -> pd.DataFrame:
+    """内存映射读取Arrow文件的指定列，字典编码列还原为普通字符串"""
+    table = ipc.open_file(pa.memory_map(path, "r")).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    for index, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            decoded = pa.chunked_array(
+                [chunk.dictionary_decode() for chunk in table.column(index).chunks],
+                type=field.type.value_type
+            )
+            table = table.set_column(index, field.name, decoded)
+    return table.to_pandas()
+
+
+def _sanitize(code: str) -> str:
+    """去掉代码前后的markdown围栏和python标记（与PythonAstREPLTool一致）"""
+    code = re.sub(r"^(\s|`)*(?i:python)?\s*", "", code)
+    return re.sub(r"(\s|`)*$", "", code)
+
+
+def _execute(code: str, local_vars: Dict[str, Any]) -> Any:
+    """执行代码：除最后一句外exec，最后一句eval，返回值为None时返回标准输出"""
+    tree = ast.parse(_sanitize(code))
+    global_vars: Dict[str, Any] = {}
+    exec(ast.unparse(ast.Module(tree.body[:-1], type_ignores=[])), global_vars, local_vars)
+    last = ast.unparse(ast.Module(tree.body[-1:], type_ignores=[]))
+    io_buffer = StringIO()
+    try:
+        with redirect_stdout(io_buffer):
+            ret = eval(last, global_vars, local_vars)
+            return io_buffer.getvalue() if ret is None else ret
+    except Exception:
+        with redirect_stdout(io_buffer):
+            exec(last, global_vars, local_vars)
+        return io_buffer.getvalue()
+
+
+def _to_ipc_bytes(df: pd.DataFrame) -> bytes:
+    """DataFrame序列化为Arrow IPC流（record batches）"""
+    try:
+        table = pa.Table.from_pandas(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+        # 混合类型列转为字符串后再序列化
+        df = df.copy()
+        df.columns = [str(col) for col in df.columns]
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].map(lambda v: None if v is None else str(v))
+        table = pa.Table.from_pandas(df)
+    sink = pa.BufferOutputStream()
+    with ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _encode_result(result: Any) -> Dict[str, Any]:
+    """将执行结果编码为可跨进程传输的结构"""
+    if isinstance(result, pd.DataFrame):
+        return {'kind': RESULT_DATAFRAME, 'data': _to_ipc_bytes(result)}
+    if isinstance(result, pd.Series):
+        return {
+            'kind': RESULT_SERIES,
+            'name': result.name if isinstance(result.name, (str, int, float)) else None,
+            'data': _to_ipc_bytes(result.to_frame(SERIES_COLUMN))
+        }
+    if isinstance(result, np.generic):
+        result = result.item()
+    if not isinstance(result, (str, int, float, bool, type(None))):
+        result = str(result)
+    return {'kind': RESULT_VALUE, 'data': result}
+
+
+def decode_result(payload: Dict[str, Any]) -> Any:
+    """父进程中还原执行结果"""
+    if payload['kind'] == RESULT_VALUE:
+        return payload['data']
+    df = ipc.open_stream(pa.py_buffer(payload['data'])).read_all().to_pandas()
+    if payload['kind'] == RESULT_SERIES:
+        series = df[SERIES_COLUMN]
+        series.name = payload.get('name')
+        return series
+    return df
+
+
+def worker_main(conn) -> None:
+    """沙箱工作进程主循环（内存由父进程按常驻内存监控，超限时结束进程）"""
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    conn.send(('ready', os.getpid()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message[0] == 'stop':
+            break
+
+        task = message[1]
+        try:
+            _set_cpu_budget(task.get('cpu_seconds', 0))
+            local_vars = {
+                var_name: _read_frame(spec['path'], spec.get('columns'))
+                for var_name, spec in task['datasets'].items()
+            }
+            try:
+                result = _execute(task['code'], local_vars)
+            except (CpuTimeExceeded, MemoryError):
+                raise
+            except Exception as e:
+                # 与PythonAstREPLTool一致，代码错误以文本形式返回
+                result = "{}: {}".format(type(e).__name__, str(e))
+            conn.send(('result', _encode_result(result)))
+        except CpuTimeExceeded as e:
+            conn.send(('error', str(e)))
+        except MemoryError:
+            conn.send(('error', "代码执行内存超过限制"))
+            break
+        except Exception as e:
+            # 数据加载、结果编码失败时返回错误，工作进程继续运行
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+        finally:
+            _set_cpu_budget(0)
+            local_vars = None
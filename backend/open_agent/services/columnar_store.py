@@ -0,0 +1,368 @@
+"""Columnar storage for uploaded Excel/CSV files."""
+
+import ast
+import json
+import os
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from .dataframe_cache import get_dataframe_cache
+from .dataset_profile import (
+    PREVIEW_ROWS,
+    PROMPT_CELL_CHARS,
+    compute_column_stats,
+    format_preview_rows,
+    profile_dataframe
+)
+from ..utils.logger import get_logger
+
+logger = get_logger("columnar_store")
+
+# 上传文件对应的列式存储目录后缀：{uuid}_{filename}.columnar/
+COLUMNAR_DIR_SUFFIX = ".columnar"
+MANIFEST_FILENAME = "manifest.json"
+STORAGE_FORMAT = "arrow_ipc"
+
+# 去重值占比低于该阈值的字符串列使用字典编码存储
+DICTIONARY_ENCODE_RATIO = 0.5
+
+
+def to_arrow_array(series: pd.Series) -> pa.Array:
+    """将单列转换为Arrow数组，混合类型的object列统一转换为字符串"""
+    try:
+        return pa.array(series, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # 空值保持为空
+        return pa.array(series.map(lambda v: None if pd.isna(v) else str(v)), type=pa.string())
+
+
+def _to_arrow_column(series: pd.Series, num_rows: int) -> pa.Array:
+    """将单列转换为Arrow数组，低基数字符串列进行字典编码"""
+    array = to_arrow_array(series)
+
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        distinct = series.nunique(dropna=True)
+        if num_rows and distinct / num_rows <= DICTIONARY_ENCODE_RATIO:
+            array = array.dictionary_encode()
+
+    return array
+
+
+def _dataframe_to_table(df: pd.DataFrame) -> pa.Table:
+    """将DataFrame转换为Arrow表"""
+    num_rows = len(df)
+    arrays = [_to_arrow_column(df[col], num_rows) for col in df.columns]
+    return pa.Table.from_arrays(arrays, names=[str(col) for col in df.columns])
+
+
+def _decode_dictionaries(table: pa.Table) -> pa.Table:
+    """还原字典编码列，保证查询代码看到的仍是普通字符串列而不是Categorical"""
+    for index, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            column = table.column(index)
+            decoded = pa.chunked_array(
+                [chunk.dictionary_decode() for chunk in column.chunks],
+                type=field.type.value_type
+            )
+            table = table.set_column(index, field.name, decoded)
+    return table
+
+
+class ColumnarStore:
+    """上传文件的列式存储
+
+    每个sheet保存为一个未压缩的Arrow IPC文件（可内存映射、零拷贝读取），
+    目录下的 manifest.json 记录sheet与文件的对应关系以及列统计信息。
+    """
+
+    @staticmethod
+    def artifact_dir(source_path: Union[str, Path]) -> Path:
+        """原始上传文件对应的列式存储目录"""
+        return Path(f"{source_path}{COLUMNAR_DIR_SUFFIX}")
+
+    @staticmethod
+    def write(sheets: Dict[str, pd.DataFrame], target_dir: Union[str, Path]) -> Dict[str, Any]:
+        """将各sheet写入列式存储，返回manifest"""
+        target_dir = Path(target_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        sheet_entries: Dict[str, Dict[str, Any]] = {}
+        for index, (sheet_name, df) in enumerate(sheets.items()):
+            df = df.copy(deep=False)
+            df.columns = [str(col) for col in df.columns]
+
+            sheet_file = f"sheet_{index}.arrow"
+            ColumnarStore.write_frame(df, target_dir / sheet_file)
+
+            sheet_entries[sheet_name] = {
+                'file': sheet_file,
+                'rows': len(df),
+                'columns': list(df.columns),
+                'column_stats': compute_column_stats(df),
+                'preview': format_preview_rows(df.head(PREVIEW_ROWS), na_value='NaN', max_chars=PROMPT_CELL_CHARS)
+            }
+
+        return ColumnarStore.write_manifest(target_dir, sheet_entries)
+
+    @staticmethod
+    def write_manifest(target_dir: Union[str, Path], sheet_entries: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """写入manifest（sheet_entries: sheet名 -> {file, rows, columns, column_stats, preview}），返回manifest"""
+        manifest: Dict[str, Any] = {
+            'format': STORAGE_FORMAT,
+            'default_sheet': next(iter(sheet_entries), None),
+            'sheets': sheet_entries
+        }
+        with open(Path(target_dir) / MANIFEST_FILENAME, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+
+        logger.info(f"列式存储写入完成: {target_dir}, sheets={list(sheet_entries.keys())}")
+        return manifest
+
+    @staticmethod
+    def write_frame(df: pd.DataFrame, path: Union[str, Path]) -> None:
+        """将单个DataFrame写为Arrow IPC文件"""
+        ColumnarStore.write_table(_dataframe_to_table(df), path)
+
+    @staticmethod
+    def write_table(table: pa.Table, path: Union[str, Path]) -> None:
+        """将Arrow表写为未压缩的IPC文件"""
+        with pa.OSFile(str(path), 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    @staticmethod
+    def read_manifest(target_dir: Union[str, Path]) -> Dict[str, Any]:
+        """读取manifest"""
+        with open(Path(target_dir) / MANIFEST_FILENAME, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def open(target_dir: Union[str, Path], sheet_name: Optional[str] = None,
+             file_id: Optional[int] = None) -> 'ColumnarDataset':
+        """打开指定sheet（默认sheet）的数据集句柄"""
+        manifest = ColumnarStore.read_manifest(target_dir)
+        sheet_name = sheet_name or manifest.get('default_sheet')
+        if sheet_name not in manifest['sheets']:
+            raise KeyError(f"sheet不存在: {sheet_name}")
+        return ColumnarDataset(Path(target_dir), sheet_name, manifest['sheets'][sheet_name], file_id)
+
+
+class ColumnarDataset:
+    """列式存储中单个sheet的数据集句柄
+
+    只在需要时读取数据，并支持按列投影加载；加载的列写入进程内DataFrame缓存，后续查询直接复用。
+    """
+
+    def __init__(self, target_dir: Path, sheet_name: str, sheet_info: Dict[str, Any],
+                 file_id: Optional[int] = None):
+        self.target_dir = target_dir
+        self.sheet_name = sheet_name
+        self.file_id = file_id
+        self.path = target_dir / sheet_info['file']
+        self.columns: List[str] = list(sheet_info['columns'])
+        self.column_stats: Dict[str, Dict[str, Any]] = sheet_info.get('column_stats', {})
+        self._num_rows: int = sheet_info['rows']
+        self._preview: Optional[List[List[Any]]] = sheet_info.get('preview')
+
+    def __len__(self) -> int:
+        return self._num_rows
+
+    def _read_table(self) -> pa.Table:
+        """内存映射读取整张Arrow表（零拷贝，实际数据按需分页载入）"""
+        source = pa.memory_map(str(self.path), 'r')
+        return ipc.open_file(source).read_all()
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        """读取前n行"""
+        return _decode_dictionaries(self._read_table().slice(0, n)).to_pandas()
+
+    def _read_columns(self, columns: List[str]) -> pd.DataFrame:
+        """从Arrow文件读取指定列"""
+        return _decode_dictionaries(self._read_table().select(columns)).to_pandas()
+
+    @property
+    def cache_key(self) -> Tuple[Any, str, float]:
+        """DataFrame缓存键：(file_id, sheet, 文件修改时间)"""
+        file_key = self.file_id if self.file_id is not None else str(self.target_dir)
+        return file_key, self.sheet_name, os.path.getmtime(self.path)
+
+    def profile(self) -> Dict[str, Any]:
+        """上传时计算的数据集画像（旧版manifest没有预览时读取前几行生成）"""
+        if self._preview is None:
+            self._preview = format_preview_rows(self.head(PREVIEW_ROWS), na_value='NaN', max_chars=PROMPT_CELL_CHARS)
+        return {
+            'rows': self._num_rows,
+            'columns': self.columns,
+            'column_stats': self.column_stats,
+            'preview': self._preview
+        }
+
+    @property
+    def data_version(self) -> Tuple[Any, str, float]:
+        """数据版本，文件被替换后随修改时间变化"""
+        return self.cache_key
+
+    def column_dtypes(self) -> Dict[str, str]:
+        """各列类型（优先取manifest中的pandas类型，缺失时取Arrow schema）"""
+        dtypes = {col: self.column_stats.get(col, {}).get('dtype') for col in self.columns}
+        if any(dtype is None for dtype in dtypes.values()):
+            schema = ipc.open_file(pa.memory_map(str(self.path), 'r')).schema
+            for col, dtype in dtypes.items():
+                if dtype is None:
+                    dtypes[col] = str(schema.field(col).type)
+        return dtypes
+
+    def load(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """加载为DataFrame，columns为None时加载全部列"""
+        if columns is None:
+            columns = self.columns
+        else:
+            columns = [col for col in self.columns if col in set(columns)]
+        return get_dataframe_cache().get_or_load(self.cache_key, columns, self._read_columns)
+
+    def warm(self, columns: List[str]) -> None:
+        """预热：逐列载入DataFrame缓存，查询按列加载时最多等待正在预热的一列"""
+        for col in columns:
+            if col in self.columns:
+                self.load([col])
+
+
+class InMemoryDataset:
+    """已在内存中的DataFrame数据集（兼容旧版pickle和原始文件）"""
+
+    def __init__(self, df: pd.DataFrame, source_path: Optional[str] = None):
+        self.df = df
+        self.columns: List[str] = [str(col) for col in df.columns]
+        # 数据来源文件及其修改时间，用于复用沙箱执行时转换出的Arrow文件
+        self.source_key: Optional[Tuple[str, float]] = (
+            (source_path, os.path.getmtime(source_path)) if source_path else None
+        )
+        self._profile: Optional[Dict[str, Any]] = None
+
+    @property
+    def column_stats(self) -> Dict[str, Dict[str, Any]]:
+        return self.profile()['column_stats']
+
+    def profile(self) -> Dict[str, Any]:
+        """数据集画像（首次使用时向量化计算）"""
+        if self._profile is None:
+            self._profile = profile_dataframe(self.df)
+        return self._profile
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        return self.df.head(n)
+
+    @property
+    def data_version(self) -> None:
+        """内存中的数据没有可靠的版本标识"""
+        return None
+
+    def column_dtypes(self) -> Dict[str, str]:
+        return {str(col): str(dtype) for col, dtype in self.df.dtypes.items()}
+
+    def load(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        return self.df
+
+    def warm(self, columns: List[str]) -> None:
+        pass
+
+
+def _constant_strings(node: ast.AST) -> Optional[List[str]]:
+    """提取字符串常量或字符串常量列表，其他表达式返回None"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, (ast.List, ast.Tuple)):
+        values = []
+        for elt in node.elts:
+            if not (isinstance(elt, ast.Constant) and isinstance(elt.value, str)):
+                return None
+            values.append(elt.value)
+        return values
+    return None
+
+
+def resolve_column_projection(code: str, var_name: str, columns: List[str]) -> Optional[List[str]]:
+    """分析生成的代码，找出数据框变量实际引用的列
+
+    只识别结果只依赖被引用列的用法（按列名取列、链式筛选后取列、groupby后取列、loc选列、len），
+    遇到其他用法（如直接打印整表、dropna、变量列名等）返回None，表示需要加载全部列。
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    parents: Dict[ast.AST, ast.AST] = {}
+    for parent in ast.walk(tree):
+        for child in ast.iter_child_nodes(parent):
+            parents[child] = parent
+
+    column_set = set(columns)
+    referenced = set()
+
+    def select_columns(values: Optional[List[str]]) -> bool:
+        if values is None or not set(values) <= column_set:
+            return False
+        referenced.update(values)
+        return True
+
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Name) and node.id == var_name):
+            continue
+        if isinstance(node.ctx, ast.Store):
+            continue
+
+        parent = parents.get(node)
+        grandparent = parents.get(parent)
+
+        # df['a'] / df[['a', 'b']] / df[mask][['a', 'b']]
+        if isinstance(parent, ast.Subscript) and parent.value is node:
+            if select_columns(_constant_strings(parent.slice)):
+                continue
+            if (isinstance(grandparent, ast.Subscript) and grandparent.value is parent
+                    and select_columns(_constant_strings(grandparent.slice))):
+                continue
+            return None
+
+        if isinstance(parent, ast.Attribute) and parent.value is node:
+            # df.a（df.sum() 等方法调用即使与列同名也不是取列）
+            called = isinstance(grandparent, ast.Call) and grandparent.func is parent
+            if parent.attr in column_set and not called:
+                referenced.add(parent.attr)
+                continue
+            # df.loc[mask, ['a', 'b']]
+            if (parent.attr == 'loc' and isinstance(grandparent, ast.Subscript)
+                    and isinstance(grandparent.slice, ast.Tuple) and len(grandparent.slice.elts) == 2
+                    and select_columns(_constant_strings(grandparent.slice.elts[1]))):
+                continue
+            # df.groupby('a')['b']
+            if parent.attr == 'groupby' and isinstance(grandparent, ast.Call):
+                outer = parents.get(grandparent)
+                keys = [_constant_strings(arg) for arg in grandparent.args]
+                keys += [_constant_strings(kw.value) for kw in grandparent.keywords if kw.arg == 'by']
+                if (isinstance(outer, ast.Subscript) and outer.value is grandparent
+                        and len(grandparent.keywords) == sum(1 for kw in grandparent.keywords if kw.arg == 'by')
+                        and all(select_columns(key) for key in keys)
+                        and select_columns(_constant_strings(outer.slice))):
+                    continue
+            return None
+
+        # len(df)
+        if (isinstance(parent, ast.Call) and isinstance(parent.func, ast.Name)
+                and parent.func.id == 'len' and node in parent.args):
+            continue
+
+        return None
+
+    if not referenced:
+        # 只用到行数时仍需保留一列
+        return columns[:1]
+    return [col for col in columns if col in referenced]
+
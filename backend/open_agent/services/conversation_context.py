@@ -1,148 +1,254 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import json
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 from sqlalchemy.orm import Session
+from open_agent.core.config import get_settings
 from open_agent.models.conversation import Conversation
 from open_agent.models.message import Message
 from open_agent.db.database import get_db
 
+# 上下文快照中保存的字段（对话ID、用户和创建时间来自对话本身）
+SNAPSHOT_KEYS = ('file_list', 'selected_files', 'query_history')
+
+
+class ConversationContextStore:
+    """
+    应用级对话上下文缓存，所有 ConversationContextService 实例共享
+    按最近使用淘汰（LRU），写入超过TTL的条目失效后从对话的上下文快照重新加载
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return None
+            stored_at, context = entry
+            if self.ttl_seconds > 0 and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[conversation_id]
+                return None
+            self._entries.move_to_end(conversation_id)
+            return context
+
+    def put(self, conversation_id: int, context: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[conversation_id] = (time.monotonic(), context)
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, conversation_id: int, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(conversation_id, None)
+        return entry[1] if entry is not None else default
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, conversation_id: int) -> bool:
+        return self.get(conversation_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# 全局实例
+_context_store: Optional[ConversationContextStore] = None
+
+
+def get_conversation_context_store() -> ConversationContextStore:
+    """获取应用级对话上下文缓存"""
+    global _context_store
+    if _context_store is None:
+        smart_query_settings = get_settings().smart_query
+        _context_store = ConversationContextStore(
+            max_entries=smart_query_settings.context_cache_max_entries,
+            ttl_seconds=smart_query_settings.context_cache_ttl_seconds
+        )
+    return _context_store
+
+
 class ConversationContextService:
     """
     对话上下文管理服务
     用于管理智能问数的对话历史和上下文信息
+
+    上下文在对话表的 context_snapshot 列中保存快照（只保留最近N轮查询），每次更新
+    增量写入；读取先查应用级缓存，未命中时读取快照，不再加载并解析全部消息。
     """
-    
+
     def __init__(self):
-        self.context_cache = {}  # 内存缓存对话上下文
-    
+        self.context_cache = get_conversation_context_store()  # 应用级缓存，各实例共享
+        self.history_turns = get_settings().smart_query.context_history_turns
+
+    @staticmethod
+    def _snapshot(context: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: context.get(key, []) for key in SNAPSHOT_KEYS}
+
+    def _build_context(self, conversation: Conversation, snapshot: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        snapshot = snapshot or {}
+        return {
+            'conversation_id': conversation.id,
+            'user_id': conversation.user_id,
+            'file_list': snapshot.get('file_list', []),
+            'selected_files': snapshot.get('selected_files', []),
+            'query_history': snapshot.get('query_history', [])[-self.history_turns:],
+            'created_at': conversation.created_at.isoformat() if conversation.created_at else datetime.utcnow().isoformat()
+        }
+
     async def create_conversation(self, user_id: int, title: str = "智能问数对话") -> int:
         """
         创建新的对话
-        
+
         Args:
             user_id: 用户ID
             title: 对话标题
-            
+
         Returns:
             新创建的对话ID
         """
         try:
             db = next(get_db())
-            
+
             conversation = Conversation(
                 user_id=user_id,
                 title=title,
+                context_snapshot={key: [] for key in SNAPSHOT_KEYS},
                 created_at=datetime.utcnow(),
                 updated_at=datetime.utcnow()
             )
-            
+
             db.add(conversation)
             db.commit()
             db.refresh(conversation)
-            
+
             # 初始化对话上下文
-            self.context_cache[conversation.id] = {
-                'conversation_id': conversation.id,
-                'user_id': user_id,
-                'file_list': [],
-                'selected_files': [],
-                'query_history': [],
-                'created_at': datetime.utcnow().isoformat()
-            }
-            
+            self.context_cache.put(conversation.id, self._build_context(conversation, conversation.context_snapshot))
+
             return conversation.id
-            
+
         except Exception as e:
             print(f"创建对话失败: {e}")
             raise
         finally:
             db.close()
-    
+
+    def _rebuild_snapshot(self, db: Session, conversation_id: int) -> Dict[str, Any]:
+        """没有快照的历史对话：只读取最近N条用户消息和最近一条带文件信息的助手消息"""
+        user_messages = db.query(Message).filter(
+            Message.conversation_id == conversation_id,
+            Message.role == 'user'
+        ).order_by(Message.created_at.desc(), Message.id.desc()).limit(self.history_turns).all()
+
+        snapshot = {
+            'file_list': [],
+            'selected_files': [],
+            'query_history': [
+                {'query': message.content, 'timestamp': message.created_at.isoformat()}
+                for message in reversed(user_messages)
+            ]
+        }
+
+        assistant_message = db.query(Message).filter(
+            Message.conversation_id == conversation_id,
+            Message.role == 'assistant',
+            Message.message_metadata.isnot(None)
+        ).order_by(Message.created_at.desc(), Message.id.desc()).first()
+        if assistant_message is not None:
+            # 从助手消息的元数据中提取文件信息
+            try:
+                metadata = assistant_message.message_metadata
+                metadata = json.loads(metadata) if isinstance(metadata, str) else metadata
+                if 'selected_files' in metadata:
+                    snapshot['selected_files'] = metadata['selected_files']
+                if 'file_list' in metadata:
+                    snapshot['file_list'] = metadata['file_list']
+            except (json.JSONDecodeError, TypeError):
+                pass
+        return snapshot
+
     async def get_conversation_context(self, conversation_id: int) -> Optional[Dict[str, Any]]:
         """
         获取对话上下文
-        
+
         Args:
             conversation_id: 对话ID
-            
+
         Returns:
             对话上下文信息
         """
         # 先从缓存中查找
-        if conversation_id in self.context_cache:
-            return self.context_cache[conversation_id]
-        
-        # 从数据库加载
+        context = self.context_cache.get(conversation_id)
+        if context is not None:
+            return context
+
+        # 从对话的上下文快照加载
         try:
             db = next(get_db())
-            
+
             conversation = db.query(Conversation).filter(
                 Conversation.id == conversation_id
             ).first()
-            
+
             if not conversation:
                 return None
-            
-            # 加载消息历史
-            messages = db.query(Message).filter(
-                Message.conversation_id == conversation_id
-            ).order_by(Message.created_at).all()
-            
-            # 重建上下文
-            context = {
-                'conversation_id': conversation_id,
-                'user_id': conversation.user_id,
-                'file_list': [],
-                'selected_files': [],
-                'query_history': [],
-                'created_at': conversation.created_at.isoformat()
-            }
-            
-            # 从消息中提取查询历史
-            for message in messages:
-                if message.role == 'user':
-                    context['query_history'].append({
-                        'query': message.content,
-                        'timestamp': message.created_at.isoformat()
-                    })
-                elif message.role == 'assistant' and message.metadata:
-                    # 从助手消息的元数据中提取文件信息
-                    try:
-                        metadata = json.loads(message.metadata) if isinstance(message.metadata, str) else message.metadata
-                        if 'selected_files' in metadata:
-                            context['selected_files'] = metadata['selected_files']
-                        if 'file_list' in metadata:
-                            context['file_list'] = metadata['file_list']
-                    except (json.JSONDecodeError, TypeError):
-                        pass
-            
+
+            snapshot = conversation.context_snapshot
+            if snapshot is None:
+                # 历史对话首次加载时重建快照并保存
+                snapshot = self._rebuild_snapshot(db, conversation_id)
+                conversation.context_snapshot = snapshot
+                db.commit()
+
+            context = self._build_context(conversation, snapshot)
+
             # 缓存上下文
-            self.context_cache[conversation_id] = context
-            
+            self.context_cache.put(conversation_id, context)
+
             return context
-            
+
         except Exception as e:
             print(f"获取对话上下文失败: {e}")
             return None
         finally:
             db.close()
-    
+
+    def _save_snapshot(self, conversation_id: int, context: Dict[str, Any]) -> None:
+        """增量写入对话的上下文快照"""
+        try:
+            db = next(get_db())
+            db.query(Conversation).filter(
+                Conversation.id == conversation_id
+            ).update({Conversation.context_snapshot: self._snapshot(context)}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
     async def update_conversation_context(
-        self, 
-        conversation_id: int, 
+        self,
+        conversation_id: int,
         file_list: List[Dict[str, Any]] = None,
         selected_files: List[Dict[str, Any]] = None,
         query: str = None
     ) -> bool:
         """
         更新对话上下文
-        
+
         Args:
             conversation_id: 对话ID
             file_list: 文件列表
             selected_files: 选中的文件
             query: 用户查询
-            
+
         Returns:
             更新是否成功
         """
@@ -151,153 +257,168 @@ class ConversationContextService:
             context = await self.get_conversation_context(conversation_id)
             if not context:
                 return False
-            
+
+            # 在副本上修改，快照写入失败时缓存保持不变
+            context = dict(context)
+
             # 更新上下文信息
             if file_list is not None:
                 context['file_list'] = file_list
-            
+
             if selected_files is not None:
                 context['selected_files'] = selected_files
-            
+
             if query is not None:
+                context['query_history'] = context['query_history'][-(self.history_turns - 1):] if self.history_turns > 1 else []
                 context['query_history'].append({
                     'query': query,
                     'timestamp': datetime.utcnow().isoformat()
                 })
-            
-            # 更新缓存
-            self.context_cache[conversation_id] = context
-            
+
+            # 保存快照并更新缓存
+            self._save_snapshot(conversation_id, context)
+            self.context_cache.put(conversation_id, context)
+
             return True
-            
+
         except Exception as e:
             print(f"更新对话上下文失败: {e}")
             return False
-    
+
     async def save_message(
-        self, 
-        conversation_id: int, 
-        role: str, 
-        content: str, 
+        self,
+        conversation_id: int,
+        role: str,
+        content: str,
         metadata: Dict[str, Any] = None
     ) -> bool:
         """
         保存消息到数据库
-        
+
         Args:
             conversation_id: 对话ID
             role: 消息角色 (user/assistant)
             content: 消息内容
             metadata: 元数据
-            
+
         Returns:
             保存是否成功
         """
         try:
             db = next(get_db())
-            
+
             message = Message(
                 conversation_id=conversation_id,
                 role=role,
                 content=content,
-                metadata=json.dumps(metadata) if metadata else None,
+                message_metadata=metadata,
                 created_at=datetime.utcnow()
             )
-            
+
             db.add(message)
-            db.commit()
-            
+
             # 更新对话的最后更新时间
-            conversation = db.query(Conversation).filter(
+            db.query(Conversation).filter(
                 Conversation.id == conversation_id
-            ).first()
-            
-            if conversation:
-                conversation.updated_at = datetime.utcnow()
-                db.commit()
-            
+            ).update({Conversation.updated_at: datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+
             return True
-            
+
         except Exception as e:
             print(f"保存消息失败: {e}")
             return False
         finally:
             db.close()
-    
+
     async def reset_conversation_context(self, conversation_id: int) -> bool:
         """
         重置对话上下文
-        
+
         Args:
             conversation_id: 对话ID
-            
+
         Returns:
             重置是否成功
         """
         try:
-            # 清除缓存
-            if conversation_id in self.context_cache:
-                context = self.context_cache[conversation_id]
-                # 保留基本信息，清除文件和查询历史
-                context.update({
-                    'file_list': [],
-                    'selected_files': [],
-                    'query_history': []
-                })
-            
+            context = await self.get_conversation_context(conversation_id)
+            if context is None:
+                return True
+
+            # 保留基本信息，清除文件和查询历史
+            context = {
+                **context,
+                'file_list': [],
+                'selected_files': [],
+                'query_history': []
+            }
+            self._save_snapshot(conversation_id, context)
+            self.context_cache.put(conversation_id, context)
+
             return True
-            
+
         except Exception as e:
             print(f"重置对话上下文失败: {e}")
             return False
-    
-    async def get_conversation_history(self, conversation_id: int) -> List[Dict[str, Any]]:
+
+    async def get_conversation_history(
+        self,
+        conversation_id: int,
+        limit: Optional[int] = None,
+        before_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
         """
-        获取对话历史消息
-        
+        获取对话历史消息（按需加载，默认只返回最近N轮）
+
         Args:
             conversation_id: 对话ID
-            
+            limit: 返回的消息数，默认最近 context_history_turns 轮（每轮一问一答）
+            before_id: 只返回该消息之前的消息，用于继续加载更早的历史
+
         Returns:
-            消息历史列表
+            消息历史列表（按时间正序）
         """
         try:
             db = next(get_db())
-            
-            messages = db.query(Message).filter(
-                Message.conversation_id == conversation_id
-            ).order_by(Message.created_at).all()
-            
+
+            query = db.query(Message).filter(Message.conversation_id == conversation_id)
+            if before_id is not None:
+                query = query.filter(Message.id < before_id)
+            messages = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(
+                limit if limit is not None else self.history_turns * 2
+            ).all()
+
             history = []
-            for message in messages:
+            for message in reversed(messages):
                 msg_data = {
                     'id': message.id,
                     'role': message.role,
                     'content': message.content,
                     'timestamp': message.created_at.isoformat()
                 }
-                
-                if message.metadata:
+
+                if message.message_metadata:
                     try:
-                        metadata = json.loads(message.metadata) if isinstance(message.metadata, str) else message.metadata
+                        metadata = json.loads(message.message_metadata) if isinstance(message.message_metadata, str) else message.message_metadata
                         msg_data['metadata'] = metadata
                     except (json.JSONDecodeError, TypeError):
                         pass
-                
+
                 history.append(msg_data)
-            
+
             return history
-            
+
         except Exception as e:
             print(f"获取对话历史失败: {e}")
             return []
         finally:
             db.close()
-    
+
     def clear_cache(self, conversation_id: int = None):
         """
         清除缓存
-        
+
         Args:
             conversation_id: 特定对话ID，如果为None则清除所有缓存
         """
@@ -307,4 +428,4 @@ class ConversationContextService:
             self.context_cache.clear()
 
 # 全局实例
-conversation_context_service = ConversationContextService()
\ No newline at end of file
+conversation_context_service = ConversationContextService()
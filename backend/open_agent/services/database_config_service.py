@@ -4,15 +4,13 @@ import json
 from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
-from cryptography.fernet import Fernet
-import base64
-import os
 
 from ..models.database_config import DatabaseConfig
 from ..utils.logger import get_logger
 from ..utils.exceptions import ValidationError, NotFoundError
 from .postgresql_tool_manager import get_postgresql_tool
 from .mysql_tool_manager import get_mysql_tool
+from .datasource_credentials import get_config_cipher, get_credential_resolver
 import pymysql
 
 logger = get_logger("database_config_service")
@@ -25,23 +23,8 @@ class DatabaseConfigService:
         self.db = db_session
         self.postgresql_tool = get_postgresql_tool()
         self.mysql_tool = get_mysql_tool()
-        # 初始化加密密钥
-        self.encryption_key = self._get_or_create_encryption_key()
-        self.cipher = Fernet(self.encryption_key)
-    def _get_or_create_encryption_key(self) -> bytes:
-        """获取或创建加密密钥"""
-        key_file = "db/db_config_key.key"
-        if os.path.exists(key_file):
-            print('find db_config_key')
-            with open(key_file, 'rb') as f:
-                return f.read()
-
-        else:
-            print('not find db_config_key')
-            key = Fernet.generate_key()
-            with open(key_file, 'wb') as f:
-                f.write(key)
-            return key
+        # 加密密钥进程内只读取一次
+        self.cipher = get_config_cipher(db_session)
     
     def _encrypt_password(self, password: str) -> str:
         """加密密码"""
@@ -183,14 +166,16 @@ class DatabaseConfigService:
             connect_result = await self.postgresql_tool.execute(
                 operation="connect",
                 connection_config=connection_config,
-                user_id=str(user_id)
+                user_id=str(user_id),
+                datasource_id=config.id
             )
         elif 'mysql' == config.db_type:
             # 连接数据库
             connect_result = await self.mysql_tool.execute(
                 operation="connect",
                 connection_config=connection_config,
-                user_id=str(user_id)
+                user_id=str(user_id),
+                datasource_id=config.id
             )
         
         if not connect_result.success:
@@ -198,7 +183,7 @@ class DatabaseConfigService:
                 'success': False,
                 'message': connect_result.error
             }
-            # 连接信息已保存到PostgreSQLMCPTool的connections中
+            # 数据源已登记到工具的connections中，连接由数据源连接池管理
         return {
             'success': True,
             'data': connect_result.result,
@@ -305,6 +290,7 @@ class DatabaseConfigService:
                 
                 self.db.commit()
                 self.db.refresh(existing_config)
+                get_credential_resolver().invalidate(existing_config.id)
                 logger.info(f"更新数据库配置成功: {existing_config.name} (ID: {existing_config.id})")
                 return existing_config
             else:
@@ -0,0 +1,187 @@
+"""Process-wide DataFrame cache for smart Excel queries."""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable, Hashable, Tuple
+
+import pandas as pd
+
+from ..core.config import get_settings
+from ..utils.logger import get_logger
+
+logger = get_logger("dataframe_cache")
+
+# pandas>=3 始终启用写时复制，缓存中的列可以直接零拷贝共享给多个查询；
+# 旧版本未开启写时复制时，每次取出都做一次拷贝，避免生成的代码原地修改缓存数据
+_COPY_ON_WRITE = int(pd.__version__.split('.')[0]) >= 3 or pd.get_option('mode.copy_on_write') is True
+
+
+class _CacheEntry:
+    """单个 (file_id, sheet, mtime) 的缓存项，按列保存"""
+
+    def __init__(self):
+        self.columns: Dict[str, pd.Series] = {}
+        self.nbytes = 0
+        # 正在加载的列及加载完成事件，同一列只加载一次，不同列的加载互不等待
+        self.loading: Dict[str, threading.Event] = {}
+
+
+class DataFrameCache:
+    """进程内共享的DataFrame缓存
+
+    以 (file_id, sheet, 文件修改时间) 为键、按列缓存数据，文件被替换后修改时间变化即自然失效；
+    总内存按 ``memory_usage(deep=True)`` 统计，超出上限时按LRU淘汰整个文件的缓存。
+
+    只服务在本进程中执行生成代码的路径（未启用代码沙箱时）；沙箱进程直接内存映射Arrow文件，
+    追问时由操作系统页缓存避免重复读盘。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._current_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _get_entry(self, key: Hashable) -> _CacheEntry:
+        """获取或创建缓存项（调用方持有锁）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _CacheEntry()
+            self._entries[key] = entry
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_or_load(
+        self,
+        key: Tuple[Hashable, str, float],
+        columns: List[str],
+        loader: Callable[[List[str]], pd.DataFrame]
+    ) -> pd.DataFrame:
+        """获取指定列，缺失的列通过 loader 加载后写入缓存
+
+        其他查询（或预热）正在加载的列等待其完成后直接使用，只加载没有人在加载的列。
+
+        Args:
+            key: (file_id, sheet, mtime)
+            columns: 需要的列
+            loader: 加载缺失列的函数，参数为列名列表
+        """
+        data: Dict[str, pd.Series] = {}
+        pending = list(columns)
+        loaded_any = False
+        while pending:
+            with self._lock:
+                entry = self._get_entry(key)
+                for col in pending:
+                    if col in entry.columns:
+                        data[col] = entry.columns[col]
+                missing = [col for col in pending if col not in data]
+                waiting = {entry.loading[col] for col in missing if col in entry.loading}
+                claimed = [col for col in missing if col not in entry.loading]
+                done = threading.Event()
+                for col in claimed:
+                    entry.loading[col] = done
+
+            if claimed:
+                loaded_any = True
+                data.update(self._load_claimed(key, entry, claimed, loader, done))
+            # 等待其他线程加载的列；加载失败或已被淘汰的列下一轮自行加载
+            for event in waiting:
+                event.wait()
+            pending = [col for col in pending if col not in data]
+
+        with self._lock:
+            if loaded_any:
+                self._misses += 1
+            else:
+                self._hits += 1
+
+        return pd.DataFrame({col: data[col] for col in columns}, copy=not _COPY_ON_WRITE)
+
+    def _load_claimed(
+        self,
+        key: Hashable,
+        entry: _CacheEntry,
+        claimed: List[str],
+        loader: Callable[[List[str]], pd.DataFrame],
+        done: threading.Event
+    ) -> Dict[str, pd.Series]:
+        """加载本线程认领的列并写入缓存；加载失败时释放认领，移除没有任何数据的缓存项"""
+        try:
+            loaded = loader(claimed)
+            added = {col: loaded[col] for col in claimed}
+        except BaseException:
+            with self._lock:
+                for col in claimed:
+                    entry.loading.pop(col, None)
+                if not entry.columns and not entry.loading and self._entries.get(key) is entry:
+                    del self._entries[key]
+            done.set()
+            raise
+
+        added_bytes = sum(int(series.memory_usage(index=False, deep=True)) for series in added.values())
+        with self._lock:
+            for col in claimed:
+                entry.loading.pop(col, None)
+            if self._entries.get(key) is entry:
+                entry.columns.update(added)
+                entry.nbytes += added_bytes
+                self._current_bytes += added_bytes
+                self._evict(keep=key)
+        done.set()
+        return added
+
+    def _evict(self, keep: Hashable) -> None:
+        """按LRU淘汰直到内存低于上限（调用方持有锁），刚写入的键不淘汰"""
+        while self._current_bytes > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            entry = self._entries.pop(key)
+            self._current_bytes -= entry.nbytes
+            self._evictions += 1
+            logger.info(f"DataFrame缓存淘汰: {key}, 释放 {entry.nbytes / 1024 / 1024:.1f}MB")
+
+    def invalidate(self, file_id: Hashable) -> None:
+        """移除某个文件的全部缓存"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == file_id]:
+                entry = self._entries.pop(key)
+                self._current_bytes -= entry.nbytes
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """缓存命中率与内存指标"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'memory_bytes': self._current_bytes,
+                'memory_mb': round(self._current_bytes / 1024 / 1024, 2),
+                'max_memory_mb': round(self.max_bytes / 1024 / 1024, 2),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else 0.0,
+                'evictions': self._evictions
+            }
+
+
+# 全局实例
+_dataframe_cache: Optional[DataFrameCache] = None
+
+
+def get_dataframe_cache() -> DataFrameCache:
+    """获取进程内DataFrame缓存实例"""
+    global _dataframe_cache
+    if _dataframe_cache is None:
+        max_mb = get_settings().smart_query.dataframe_cache_max_mb
+        _dataframe_cache = DataFrameCache(max_bytes=max_mb * 1024 * 1024)
+    return _dataframe_cache
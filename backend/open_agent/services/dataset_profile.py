@@ -0,0 +1,211 @@
+"""Vectorized dataset profiling and LLM prompt context."""
+
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+PREVIEW_ROWS = 5
+# 提示词预览中单元格的最大字符数
+PROMPT_CELL_CHARS = 20
+# 文本列记录的高频值个数
+TOP_VALUES = 5
+TOP_VALUE_CHARS = 50
+
+
+def json_safe(value: Any) -> Any:
+    """将统计值转换为可JSON序列化的类型"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def _top_values(values: List[Any], counts: List[int]) -> List[Dict[str, Any]]:
+    """按出现次数降序、值升序取高频值（结果确定，不受原始顺序影响）"""
+    pairs = sorted(
+        ((str(value)[:TOP_VALUE_CHARS], int(count)) for value, count in zip(values, counts) if value is not None),
+        key=lambda pair: (-pair[1], pair[0])
+    )
+    return [{'value': value, 'count': count} for value, count in pairs[:TOP_VALUES]]
+
+
+def arrow_top_values(column: pa.ChunkedArray) -> List[Dict[str, Any]]:
+    """Arrow文本列的高频值"""
+    counts = pc.value_counts(column)
+    return _top_values(counts.field('values').to_pylist(), counts.field('counts').to_pylist())
+
+
+def compute_column_stats(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """向量化计算每列的统计信息
+
+    空值数、去重数各一次整表计算；数值列一次聚合得到最值/均值/标准差；时间列取最值；
+    文本列记录高频值。
+    """
+    null_counts = df.isna().sum()
+    distinct_counts = df.nunique(dropna=True)
+
+    stats: Dict[str, Dict[str, Any]] = {}
+    for col in df.columns:
+        stats[col] = {
+            'dtype': str(df[col].dtype),
+            'null_count': int(null_counts[col]),
+            'distinct_count': int(distinct_counts[col])
+        }
+
+    numeric_df = df.select_dtypes(include='number')
+    if not numeric_df.empty:
+        numeric_stats = numeric_df.agg(['min', 'max', 'mean', 'std'])
+        for col in numeric_df.columns:
+            stats[col].update({
+                key: json_safe(numeric_stats.at[key, col]) for key in ('min', 'max', 'mean', 'std')
+            })
+
+    datetime_df = df.select_dtypes(include='datetime')
+    if not datetime_df.empty:
+        minimums, maximums = datetime_df.min(), datetime_df.max()
+        for col in datetime_df.columns:
+            stats[col].update({'min': json_safe(minimums[col]), 'max': json_safe(maximums[col])})
+
+    for col in df.select_dtypes(include=['object', 'string']).columns:
+        counts = df[col].value_counts(dropna=True)
+        stats[col]['top_values'] = _top_values(counts.index.tolist(), counts.tolist())
+
+    return stats
+
+
+def format_preview_rows(df: pd.DataFrame, na_value: Optional[str] = None,
+                        max_chars: Optional[int] = None) -> List[List[Optional[str]]]:
+    """按列向量化格式化预览行：时间列统一格式，空值替换为 na_value，可截断长文本"""
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            text = series.dt.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            text = series.astype(str)
+        if max_chars and not pd.api.types.is_numeric_dtype(series):
+            text = text.where(text.str.len() <= max_chars, text.str.slice(0, max_chars - 3) + '...')
+        values = text.to_numpy(dtype=object)
+        values[series.isna().to_numpy()] = na_value
+        columns.append(values)
+    if not columns:
+        return [[] for _ in range(len(df))]
+    return np.column_stack(columns).tolist()
+
+
+def profile_dataframe(df: pd.DataFrame) -> Dict[str, Any]:
+    """内存中DataFrame的画像（与上传时写入manifest的画像结构一致）"""
+    df = df.copy(deep=False)
+    df.columns = [str(col) for col in df.columns]
+    return {
+        'rows': len(df),
+        'columns': list(df.columns),
+        'column_stats': compute_column_stats(df),
+        'preview': format_preview_rows(df.head(PREVIEW_ROWS), na_value='NaN', max_chars=PROMPT_CELL_CHARS)
+    }
+
+
+def _format_number(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.4f}".rstrip('0').rstrip('.')
+    return str(value)
+
+
+def _describe_column(name: str, stats: Dict[str, Any]) -> str:
+    """单列的一行描述"""
+    parts = [f"空值{stats.get('null_count', 0)}", f"去重{stats.get('distinct_count', 0)}"]
+    if stats.get('min') is not None and stats.get('max') is not None:
+        parts.append(f"范围{_format_number(stats['min'])}~{_format_number(stats['max'])}")
+    if stats.get('mean') is not None:
+        parts.append(f"均值{_format_number(stats['mean'])}")
+    if stats.get('top_values'):
+        parts.append("常见值: " + ", ".join(
+            str(item['value'])[:PROMPT_CELL_CHARS] for item in stats['top_values']
+        ))
+    return f"    {name} ({stats.get('dtype', 'unknown')}): {', '.join(parts)}"
+
+
+def build_dataset_context(var_name: str, filename: str, profile: Dict[str, Any],
+                          max_columns: int = 50, max_chars: int = 4000) -> str:
+    """
+    根据数据集画像生成提示词中的数据集描述
+
+    文本只由画像决定（相同画像得到相同文本），列数和总字符数有上限。
+
+    Args:
+        var_name: 代码中的变量名
+        filename: 来源文件名
+        profile: 画像 {rows, columns, column_stats, preview}
+        max_columns: 最多列出的列数
+        max_chars: 描述的最大字符数
+    """
+    columns = profile['columns']
+    column_stats = profile.get('column_stats', {})
+    listed = columns[:max_columns]
+    omitted = len(columns) - len(listed)
+
+    lines = [
+        f"- {var_name} (来源文件: {filename}): {profile['rows']}行 x {len(columns)}列",
+        f"  列名: {', '.join(listed)}" + (f" ...（另有{omitted}列）" if omitted else ""),
+        "  列信息:"
+    ]
+    lines.extend(_describe_column(col, column_stats.get(col, {})) for col in listed)
+
+    preview = profile.get('preview') or []
+    lines.append(f"  前{len(preview)}行数据预览:")
+    for index, row in enumerate(preview):
+        lines.append(f"    行{index}: {', '.join(str(value) for value in row[:max_columns])}")
+
+    text = "\n".join(lines)
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit("\n", 1)[0] + "\n  ...（数据集描述已截断）"
+    return text
+
+
+def build_analysis(filename: str, rows: int, columns: List[str], column_stats: Dict[str, Dict[str, Any]],
+                   preview_records: List[Dict[str, Any]], duplicate_count: int, nbytes: int) -> Dict[str, Any]:
+    """上传文件的分析结果（列信息、预览、数据质量问题）"""
+    column_info = []
+    for col in columns:
+        stats = column_stats.get(col, {})
+        col_info = {
+            'name': col,
+            'dtype': stats.get('dtype'),
+            'null_count': stats.get('null_count', 0),
+            'unique_count': stats.get('distinct_count', 0)
+        }
+        if 'mean' in stats:
+            col_info.update({key: stats.get(key) for key in ('mean', 'std', 'min', 'max')})
+        column_info.append(col_info)
+
+    quality_issues = []
+    missing_cols = [col for col in columns if column_stats.get(col, {}).get('null_count')]
+    if missing_cols:
+        quality_issues.append({
+            'type': 'missing_values',
+            'description': f'以下列存在缺失值: {", ".join(missing_cols)}',
+            'columns': missing_cols
+        })
+    if duplicate_count > 0:
+        quality_issues.append({
+            'type': 'duplicate_rows',
+            'description': f'发现 {duplicate_count} 行重复数据',
+            'count': duplicate_count
+        })
+
+    return {
+        'filename': filename,
+        'rows': rows,
+        'columns': len(columns),
+        'column_names': list(columns),
+        'column_info': column_info,
+        'preview': preview_records,
+        'quality_issues': quality_issues,
+        'memory_usage': f"{nbytes / 1024 / 1024:.2f} MB"
+    }
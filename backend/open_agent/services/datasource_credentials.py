@@ -0,0 +1,168 @@
+"""Process-level encryption key and decrypted datasource credential cache."""
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from cryptography.fernet import Fernet
+from sqlalchemy.orm import Session
+
+from ..core.config import get_settings
+from ..models.database_config import DatabaseConfig
+from ..utils.logger import get_logger
+
+logger = get_logger("datasource_credentials")
+
+# 随代码包分发的密钥文件（open_agent/db/db_config_key.key），与启动目录无关
+KEY_PATH = Path(__file__).resolve().parent.parent / "db" / "db_config_key.key"
+
+
+def _has_encrypted_configs(db: Optional[Session]) -> bool:
+    """是否已有加密保存的数据库配置（无法查询时按已存在处理）"""
+    if db is None:
+        return True
+    return db.query(DatabaseConfig.id).first() is not None
+
+
+def load_encryption_key(db: Optional[Session] = None) -> bytes:
+    """
+    读取数据库配置加密密钥
+
+    密钥文件不存在时只在还没有任何数据库配置时生成新密钥；已有加密保存的密码时
+    新密钥无法解密它们，直接报错而不是静默生成。
+
+    Raises:
+        RuntimeError: 密钥文件不存在且已有（或无法确认是否有）加密保存的数据库配置
+    """
+    if KEY_PATH.exists():
+        logger.info(f"读取数据库配置加密密钥: {KEY_PATH}")
+        return KEY_PATH.read_bytes()
+    if _has_encrypted_configs(db):
+        raise RuntimeError(f"未找到数据库配置加密密钥 {KEY_PATH}，已保存的数据库配置密码无法解密")
+    logger.warning(f"未找到数据库配置加密密钥，生成新密钥: {KEY_PATH}")
+    key = Fernet.generate_key()
+    os.makedirs(KEY_PATH.parent, exist_ok=True)
+    KEY_PATH.write_bytes(key)
+    return key
+
+
+# 全局实例
+_cipher: Optional[Fernet] = None
+_cipher_lock = threading.Lock()
+
+
+def get_config_cipher(db: Optional[Session] = None) -> Fernet:
+    """
+    获取数据库配置密码的加解密器（进程内只读取一次密钥文件）
+
+    Args:
+        db: 系统数据库会话，密钥文件不存在时用于确认是否可以生成新密钥
+    """
+    global _cipher
+    if _cipher is None:
+        with _cipher_lock:
+            if _cipher is None:
+                _cipher = Fernet(load_encryption_key(db))
+    return _cipher
+
+
+def encrypt_password(password: str) -> str:
+    """加密密码"""
+    return get_config_cipher().encrypt(password.encode()).decode()
+
+
+def decrypt_password(encrypted_password: str) -> str:
+    """解密密码"""
+    return get_config_cipher().decrypt(encrypted_password.encode()).decode()
+
+
+class ResolvedDatasource:
+    """已解密的数据源连接信息（DatabaseConfig 的只读快照）"""
+
+    def __init__(self, config: DatabaseConfig):
+        self.id = config.id
+        self.owner_id = config.created_by
+        self.name = config.name
+        self.db_type = config.db_type
+        self.database = config.database
+        self.version = config.updated_at
+        self.connection_config: Dict[str, Any] = {
+            'host': config.host,
+            'port': config.port,
+            'database': config.database,
+            'username': config.username,
+            'password': decrypt_password(config.password)
+        }
+        self.checked_at = time.monotonic()
+
+
+class DatasourceCredentialResolver:
+    """按 DatabaseConfig.id 缓存解密后的连接配置
+
+    同一进程内配置更新时由 DatabaseConfigService 主动失效；缓存超过 revalidate_seconds
+    后只查询配置的 updated_at 作为版本号，版本未变时继续使用缓存，不再读取整行和解密。
+    """
+
+    def __init__(self, revalidate_seconds: float):
+        self.revalidate_seconds = revalidate_seconds
+        self._entries: Dict[int, ResolvedDatasource] = {}
+        self._lock = threading.Lock()
+
+    def _current_version(self, db: Session, config_id: int) -> Any:
+        return db.query(DatabaseConfig.updated_at).filter(DatabaseConfig.id == config_id).scalar()
+
+    def resolve(self, db: Session, config_id: int, user_id: Optional[int] = None) -> Optional[ResolvedDatasource]:
+        """
+        获取数据源连接信息
+
+        Args:
+            db: 系统数据库会话（缓存未命中或需要校验版本时使用）
+            config_id: 数据库配置ID
+            user_id: 指定时只返回该用户创建的配置
+
+        Returns:
+            已解密的连接信息，配置不存在或不属于该用户时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(config_id)
+        if entry is not None and time.monotonic() - entry.checked_at > self.revalidate_seconds:
+            if self._current_version(db, config_id) == entry.version:
+                entry.checked_at = time.monotonic()
+            else:
+                logger.info(f"数据库配置 {config_id} 已变化，重新读取连接信息")
+                entry = None
+        if entry is None:
+            config = db.query(DatabaseConfig).filter(DatabaseConfig.id == config_id).first()
+            if config is None:
+                self.invalidate(config_id)
+                return None
+            entry = ResolvedDatasource(config)
+            with self._lock:
+                self._entries[config_id] = entry
+        if user_id is not None and entry.owner_id != user_id:
+            return None
+        return entry
+
+    def invalidate(self, config_id: Optional[int] = None) -> None:
+        """使配置缓存失效，config_id为None时清空"""
+        with self._lock:
+            if config_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(config_id, None)
+
+
+# 全局实例
+_credential_resolver: Optional[DatasourceCredentialResolver] = None
+
+
+def get_credential_resolver() -> DatasourceCredentialResolver:
+    """获取数据源连接信息缓存"""
+    global _credential_resolver
+    if _credential_resolver is None:
+        _credential_resolver = DatasourceCredentialResolver(
+            revalidate_seconds=get_settings().datasource_pool.credential_revalidate_seconds
+        )
+    return _credential_resolver
@@ -0,0 +1,361 @@
+"""Single-pass streaming ingestion for uploaded Excel/CSV files."""
+
+import codecs
+import math
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .columnar_store import ColumnarStore, DICTIONARY_ENCODE_RATIO, to_arrow_array
+from .dataset_profile import (
+    PREVIEW_ROWS,
+    PROMPT_CELL_CHARS,
+    json_safe,
+    arrow_top_values,
+    format_preview_rows,
+    build_analysis
+)
+from ..utils.logger import get_logger
+
+logger = get_logger("excel_ingestion")
+
+# 上传文件按块写入磁盘的块大小
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# CSV编码探测读取的样本大小
+ENCODING_SAMPLE_BYTES = 64 * 1024
+# 按顺序尝试的CSV编码（与原有 utf-8 -> gbk 回退保持一致）
+CSV_ENCODINGS = ('utf-8', 'gbk')
+
+
+class UploadTooLargeError(ValueError):
+    """上传文件超过大小限制"""
+    pass
+
+
+class FileEncodingError(ValueError):
+    """CSV文件编码无法识别"""
+    pass
+
+
+async def save_upload(upload, file_path: Union[str, Path], max_bytes: int,
+                      chunk_bytes: int = UPLOAD_CHUNK_BYTES) -> int:
+    """
+    将上传文件按块写入磁盘，不在内存中保留完整内容
+
+    Args:
+        upload: FastAPI UploadFile
+        file_path: 目标路径
+        max_bytes: 大小上限，超出时删除已写入部分并抛出 UploadTooLargeError
+        chunk_bytes: 每次读取的字节数
+
+    Returns:
+        文件大小（字节）
+    """
+    file_size = 0
+    try:
+        with open(file_path, 'wb') as f:
+            while True:
+                chunk = await upload.read(chunk_bytes)
+                if not chunk:
+                    break
+                file_size += len(chunk)
+                if file_size > max_bytes:
+                    raise UploadTooLargeError(f"文件大小超过 {max_bytes} 字节")
+                f.write(chunk)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    return file_size
+
+
+def detect_csv_encoding(file_path: Union[str, Path]) -> str:
+    """根据文件开头的样本探测CSV编码（只读取一次样本）"""
+    with open(file_path, 'rb') as f:
+        sample = f.read(ENCODING_SAMPLE_BYTES)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    for encoding in CSV_ENCODINGS:
+        try:
+            # 增量解码：样本末尾被截断的多字节字符不视为错误
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    raise FileEncodingError("文件编码错误，请确保文件为UTF-8或GBK编码")
+
+
+def _pandas_dtype_name(arrow_type: pa.DataType, null_count: int) -> str:
+    """Arrow类型在查询时（to_pandas后）对应的pandas dtype名称"""
+    if pa.types.is_null(arrow_type):
+        return 'object'
+    if null_count and pa.types.is_integer(arrow_type):
+        return 'float64'
+    if null_count and pa.types.is_boolean(arrow_type):
+        return 'object'
+    return str(pa.array([], type=arrow_type).to_pandas().dtype)
+
+
+class _ColumnAccumulator:
+    """单列的增量统计：数值列按块合并均值/方差（Chan并行算法）与最值，时间列合并最值"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self._range_valid = True
+
+    def update(self, series: pd.Series) -> None:
+        if pd.api.types.is_bool_dtype(series):
+            return
+        if pd.api.types.is_numeric_dtype(series):
+            n = int(series.count())
+            if n == 0:
+                return
+            chunk_mean = float(series.mean())
+            chunk_m2 = float(series.var(ddof=0)) * n
+            total = self.count + n
+            delta = chunk_mean - self.mean
+            self.mean += delta * n / total
+            self.m2 += chunk_m2 + delta * delta * self.count * n / total
+            self.count = total
+            self._update_range(series.min(), series.max())
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            self._update_range(series.min(), series.max())
+
+    def _update_range(self, chunk_min: Any, chunk_max: Any) -> None:
+        if not self._range_valid or pd.isna(chunk_min):
+            return
+        try:
+            self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+            self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+        except TypeError:
+            # 不同块的类型不可比较（如数值与时间混合），放弃最值统计
+            self._range_valid = False
+            self.min = self.max = None
+
+    def finish(self, arrow_type: pa.DataType) -> Dict[str, Any]:
+        """按最终的Arrow类型输出统计项"""
+        if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type):
+            if self.count == 0:
+                return {'min': None, 'max': None, 'mean': None, 'std': None}
+            return {
+                'min': json_safe(self.min),
+                'max': json_safe(self.max),
+                'mean': self.mean,
+                'std': math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+            }
+        if pa.types.is_timestamp(arrow_type) or pa.types.is_date(arrow_type):
+            return {'min': json_safe(self.min), 'max': json_safe(self.max)}
+        return {}
+
+
+class SheetIngestor:
+    """单个sheet的增量转换
+
+    逐块转换为Arrow并累计列统计；结束时统一各块的列类型，在Arrow表上统计去重数、重复行
+    和预览（与查询时看到的类型一致），再对低基数字符串列做字典编码。
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.columns: List[str] = []
+        self.preview_df: Optional[pd.DataFrame] = None
+        self.duplicate_rows = 0
+        self._tables: List[pa.Table] = []
+        self._accumulators: Dict[str, _ColumnAccumulator] = {}
+
+    def add_chunk(self, chunk: pd.DataFrame) -> None:
+        chunk = chunk.copy(deep=False)
+        chunk.columns = [str(col) for col in chunk.columns]
+        if not self._tables:
+            self.columns = list(chunk.columns)
+
+        for col in chunk.columns:
+            self._accumulators.setdefault(col, _ColumnAccumulator()).update(chunk[col])
+
+        self._tables.append(pa.Table.from_arrays(
+            [to_arrow_array(chunk[col]) for col in chunk.columns],
+            names=list(chunk.columns)
+        ))
+        self.rows += len(chunk)
+
+    def finish(self) -> Tuple[pa.Table, Dict[str, Dict[str, Any]]]:
+        """合并各块为一张Arrow表，返回 (表, 列统计)"""
+        table = self._concat_tables()
+        self._tables = []
+        self.preview_df = table.slice(0, PREVIEW_ROWS).to_pandas()
+        self.duplicate_rows = _count_duplicate_rows(table)
+
+        column_stats: Dict[str, Dict[str, Any]] = {}
+        for index, field in enumerate(table.schema):
+            column = table.column(index)
+            null_count = column.null_count
+            distinct_count = 0 if pa.types.is_null(field.type) else \
+                pc.count_distinct(column, mode='only_valid').as_py()
+
+            stats = {
+                'dtype': _pandas_dtype_name(field.type, null_count),
+                'null_count': int(null_count),
+                'distinct_count': int(distinct_count)
+            }
+            accumulator = self._accumulators.get(field.name)
+            if accumulator is not None:
+                stats.update(accumulator.finish(field.type))
+            column_stats[field.name] = stats
+
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                stats['top_values'] = arrow_top_values(column)
+                if table.num_rows and distinct_count / table.num_rows <= DICTIONARY_ENCODE_RATIO:
+                    table = table.set_column(index, field.name, pc.dictionary_encode(column))
+
+        # 各块字典编码后共享同一个字典，IPC文件格式不支持替换字典
+        return table.unify_dictionaries(), column_stats
+
+    def _concat_tables(self) -> pa.Table:
+        """合并各块，类型不一致的列（如前面的块为数值、后面出现文本）统一转换为字符串"""
+        if not self._tables:
+            return pa.table({})
+        try:
+            return pa.concat_tables(self._tables, promote_options='permissive')
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+
+        conflicting = set()
+        for name in self._tables[0].column_names:
+            types = {table.schema.field(name).type for table in self._tables
+                     if not pa.types.is_null(table.schema.field(name).type)}
+            if len(types) > 1:
+                conflicting.add(name)
+        logger.info(f"以下列在不同数据块中类型不一致，统一转换为字符串: {sorted(conflicting)}")
+
+        tables = []
+        for table in self._tables:
+            for name in conflicting:
+                index = table.schema.get_field_index(name)
+                table = table.set_column(index, name, pc.cast(table.column(index), pa.string()))
+            tables.append(table)
+        return pa.concat_tables(tables, promote_options='permissive')
+
+
+def _count_duplicate_rows(table: pa.Table) -> int:
+    """重复行数：整行分组后的组数与行数之差（空值视为相同，与 DataFrame.duplicated 一致）"""
+    keys = [field.name for field in table.schema if not pa.types.is_null(field.type)]
+    if not keys or table.num_rows == 0:
+        return 0
+    return table.num_rows - table.group_by(keys, use_threads=False).aggregate([]).num_rows
+
+
+def _iter_row_chunks(df: pd.DataFrame, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """按行切块（空表也返回一次，保留列结构）"""
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _iter_csv_sheets(file_path: Union[str, Path], chunk_rows: int) -> Iterator[Tuple[str, SheetIngestor]]:
+    """CSV分块解析，编码只探测一次；样本之后出现解码错误时换下一个编码重新解析"""
+    detected = detect_csv_encoding(file_path)
+    encodings = [detected] + [encoding for encoding in CSV_ENCODINGS if encoding != detected]
+    for encoding in encodings:
+        ingestor = SheetIngestor()
+        try:
+            for chunk in pd.read_csv(file_path, encoding=encoding, chunksize=chunk_rows):
+                ingestor.add_chunk(chunk)
+        except UnicodeDecodeError:
+            logger.warning(f"CSV按 {encoding} 解码失败，尝试其他编码: {file_path}")
+            continue
+        yield 'Sheet1', ingestor
+        return
+    raise FileEncodingError("文件编码错误，请确保文件为UTF-8或GBK编码")
+
+
+def _iter_excel_sheets(file_path: Union[str, Path], chunk_rows: int) -> Iterator[Tuple[str, SheetIngestor]]:
+    """Excel逐个sheet解析，前一个sheet写入列式存储并释放后再解析下一个"""
+    with pd.ExcelFile(file_path) as excel:
+        for sheet_name in excel.sheet_names:
+            df = excel.parse(sheet_name)
+            ingestor = SheetIngestor()
+            for chunk in _iter_row_chunks(df, chunk_rows):
+                ingestor.add_chunk(chunk)
+            del df
+            yield sheet_name, ingestor
+
+
+def ingest_file(file_path: Union[str, Path], original_filename: str, target_dir: Union[str, Path],
+                chunk_rows: int = 50000) -> Dict[str, Any]:
+    """
+    单遍解析上传文件：分块转换为列式存储，同时计算文件元信息、预览和列统计
+
+    Args:
+        file_path: 已落盘的上传文件
+        original_filename: 原始文件名（用于判断类型和分析结果）
+        target_dir: 列式存储目录
+        chunk_rows: 每块行数
+
+    Returns:
+        {'manifest': 列式存储manifest,
+         'metadata': ExcelFile元信息（与 ExcelMetadataService.extract_file_metadata 结构一致）,
+         'analysis': 默认sheet的分析结果}
+    """
+    target_dir = Path(target_dir)
+    file_extension = os.path.splitext(original_filename)[1].lower()
+    sheets = _iter_csv_sheets(file_path, chunk_rows) if file_extension == '.csv' \
+        else _iter_excel_sheets(file_path, chunk_rows)
+
+    sheet_entries: Dict[str, Dict[str, Any]] = {}
+    metadata: Dict[str, Any] = {
+        'sheet_names': [],
+        'default_sheet': None,
+        'columns_info': {},
+        'preview_data': {},
+        'data_types': {},
+        'total_rows': {},
+        'total_columns': {},
+        'is_processed': True,
+        'processing_error': None
+    }
+    analysis: Optional[Dict[str, Any]] = None
+
+    target_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        for index, (sheet_name, ingestor) in enumerate(sheets):
+            table, column_stats = ingestor.finish()
+            sheet_file = f"sheet_{index}.arrow"
+            ColumnarStore.write_table(table, target_dir / sheet_file)
+            sheet_entries[sheet_name] = {
+                'file': sheet_file,
+                'rows': ingestor.rows,
+                'columns': list(ingestor.columns),
+                'column_stats': column_stats,
+                'preview': format_preview_rows(ingestor.preview_df, na_value='NaN', max_chars=PROMPT_CELL_CHARS)
+            }
+
+            # 元信息中去掉未命名列
+            named_columns = [col for col in ingestor.columns if not col.startswith('Unnamed')]
+            metadata['sheet_names'].append(sheet_name)
+            metadata['columns_info'][sheet_name] = named_columns
+            metadata['preview_data'][sheet_name] = format_preview_rows(ingestor.preview_df[named_columns])
+            metadata['data_types'][sheet_name] = {col: column_stats[col]['dtype'] for col in named_columns}
+            metadata['total_rows'][sheet_name] = ingestor.rows
+            metadata['total_columns'][sheet_name] = len(named_columns)
+
+            if analysis is None:
+                analysis = build_analysis(
+                    original_filename, ingestor.rows, ingestor.columns, column_stats,
+                    ingestor.preview_df.fillna('').to_dict('records'), ingestor.duplicate_rows, table.nbytes
+                )
+
+        manifest = ColumnarStore.write_manifest(target_dir, sheet_entries)
+    except BaseException:
+        shutil.rmtree(target_dir, ignore_errors=True)
+        raise
+
+    metadata['default_sheet'] = metadata['sheet_names'][0] if metadata['sheet_names'] else None
+    return {'manifest': manifest, 'metadata': metadata, 'analysis': analysis or {}}
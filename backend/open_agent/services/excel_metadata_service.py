@@ -1,10 +1,15 @@
 """Excel metadata extraction service."""
 
 import os
+import shutil
 import pandas as pd
 from typing import Dict, List, Any, Optional, Tuple
 from sqlalchemy.orm import Session
 from ..models.excel_file import ExcelFile
+from .columnar_store import ColumnarStore
+from .dataframe_cache import get_dataframe_cache
+from .dataset_profile import PREVIEW_ROWS, format_preview_rows
+from .schema_index import get_schema_index, excel_documents
 from ..db.database import get_db
 import logging
 
@@ -48,25 +53,8 @@ class ExcelMetadataService:
                 # Get column information - ensure proper encoding
                 columns_info[sheet_name] = [str(col) if not isinstance(col, str) else col for col in df.columns.tolist()]
                 
-                # Get preview data (first 5 rows) and convert to JSON serializable format
-                preview_df = df.head(5)
-                # Convert all values to strings to ensure JSON serialization
-                preview_values = []
-                for row in preview_df.values:
-                    string_row = []
-                    for value in row:
-                        if pd.isna(value):
-                            string_row.append(None)
-                        elif hasattr(value, 'strftime'):  # Handle datetime/timestamp objects
-                            string_row.append(value.strftime('%Y-%m-%d %H:%M:%S'))
-                        else:
-                            # Preserve Chinese characters and other unicode content
-                            if isinstance(value, str):
-                                string_row.append(value)
-                            else:
-                                string_row.append(str(value))
-                    preview_values.append(string_row)
-                preview_data[sheet_name] = preview_values
+                # Get preview data (first 5 rows) as JSON serializable strings, formatted column by column
+                preview_data[sheet_name] = format_preview_rows(df.head(PREVIEW_ROWS))
                 
                 # Get data types
                 data_types[sheet_name] = {col: str(dtype) for col, dtype in df.dtypes.items()}
@@ -105,11 +93,18 @@ class ExcelMetadataService:
             }
     
     def save_file_metadata(self, file_path: str, original_filename: str, 
-                          user_id: int, file_size: int) -> ExcelFile:
-        """Extract and save Excel file metadata to database."""
+                          user_id: int, file_size: int,
+                          sheet_artifacts: Optional[Dict[str, str]] = None,
+                          metadata: Optional[Dict[str, Any]] = None) -> ExcelFile:
+        """Extract and save Excel file metadata to database.
+
+        ``metadata`` computed during ingestion is stored as-is; the file is only
+        re-parsed when it is not provided.
+        """
         try:
             # Extract metadata
-            metadata = self.extract_file_metadata(file_path, original_filename, user_id, file_size)
+            if metadata is None:
+                metadata = self.extract_file_metadata(file_path, original_filename, user_id, file_size)
             
             # Determine file type
             file_extension = os.path.splitext(original_filename)[1].lower()
@@ -127,6 +122,7 @@ class ExcelMetadataService:
                 data_types=metadata['data_types'],
                 total_rows=metadata['total_rows'],
                 total_columns=metadata['total_columns'],
+                sheet_artifacts=sheet_artifacts,
                 is_processed=metadata['is_processed'],
                 processing_error=metadata['processing_error']
             )
@@ -145,6 +141,28 @@ class ExcelMetadataService:
             self.db.rollback()
             raise
     
+    def index_file_schema(self, excel_file: ExcelFile) -> None:
+        """Embed sheet descriptions for schema retrieval (best effort)."""
+        schema_index = get_schema_index()
+        if schema_index is None:
+            return
+        documents = excel_documents(excel_file.original_filename, excel_file.columns_info, excel_file.data_types)
+        embeddings = schema_index.index([(documents, excel_file.schema_embedding)])
+        if embeddings:
+            self.save_schema_embeddings({excel_file.id: embeddings[0]})
+    
+    def save_schema_embeddings(self, embeddings: Dict[int, Dict[str, Any]]) -> None:
+        """Persist schema embeddings keyed by file ID."""
+        if not embeddings:
+            return
+        try:
+            for excel_file in self.db.query(ExcelFile).filter(ExcelFile.id.in_(list(embeddings))).all():
+                excel_file.schema_embedding = embeddings[excel_file.id]
+            self.db.commit()
+        except Exception as e:
+            logger.warning(f"Error saving schema embeddings: {str(e)}")
+            self.db.rollback()
+    
     def get_user_files(self, user_id: int, skip: int = 0, limit: int = 50) -> Tuple[List[ExcelFile], int]:
         """Get Excel files for a user with pagination."""
         try:
@@ -175,6 +193,20 @@ class ExcelMetadataService:
             logger.error(f"Error getting file {file_id} for user {user_id}: {str(e)}")
             return None
     
+    def resolve_user_files(self, user_id: int, filenames: List[str]) -> List[ExcelFile]:
+        """Resolve files by original filename with one indexed query, newest first."""
+        if not filenames:
+            return []
+        try:
+            return (self.db.query(ExcelFile)
+                   .filter(ExcelFile.created_by == user_id,
+                           ExcelFile.original_filename.in_(filenames))
+                   .order_by(ExcelFile.created_at.desc(), ExcelFile.id.desc())
+                   .all())
+        except Exception as e:
+            logger.error(f"Error resolving files {filenames} for user {user_id}: {str(e)}")
+            return []
+    
     def delete_file(self, file_id: int, user_id: int) -> bool:
         """Delete Excel file record and physical file."""
         try:
@@ -187,7 +219,15 @@ class ExcelMetadataService:
             if os.path.exists(excel_file.file_path):
                 os.remove(excel_file.file_path)
                 logger.info(f"Deleted physical file: {excel_file.file_path}")
+
+            # Delete columnar artifacts if exist
+            artifact_dir = ColumnarStore.artifact_dir(excel_file.file_path)
+            if artifact_dir.is_dir():
+                shutil.rmtree(artifact_dir, ignore_errors=True)
+                logger.info(f"Deleted columnar artifacts: {artifact_dir}")
             
+            get_dataframe_cache().invalidate(excel_file.id)
+
             # Delete database record
             self.db.delete(excel_file)
             self.db.commit()
@@ -0,0 +1,244 @@
+"""Cache of LLM-generated pandas code for smart Excel queries."""
+
+import difflib
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, Hashable, Optional, Tuple
+
+import pandas as pd
+
+from ..core.config import get_settings
+from ..utils.logger import get_logger
+
+logger = get_logger("generated_code_cache")
+
+# 问题开头的口语化用语，归一化时去掉
+LEADING_FILLERS = ('请帮我', '帮我', '帮忙', '麻烦', '请问', '请', '查询一下', '查一下', '查询', '看看', '告诉我')
+# 问题末尾的语气词
+TRAILING_PARTICLES = '吗呢呀吧啊'
+# 去掉的标点与空白（保留 . % 等可能影响语义的符号，NFKC后全角标点已转为半角）
+_PUNCTUATION_RE = re.compile(r"[\s,?!;:\"'`、。“”‘’《》「」【】()…]+")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+# PythonAstREPLTool 执行出错时返回 "异常类型: 信息" 文本
+_ERROR_RESULT_RE = re.compile(r"^\w+(Error|Exception): ")
+
+
+def normalize_question(question: str) -> str:
+    """归一化问题：全角转半角、小写、去标点空白、去掉开头的客套用语和末尾语气词"""
+    text = unicodedata.normalize('NFKC', question).lower()
+    text = _PUNCTUATION_RE.sub('', text).rstrip('.')
+    stripped = True
+    while stripped:
+        stripped = False
+        for filler in LEADING_FILLERS:
+            if text.startswith(filler) and len(text) > len(filler):
+                text = text[len(filler):]
+                stripped = True
+    return text.rstrip(TRAILING_PARTICLES) or text
+
+
+def schema_fingerprint(datasets: Dict[str, Any]) -> str:
+    """数据集结构指纹：变量名、列名和列类型（与具体文件、数据内容无关）"""
+    schema = [[var_name, list(dataset.column_dtypes().items())] for var_name, dataset in datasets.items()]
+    return hashlib.sha1(json.dumps(schema, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def data_version(datasets: Dict[str, Any]) -> Optional[Tuple[Hashable, ...]]:
+    """数据版本，任一数据集没有版本标识时返回None（不缓存结果）"""
+    versions = tuple(dataset.data_version for dataset in datasets.values())
+    return None if any(version is None for version in versions) else versions
+
+
+def result_fingerprint(result: Any) -> str:
+    """结果指纹，用于观察同一段代码在不同数据版本上的结果是否变化"""
+    digest = hashlib.sha1()
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        digest.update(repr((result.shape, [str(col) for col in getattr(result, 'columns', [])])).encode('utf-8'))
+        try:
+            digest.update(pd.util.hash_pandas_object(result, index=True).to_numpy().tobytes())
+        except TypeError:
+            digest.update(result.to_string().encode('utf-8'))
+    else:
+        digest.update(repr(result).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def is_error_result(result: Any) -> bool:
+    """代码执行结果是否为错误信息"""
+    return isinstance(result, str) and bool(_ERROR_RESULT_RE.match(result.strip()))
+
+
+class CodeCacheEntry:
+    """一条已验证的生成代码"""
+
+    def __init__(self, key: Tuple[Hashable, str, str], question: str, code: str, result_fingerprint: str):
+        self.key = key
+        self.question = question
+        self.code = code
+        self.result_fingerprint = result_fingerprint
+        self.created_at = time.monotonic()
+        self.hits = 0
+
+
+class GeneratedCodeCache:
+    """生成代码缓存
+
+    以 (用户, 数据集结构指纹, 归一化问题) 为键保存执行成功的代码及其结果指纹，同一用户重复或近似的问题
+    直接执行缓存的代码、跳过LLM；可选按数据版本缓存执行结果。按条目数LRU淘汰，超过TTL失效。
+    代码只在同一用户内复用：结构相同的文件可能属于不同用户，代码和结果不跨用户共享。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, similarity: float = 1.0,
+                 result_cache_enabled: bool = False, result_max_entries: int = 200):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.result_cache_enabled = result_cache_enabled
+        self.result_max_entries = result_max_entries
+        self._entries: "OrderedDict[Tuple[Hashable, str, str], CodeCacheEntry]" = OrderedDict()
+        self._results: "OrderedDict[Tuple[Tuple[Hashable, str, str], Hashable], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._near_hits = 0
+        self._misses = 0
+        self._result_hits = 0
+
+    def _expired(self, entry: CodeCacheEntry) -> bool:
+        return self.ttl_seconds > 0 and time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def lookup(self, owner: Hashable, question: str, fingerprint: str) -> Optional[CodeCacheEntry]:
+        """查找用户缓存的代码：先按归一化问题精确匹配，开启相似度匹配时再找同结构下的近似问题"""
+        normalized = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get((owner, fingerprint, normalized))
+            if entry is not None and self._expired(entry):
+                self._remove(entry.key)
+                entry = None
+            if entry is None and self.similarity < 1.0:
+                entry = self._find_similar(owner, normalized, fingerprint)
+                if entry is not None:
+                    self._near_hits += 1
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(entry.key)
+            entry.hits += 1
+            self._hits += 1
+            return entry
+
+    def _find_similar(self, owner: Hashable, normalized: str, fingerprint: str) -> Optional[CodeCacheEntry]:
+        """同一用户、同一结构下相似度最高且数字完全一致的问题（调用方持有锁）"""
+        numbers = _NUMBER_RE.findall(normalized)
+        best, best_ratio = None, self.similarity
+        for (entry_owner, entry_fingerprint, entry_question), entry in self._entries.items():
+            if entry_owner != owner or entry_fingerprint != fingerprint or self._expired(entry):
+                continue
+            if _NUMBER_RE.findall(entry_question) != numbers:
+                continue
+            ratio = difflib.SequenceMatcher(None, normalized, entry_question).ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = entry, ratio
+        return best
+
+    def store(self, owner: Hashable, question: str, fingerprint: str, code: str, result: Any,
+              version: Optional[Hashable] = None) -> Optional[CodeCacheEntry]:
+        """保存用户执行成功的代码（开启结果缓存时同时缓存结果），结果为错误信息时不缓存"""
+        if not code or is_error_result(result):
+            return None
+        key = (owner, fingerprint, normalize_question(question))
+        entry = CodeCacheEntry(key, question, code, result_fingerprint(result))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self._put_result(key, version, result)
+        return entry
+
+    def invalidate(self, entry: CodeCacheEntry) -> None:
+        """缓存的代码在当前数据上执行失败时移除"""
+        with self._lock:
+            self._remove(entry.key)
+        logger.info(f"移除失效的缓存代码: {entry.question[:50]}")
+
+    def _remove(self, key: Tuple[Hashable, str, str]) -> None:
+        """移除代码及其缓存的结果（调用方持有锁）"""
+        self._entries.pop(key, None)
+        for result_key in [result_key for result_key in self._results if result_key[0] == key]:
+            del self._results[result_key]
+
+    def get_result(self, entry: CodeCacheEntry, version: Optional[Hashable]) -> Optional[Any]:
+        """获取缓存的执行结果（同一段代码、同一数据版本）"""
+        if not self.result_cache_enabled or version is None:
+            return None
+        with self._lock:
+            result = self._results.get((entry.key, version))
+            if result is not None:
+                self._results.move_to_end((entry.key, version))
+                self._result_hits += 1
+            return result
+
+    def put_result(self, entry: CodeCacheEntry, version: Optional[Hashable], result: Any) -> None:
+        """按数据版本缓存执行结果，并更新结果指纹"""
+        fingerprint = result_fingerprint(result)
+        if fingerprint != entry.result_fingerprint:
+            logger.info(f"缓存代码的结果已变化（数据更新）: {entry.question[:50]}")
+            entry.result_fingerprint = fingerprint
+        if is_error_result(result):
+            return
+        with self._lock:
+            if entry.key in self._entries:
+                self._put_result(entry.key, version, result)
+
+    def _put_result(self, key: Tuple[Hashable, str, str], version: Optional[Hashable], result: Any) -> None:
+        """写入结果缓存（调用方持有锁）"""
+        if not self.result_cache_enabled or version is None:
+            return
+        self._results[(key, version)] = result
+        while len(self._results) > self.result_max_entries:
+            self._results.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._results.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """命中率指标"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'results': len(self._results),
+                'hits': self._hits,
+                'near_duplicate_hits': self._near_hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else 0.0,
+                'result_hits': self._result_hits
+            }
+
+
+# 全局实例
+_generated_code_cache: Optional[GeneratedCodeCache] = None
+
+
+def get_generated_code_cache() -> Optional[GeneratedCodeCache]:
+    """获取生成代码缓存实例，未启用时返回None"""
+    global _generated_code_cache
+    if _generated_code_cache is None:
+        smart_query_settings = get_settings().smart_query
+        if not smart_query_settings.code_cache_enabled:
+            return None
+        _generated_code_cache = GeneratedCodeCache(
+            max_entries=smart_query_settings.code_cache_max_entries,
+            ttl_seconds=smart_query_settings.code_cache_ttl_seconds,
+            similarity=smart_query_settings.code_cache_similarity,
+            result_cache_enabled=smart_query_settings.result_cache_enabled,
+            result_max_entries=smart_query_settings.result_cache_max_entries
+        )
+    return _generated_code_cache
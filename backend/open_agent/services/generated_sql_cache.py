@@ -0,0 +1,240 @@
+"""Cache of LLM-generated SQL for smart database queries."""
+
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from ..core.config import get_settings
+from ..utils.logger import get_logger
+from .generated_code_cache import normalize_question
+
+logger = get_logger("generated_sql_cache")
+
+# 问题中的字面量：引号内的文本或数字（NFKC后全角数字已转为半角；数字与中文相邻时也视为独立数字）
+_LITERAL_RE = re.compile(r"[\"'“‘「『]([^\"'”’」』]+)[\"'”’」』]|(?<![A-Za-z0-9_.])(\d+(?:\.\d+)?)(?![A-Za-z0-9_.])")
+_NUMBER_RE = re.compile(r"^\d+(?:\.\d+)?$")
+# 不能安全拼进SQL字符串的字符：MySQL默认把反斜杠当作转义符，控制字符可能被驱动或数据库特殊处理
+_UNSAFE_LITERAL_RE = re.compile(r"[\\\x00-\x1f\x7f]")
+# 模板中的参数占位符（不含会被归一化去掉的标点）
+_PLACEHOLDER = "{{p{}}}"
+
+
+def question_template(question: str) -> Tuple[str, List[str]]:
+    """问题模板：引号内文本和数字替换为占位符后归一化，返回 (模板, 字面量列表)"""
+    literals: List[str] = []
+
+    def replace(match: re.Match) -> str:
+        literals.append(match.group(1) if match.group(1) is not None else match.group(2))
+        return f" {_PLACEHOLDER.format(len(literals) - 1)} "
+
+    template = _LITERAL_RE.sub(replace, unicodedata.normalize('NFKC', question))
+    return normalize_question(template), literals
+
+
+def _sql_literal_pattern(value: str) -> re.Pattern:
+    """SQL中的字面量：数字按独立词匹配，文本按单引号字符串匹配"""
+    if _NUMBER_RE.match(value):
+        return re.compile(rf"(?<![\w.']){re.escape(value)}(?![\w.'])")
+    return re.compile(re.escape("'" + value.replace("'", "''") + "'"))
+
+
+def _sql_literal(value: str) -> Optional[str]:
+    """字面量的SQL文本，只对单引号加倍转义；含反斜杠或控制字符的文本无法安全转义，返回None"""
+    if _NUMBER_RE.match(value):
+        return value
+    if _UNSAFE_LITERAL_RE.search(value):
+        return None
+    return "'" + value.replace("'", "''") + "'"
+
+
+def tables_fingerprint(tables_info: Dict[str, Dict[str, Any]]) -> str:
+    """可用表结构指纹：表名、列名和列类型（表结构变化后缓存的SQL自动失效）"""
+    schema = [
+        [name, [[col.get('column_name', col.get('name', '')), col.get('data_type', '')]
+                for col in (info.get('columns') or [])]]
+        for name, info in sorted(tables_info.items())
+    ]
+    return hashlib.sha1(json.dumps(schema, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+class SQLCacheEntry:
+    """一条已执行成功的生成SQL
+
+    sql_template 中 {p0} 等占位符对应问题中的字面量；在SQL中无法唯一定位的字面量记在
+    fixed 中，只有取值相同的问题才能复用。
+    """
+
+    def __init__(self, key: Tuple[Any, str, str], question: str, tables: List[str],
+                 sql_template: str, fixed: Dict[int, str]):
+        self.key = key
+        self.question = question
+        self.tables = tables
+        self.sql_template = sql_template
+        self.fixed = fixed
+        self.created_at = time.monotonic()
+        self.hits = 0
+
+    def render(self, literals: List[str]) -> Optional[str]:
+        """代入当前问题的字面量，固定字面量不一致或字面量无法安全代入时返回None"""
+        if any(index >= len(literals) or literals[index] != value for index, value in self.fixed.items()):
+            return None
+        sql = self.sql_template
+        for index, value in enumerate(literals):
+            if index not in self.fixed:
+                literal = _sql_literal(value)
+                if literal is None:
+                    return None
+                sql = sql.replace(_PLACEHOLDER.format(index), literal)
+        return sql
+
+
+class SQLCacheHit:
+    """缓存命中：目标表和代入字面量后的SQL"""
+
+    def __init__(self, entry: SQLCacheEntry, sql: str):
+        self.entry = entry
+        self.tables = entry.tables
+        self.sql = sql
+
+
+class GeneratedSQLCache:
+    """生成SQL缓存
+
+    以 (数据源ID, 表结构指纹, 问题模板) 为键保存执行成功的SQL，问题中的数字和引号内文本
+    作为参数：只是字面量不同的问题（如"销量前10"与"销量前20"）代入新值后直接执行，
+    跳过选表和SQL生成两次LLM调用。可选按 (数据源ID, SQL) 在TTL内缓存查询结果，
+    用于反复刷新的固定问题。按条目数LRU淘汰，超过TTL失效。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, result_ttl_seconds: int = 0,
+                 result_max_entries: int = 200):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.result_max_entries = result_max_entries
+        self._entries: "OrderedDict[Tuple[Any, str, str], SQLCacheEntry]" = OrderedDict()
+        self._results: "OrderedDict[Tuple[Any, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._result_hits = 0
+
+    def _expired(self, entry: SQLCacheEntry) -> bool:
+        return self.ttl_seconds > 0 and time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def lookup(self, datasource_id: Any, fingerprint: str, question: str) -> Optional[SQLCacheHit]:
+        """查找缓存的SQL并代入当前问题的字面量"""
+        template, literals = question_template(question)
+        key = (datasource_id, fingerprint, template)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._entries.pop(key, None)
+                entry = None
+            sql = entry.render(literals) if entry is not None else None
+            if sql is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            self._hits += 1
+            return SQLCacheHit(entry, sql)
+
+    def store(self, datasource_id: Any, fingerprint: str, question: str, tables: List[str],
+              sql: str) -> Optional[SQLCacheEntry]:
+        """保存执行成功的SQL，能在SQL中唯一定位的字面量替换为参数"""
+        if not sql:
+            return None
+        template, literals = question_template(question)
+        sql_template, fixed = sql, {}
+        for index, value in enumerate(literals):
+            matches = _sql_literal_pattern(value).findall(sql_template)
+            # 重复的字面量、在SQL中出现多次/未出现的字面量以及不能安全转义的字面量不作为参数，要求取值完全相同
+            if literals.count(value) > 1 or len(matches) != 1 or _sql_literal(value) is None:
+                fixed[index] = value
+                continue
+            sql_template = _sql_literal_pattern(value).sub(lambda _: _PLACEHOLDER.format(index), sql_template)
+        key = (datasource_id, fingerprint, template)
+        entry = SQLCacheEntry(key, question, list(tables), sql_template, fixed)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, hit: SQLCacheHit) -> None:
+        """缓存的SQL执行失败时移除"""
+        with self._lock:
+            self._entries.pop(hit.entry.key, None)
+        logger.info(f"移除失效的缓存SQL: {hit.entry.question[:50]}")
+
+    def get_result(self, datasource_id: Any, sql: str) -> Optional[Dict[str, Any]]:
+        """获取TTL内缓存的查询结果"""
+        if self.result_ttl_seconds <= 0:
+            return None
+        key = (datasource_id, sql)
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is None:
+                return None
+            stored_at, result = cached
+            if time.monotonic() - stored_at > self.result_ttl_seconds:
+                del self._results[key]
+                return None
+            self._results.move_to_end(key)
+            self._result_hits += 1
+            return result
+
+    def put_result(self, datasource_id: Any, sql: str, result: Dict[str, Any]) -> None:
+        """缓存查询结果（未开启结果缓存时忽略）"""
+        if self.result_ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._results[(datasource_id, sql)] = (time.monotonic(), result)
+            self._results.move_to_end((datasource_id, sql))
+            while len(self._results) > self.result_max_entries:
+                self._results.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._results.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """命中率指标"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'results': len(self._results),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else 0.0,
+                'result_hits': self._result_hits
+            }
+
+
+# 全局实例
+_generated_sql_cache: Optional[GeneratedSQLCache] = None
+
+
+def get_generated_sql_cache() -> Optional[GeneratedSQLCache]:
+    """获取生成SQL缓存实例，未启用时返回None"""
+    global _generated_sql_cache
+    if _generated_sql_cache is None:
+        smart_query_settings = get_settings().smart_query
+        if not smart_query_settings.sql_cache_enabled:
+            return None
+        _generated_sql_cache = GeneratedSQLCache(
+            max_entries=smart_query_settings.sql_cache_max_entries,
+            ttl_seconds=smart_query_settings.sql_cache_ttl_seconds,
+            result_ttl_seconds=smart_query_settings.sql_result_cache_ttl_seconds,
+            result_max_entries=smart_query_settings.result_cache_max_entries
+        )
+    return _generated_sql_cache
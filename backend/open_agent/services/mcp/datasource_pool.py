@@ -0,0 +1,401 @@
+"""Per-datasource connection pools for the database MCP tools."""
+
+import asyncio
+import hashlib
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Optional
+
+from open_agent.core.config import get_settings
+from open_agent.core.executor import get_executor_pools
+from open_agent.utils.logger import get_logger
+
+logger = get_logger("datasource_pool")
+
+# 跨数据源检查空闲连接的最小间隔
+EVICT_INTERVAL_SECONDS = 30
+
+
+class PoolTimeoutError(Exception):
+    """连接池已满，等待可用连接超时"""
+    pass
+
+
+class DatasourceNotConnectedError(Exception):
+    """用户尚未连接数据源"""
+    pass
+
+
+def _checked_out(connection: Any) -> bool:
+    """健康检查：能从连接池取出连接（新建或探活通过）即可用"""
+    return True
+
+
+def config_fingerprint(config: Dict[str, Any]) -> str:
+    """连接配置指纹，配置（含密码）变化时重建连接池"""
+    parts = [str(config.get(key, '')) for key in ('host', 'port', 'database', 'username', 'password')]
+    return hashlib.sha1('\x00'.join(parts).encode('utf-8')).hexdigest()
+
+
+class PooledConnection:
+    """池中的一个连接"""
+
+    def __init__(self, connection: Any):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class DatasourcePool:
+    """单个数据源的有界连接池（线程安全，在数据库线程池中使用）
+
+    - 最多 max_size 个连接，超出时等待 checkout_timeout 秒后报错
+    - 空闲超过 idle_timeout 或存活超过 max_lifetime 的连接被关闭
+    - 空闲超过 pre_ping_idle 秒的连接在取出前先探活，失效则重建
+    - 归还时回滚未结束的事务，回滚失败（连接已断开）的连接直接丢弃
+    - 记录最近一次成功取出/归还连接的时间作为健康状态，请求不必每次单独测试连接
+    """
+
+    def __init__(self, key: str, config: Dict[str, Any], connect: Callable[[Dict[str, Any]], Any],
+                 ping: Callable[[Any], bool], max_size: int, checkout_timeout: float,
+                 idle_timeout: float, max_lifetime: float, pre_ping_idle: float):
+        self.key = key
+        self.config = config
+        self.fingerprint = config_fingerprint(config)
+        self._connect = connect
+        self._ping = ping
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.pre_ping_idle = pre_ping_idle
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle: Deque[PooledConnection] = deque()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._in_use = 0
+        self._created = 0
+        self._reused = 0
+        self._reconnects = 0
+        self._evicted = 0
+        self._last_healthy: Optional[float] = None
+        self._last_error: Optional[str] = None
+
+    @staticmethod
+    def _close_connection(item: PooledConnection) -> None:
+        try:
+            item.connection.close()
+        except Exception:
+            pass
+
+    def _expired(self, item: PooledConnection, now: float) -> bool:
+        return self.max_lifetime > 0 and now - item.created_at > self.max_lifetime
+
+    def acquire(self) -> PooledConnection:
+        """取出连接（阻塞）"""
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise PoolTimeoutError(f"数据源 {self.key} 连接池已满（{self.max_size}），等待超时")
+        try:
+            while True:
+                with self._lock:
+                    # 后进先出：优先复用最近使用过的连接
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    item = PooledConnection(self._connect(self.config))
+                    with self._lock:
+                        self._created += 1
+                    break
+                now = time.monotonic()
+                if self._expired(item, now):
+                    self._close_connection(item)
+                    with self._lock:
+                        self._evicted += 1
+                    continue
+                if now - item.last_used >= self.pre_ping_idle and not self._ping(item.connection):
+                    self._close_connection(item)
+                    with self._lock:
+                        self._reconnects += 1
+                    continue
+                with self._lock:
+                    self._reused += 1
+                break
+        except Exception as e:
+            self._slots.release()
+            with self._lock:
+                self._last_healthy = None
+                self._last_error = str(e)
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._last_healthy = time.monotonic()
+        return item
+
+    def release(self, item: PooledConnection) -> None:
+        """归还连接"""
+        keep = not self._closed
+        if keep:
+            try:
+                item.connection.rollback()
+            except Exception:
+                keep = False
+        if keep:
+            item.last_used = time.monotonic()
+            with self._lock:
+                self._idle.append(item)
+                self._last_healthy = item.last_used
+        else:
+            self._close_connection(item)
+        with self._lock:
+            self._in_use -= 1
+        self._slots.release()
+
+    def run(self, func: Callable, *args, **kwargs) -> Any:
+        """取出连接执行 func(connection, ...)，结束后归还（阻塞）"""
+        item = self.acquire()
+        try:
+            return func(item.connection, *args, **kwargs)
+        finally:
+            self.release(item)
+
+    def is_healthy(self, max_age: float) -> bool:
+        """最近 max_age 秒内成功取出或归还过连接"""
+        last_healthy = self._last_healthy
+        return last_healthy is not None and time.monotonic() - last_healthy <= max_age
+
+    def evict_idle(self) -> int:
+        """关闭空闲过久或存活过久的连接"""
+        now = time.monotonic()
+        with self._lock:
+            stale = [item for item in self._idle
+                     if now - item.last_used > self.idle_timeout or self._expired(item, now)]
+            for item in stale:
+                self._idle.remove(item)
+            self._evicted += len(stale)
+        for item in stale:
+            self._close_connection(item)
+        return len(stale)
+
+    def close(self) -> None:
+        """关闭空闲连接，使用中的连接归还时关闭"""
+        self._closed = True
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for item in idle:
+            self._close_connection(item)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'created': self._created,
+                'reused': self._reused,
+                'reconnects': self._reconnects,
+                'evicted': self._evicted,
+                'healthy_seconds_ago': (round(time.monotonic() - self._last_healthy, 1)
+                                        if self._last_healthy is not None else None),
+                'last_error': self._last_error
+            }
+
+
+class DatasourcePoolManager:
+    """按数据源（DatabaseConfig.id）管理连接池
+
+    阻塞的数据库驱动调用都在共享执行器的 db 线程池中执行；每个用户同时执行的
+    数据库操作数有上限，避免单个用户占满连接池。
+    """
+
+    def __init__(self, max_size: int, checkout_timeout: float, idle_timeout: float,
+                 max_lifetime: float, pre_ping_idle: float, per_user_limit: int):
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.pre_ping_idle = pre_ping_idle
+        self.per_user_limit = per_user_limit
+        self._pools: Dict[str, DatasourcePool] = {}
+        self._user_limits: Dict[str, asyncio.Semaphore] = {}
+        self._lock = threading.Lock()
+        self._last_evict = time.monotonic()
+
+    def get_pool(self, key: str, config: Dict[str, Any], connect: Callable[[Dict[str, Any]], Any],
+                 ping: Callable[[Any], bool]) -> DatasourcePool:
+        """获取数据源的连接池，不存在或连接配置已变化时新建"""
+        fingerprint = config_fingerprint(config)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None and pool.fingerprint == fingerprint:
+                return pool
+            if pool is not None:
+                pool.close()
+                logger.info(f"数据源 {key} 连接配置已变化，重建连接池")
+            pool = DatasourcePool(
+                key, config, connect, ping,
+                max_size=self.max_size,
+                checkout_timeout=self.checkout_timeout,
+                idle_timeout=self.idle_timeout,
+                max_lifetime=self.max_lifetime,
+                pre_ping_idle=self.pre_ping_idle
+            )
+            self._pools[key] = pool
+            return pool
+
+    def _user_limit(self, user_id: Optional[str]) -> asyncio.Semaphore:
+        semaphore = self._user_limits.get(user_id)
+        if semaphore is None:
+            semaphore = self._user_limits[user_id] = asyncio.Semaphore(self.per_user_limit)
+        return semaphore
+
+    async def run(self, key: str, user_id: Optional[str], func: Callable, *args, **kwargs) -> Any:
+        """在数据源连接上执行 func(connection, ...)"""
+        pool = self._pools.get(key)
+        if pool is None:
+            raise DatasourceNotConnectedError(f"数据源 {key} 未连接")
+        self._maybe_evict()
+        async with self._user_limit(user_id):
+            return await get_executor_pools().run_db(pool.run, func, *args, **kwargs)
+
+    async def check_health(self, key: str, user_id: Optional[str]) -> bool:
+        """
+        数据源健康检查：pre_ping_idle 秒内成功使用过的连接池直接视为可用，不产生数据库往返；
+        否则取出一个连接（空闲过久的连接会先探活，失效则重建），连接失败时抛出异常
+
+        Returns:
+            是否实际访问了数据库
+        """
+        pool = self._pools.get(key)
+        if pool is None:
+            raise DatasourceNotConnectedError(f"数据源 {key} 未连接")
+        if pool.is_healthy(self.pre_ping_idle):
+            return False
+        await self.run(key, user_id, _checked_out)
+        return True
+
+    def _maybe_evict(self) -> None:
+        now = time.monotonic()
+        if now - self._last_evict < EVICT_INTERVAL_SECONDS:
+            return
+        self._last_evict = now
+        for pool in list(self._pools.values()):
+            pool.evict_idle()
+
+    def close_pool(self, key: str) -> None:
+        with self._lock:
+            pool = self._pools.pop(key, None)
+        if pool is not None:
+            pool.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {key: pool.get_stats() for key, pool in list(self._pools.items())}
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+
+class PooledDatasourceMixin:
+    """数据库MCP工具的数据源连接管理
+
+    ``connections`` 记录用户当前连接的数据源（兼容按用户ID调用的工具接口），真正的连接
+    由 DatasourcePoolManager 按数据源共享。工具类需提供 ``pool_prefix``、
+    ``_create_connection(config)`` 和 ``_ping(connection)``。
+    """
+
+    pool_prefix = "db"
+
+    def _datasource_key(self, config: Dict[str, Any], datasource_id: Optional[Any] = None) -> str:
+        """数据源键：有DatabaseConfig.id时按ID，否则按连接地址"""
+        if datasource_id is not None:
+            return f"{self.pool_prefix}:{datasource_id}"
+        address = f"{config.get('host')}:{config.get('port')}/{config.get('database')}/{config.get('username')}"
+        return f"{self.pool_prefix}:{hashlib.sha1(address.encode('utf-8')).hexdigest()[:16]}"
+
+    def register_datasource(self, user_id: str, connection_config: Dict[str, Any],
+                            datasource_id: Optional[Any] = None) -> str:
+        """登记用户使用的数据源并准备连接池（不建立连接）"""
+        key = self._datasource_key(connection_config, datasource_id)
+        get_datasource_pools().get_pool(key, connection_config, self._create_connection, self._ping)
+        self.connections[user_id] = {
+            "datasource": key,
+            "datasource_id": datasource_id,
+            "config": connection_config,
+            "connected_at": datetime.now().isoformat()
+        }
+        return key
+
+    def _user_entry(self, user_id: Optional[str], datasource_id: Optional[Any] = None) -> Optional[Dict[str, Any]]:
+        """用户自己登记的数据源（指定datasource_id时要求登记的是该数据源）
+
+        连接池按数据源共享，但只能通过用户自己的登记访问：登记发生在凭据解析的归属检查之后，
+        其他用户为同一数据源建立的连接池不能用来跳过该检查。
+        """
+        entry = self.connections.get(user_id) if user_id else None
+        if entry is None or (datasource_id is not None and entry.get("datasource_id") != datasource_id):
+            return None
+        return entry
+
+    def is_connected(self, user_id: Optional[str], datasource_id: Optional[Any] = None) -> bool:
+        """用户是否已连接（指定datasource_id时要求连接的是该数据源）"""
+        return self._user_entry(user_id, datasource_id) is not None
+
+    def _resolve_datasource(self, user_id: Optional[str], datasource_id: Optional[Any] = None) -> str:
+        entry = self._user_entry(user_id, datasource_id)
+        if entry is None:
+            raise DatasourceNotConnectedError("用户未连接数据库，请先执行connect操作")
+        return entry["datasource"]
+
+    async def _run_pooled(self, user_id: Optional[str], datasource_id: Optional[Any],
+                          func: Callable, *args, **kwargs) -> Any:
+        """在用户数据源的池化连接上执行阻塞函数"""
+        key = self._resolve_datasource(user_id, datasource_id)
+        return await get_datasource_pools().run(key, user_id, func, *args, **kwargs)
+
+    async def check_datasource_health(self, user_id: Optional[str], datasource_id: Optional[Any] = None) -> bool:
+        """检查用户数据源是否可用（使用连接池的健康状态，必要时取出连接验证）"""
+        key = self._resolve_datasource(user_id, datasource_id)
+        return await get_datasource_pools().check_health(key, user_id)
+
+    def _disconnect_user(self, user_id: str) -> bool:
+        """移除用户的数据源登记，没有其他用户使用时关闭连接池"""
+        entry = self.connections.pop(user_id, None)
+        if entry is None:
+            return False
+        key = entry["datasource"]
+        if not any(other["datasource"] == key for other in self.connections.values()):
+            get_datasource_pools().close_pool(key)
+        return True
+
+
+# 全局实例
+_datasource_pools: Optional[DatasourcePoolManager] = None
+
+
+def get_datasource_pools() -> DatasourcePoolManager:
+    """获取数据源连接池管理器"""
+    global _datasource_pools
+    if _datasource_pools is None:
+        pool_settings = get_settings().datasource_pool
+        _datasource_pools = DatasourcePoolManager(
+            max_size=pool_settings.max_size,
+            checkout_timeout=pool_settings.checkout_timeout_seconds,
+            idle_timeout=pool_settings.idle_timeout_seconds,
+            max_lifetime=pool_settings.max_lifetime_seconds,
+            pre_ping_idle=pool_settings.pre_ping_idle_seconds,
+            per_user_limit=pool_settings.per_user_limit
+        )
+    return _datasource_pools
+
+
+def shutdown_datasource_pools() -> None:
+    """关闭全部连接池（应用关闭时调用）"""
+    global _datasource_pools
+    if _datasource_pools is not None:
+        _datasource_pools.shutdown()
+        _datasource_pools = None
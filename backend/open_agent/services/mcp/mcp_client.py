@@ -0,0 +1,253 @@
+"""Shared HTTP client for the MCP server: pooled async tool calls and cached tool discovery."""
+
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from open_agent.core.config import get_settings
+from open_agent.utils.logger import get_logger
+
+logger = get_logger("mcp_client")
+
+DEFAULT_MCP_SERVER_URL = "http://127.0.0.1:8001"
+# 服务端暂时不可用、请求未被处理时重试的状态码（504 时工具可能仍在执行，和工具本身的错误一样不重试）
+RETRY_STATUS_CODES = {502, 503}
+# 连接建立前的异常，请求没有发出，重试不会重复执行工具（连接中断可能发生在请求发出之后，不重试）
+RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class MCPClient:
+    """MCP服务客户端
+
+    - 异步调用共享一个 httpx.AsyncClient（keep-alive，安装 h2 时启用HTTP/2），不阻塞事件循环
+    - 每个工具可单独配置超时；连接失败和 502/503 按指数退避重试
+    - /tools 工具列表按TTL缓存，过期后携带 ETag 重新验证，未变化时服务端返回304
+    """
+
+    def __init__(self, base_url: str, timeout: float, connect_timeout: float, max_retries: int,
+                 retry_backoff: float, tool_timeouts: Dict[str, float], tools_cache_ttl: float,
+                 max_connections: int, http2: bool):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.tool_timeouts = tool_timeouts or {}
+        self.tools_cache_ttl = tools_cache_ttl
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            logger.info("未安装 h2，MCP 客户端使用 HTTP/1.1 keep-alive")
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sync_client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+        self._tools: Optional[List[Dict[str, Any]]] = None
+        self._tools_etag: Optional[str] = None
+        self._tools_fetched_at = 0.0
+
+    def _timeout(self, seconds: Optional[float] = None) -> httpx.Timeout:
+        return httpx.Timeout(seconds or self.timeout, connect=self.connect_timeout)
+
+    def tool_timeout(self, tool_name: str) -> float:
+        return self.tool_timeouts.get(tool_name, self.timeout)
+
+    async def _get_async_client(self) -> httpx.AsyncClient:
+        # 连接池绑定创建时的事件循环，事件循环变化时关闭旧客户端再重建
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            old_client, old_loop = self._async_client, self._async_loop
+            self._async_client = httpx.AsyncClient(
+                base_url=self.base_url, timeout=self._timeout(), limits=self.limits, http2=self.http2
+            )
+            self._async_loop = loop
+            if old_client is not None:
+                await self._close_stale_client(old_client, old_loop)
+        return self._async_client
+
+    @staticmethod
+    async def _close_stale_client(client: httpx.AsyncClient, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        """关闭绑定在旧事件循环上的客户端，旧循环仍在运行时交给它自己关闭"""
+        try:
+            if loop is not None and loop.is_running() and not loop.is_closed():
+                asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+            else:
+                await client.aclose()
+        except Exception as e:
+            logger.debug(f"关闭旧的 MCP 异步客户端失败: {e}")
+
+    def _get_sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._sync_client is None:
+                self._sync_client = httpx.Client(
+                    base_url=self.base_url, timeout=self._timeout(), limits=self.limits, http2=self.http2
+                )
+            return self._sync_client
+
+    def _should_retry(self, attempt: int, error: Optional[Exception] = None,
+                      response: Optional[httpx.Response] = None) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if error is not None:
+            return isinstance(error, RETRY_EXCEPTIONS)
+        return response is not None and response.status_code in RETRY_STATUS_CODES
+
+    def _backoff(self, attempt: int) -> float:
+        return self.retry_backoff * (2 ** attempt)
+
+    async def _arequest(self, method: str, path: str, timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+        client = await self._get_async_client()
+        attempt = 0
+        while True:
+            try:
+                # httpx 的读超时针对单次读取，外层再限制整次请求的总时间
+                response = await asyncio.wait_for(
+                    client.request(method, path, timeout=self._timeout(timeout), **kwargs), timeout or self.timeout
+                )
+            except Exception as e:
+                if not self._should_retry(attempt, error=e):
+                    raise
+                logger.warning(f"MCP 请求 {path} 失败，第{attempt + 1}次重试: {e}")
+            else:
+                if not self._should_retry(attempt, response=response):
+                    return response
+                logger.warning(f"MCP 请求 {path} 返回 {response.status_code}，第{attempt + 1}次重试")
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def _request(self, method: str, path: str, timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+        client = self._get_sync_client()
+        attempt = 0
+        while True:
+            try:
+                response = client.request(method, path, timeout=self._timeout(timeout), **kwargs)
+            except Exception as e:
+                if not self._should_retry(attempt, error=e):
+                    raise
+                logger.warning(f"MCP 请求 {path} 失败，第{attempt + 1}次重试: {e}")
+            else:
+                if not self._should_retry(attempt, response=response):
+                    return response
+                logger.warning(f"MCP 请求 {path} 返回 {response.status_code}，第{attempt + 1}次重试")
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    @staticmethod
+    def _error_result(tool_name: str, error: Exception) -> Dict[str, Any]:
+        logger.error(f"MCP 工具调用失败: {tool_name}: {error}")
+        return {
+            "success": False,
+            "error": str(error) or error.__class__.__name__,
+            "result": None,
+            "tool_name": tool_name,
+        }
+
+    @staticmethod
+    def _payload(tool_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {"tool_name": tool_name, "parameters": params}
+
+    async def call_tool(self, tool_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """异步调用MCP工具，失败时返回 success=False 的结果"""
+        logger.info(f"调用 MCP 工具: {tool_name} 参数: {params}")
+        timeout = self.tool_timeout(tool_name)
+        try:
+            response = await self._arequest("POST", "/execute", timeout=timeout, json=self._payload(tool_name, params))
+            response.raise_for_status()
+            return response.json()
+        except asyncio.TimeoutError:
+            return self._error_result(tool_name, TimeoutError(f"MCP 工具调用超时（{timeout}秒）"))
+        except Exception as e:
+            return self._error_result(tool_name, e)
+
+    def call_tool_sync(self, tool_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """同步调用MCP工具（同步代码路径使用）"""
+        logger.info(f"调用 MCP 工具: {tool_name} 参数: {params}")
+        try:
+            response = self._request(
+                "POST", "/execute", timeout=self.tool_timeout(tool_name), json=self._payload(tool_name, params)
+            )
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            return self._error_result(tool_name, e)
+
+    async def call_tools(self, calls: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """并行调用多个MCP工具，结果按调用顺序返回"""
+        return list(await asyncio.gather(*(self.call_tool(name, params) for name, params in calls)))
+
+    def _tools_fresh(self) -> bool:
+        return self._tools is not None and time.monotonic() - self._tools_fetched_at < self.tools_cache_ttl
+
+    def _tools_headers(self) -> Dict[str, str]:
+        return {"If-None-Match": self._tools_etag} if self._tools_etag and self._tools is not None else {}
+
+    def _store_tools(self, response: httpx.Response) -> List[Dict[str, Any]]:
+        if response.status_code == 304 and self._tools is not None:
+            logger.debug("MCP 工具列表未变化")
+        else:
+            response.raise_for_status()
+            self._tools = response.json()
+            self._tools_etag = response.headers.get("ETag")
+        self._tools_fetched_at = time.monotonic()
+        return self._tools
+
+    def list_tools(self) -> List[Dict[str, Any]]:
+        """获取MCP工具列表（缓存未过期时不访问服务端）"""
+        if self._tools_fresh():
+            return self._tools
+        return self._store_tools(self._request("GET", "/tools", headers=self._tools_headers()))
+
+    async def alist_tools(self) -> List[Dict[str, Any]]:
+        """异步获取MCP工具列表"""
+        if self._tools_fresh():
+            return self._tools
+        return self._store_tools(await self._arequest("GET", "/tools", headers=self._tools_headers()))
+
+    def invalidate_tools(self) -> None:
+        self._tools_fetched_at = 0.0
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_loop = None
+        with self._lock:
+            if self._sync_client is not None:
+                self._sync_client.close()
+                self._sync_client = None
+
+
+# 全局实例
+_mcp_client: Optional[MCPClient] = None
+
+
+def get_mcp_client() -> MCPClient:
+    """获取MCP服务客户端"""
+    global _mcp_client
+    if _mcp_client is None:
+        tool_settings = get_settings().tool
+        _mcp_client = MCPClient(
+            base_url=tool_settings.mcp_server_url or os.getenv("MCP_SERVER_URL") or DEFAULT_MCP_SERVER_URL,
+            timeout=tool_settings.mcp_timeout_seconds,
+            connect_timeout=tool_settings.mcp_connect_timeout_seconds,
+            max_retries=tool_settings.mcp_max_retries,
+            retry_backoff=tool_settings.mcp_retry_backoff_seconds,
+            tool_timeouts=tool_settings.mcp_tool_timeouts,
+            tools_cache_ttl=tool_settings.mcp_tools_cache_ttl_seconds,
+            max_connections=tool_settings.mcp_max_connections,
+            http2=tool_settings.mcp_http2
+        )
+    return _mcp_client
+
+
+async def shutdown_mcp_client() -> None:
+    """关闭MCP客户端连接（应用关闭时调用）"""
+    global _mcp_client
+    if _mcp_client is not None:
+        await _mcp_client.aclose()
+        _mcp_client = None
@@ -1,17 +1,15 @@
 """Dynamic MCP tool wrapper for LangChain/LangGraph.
 
 Fetches available MCP tools from the MCP server and exposes them as LangChain BaseTool
-instances that call the MCP `/execute` endpoint at runtime.
+instances that call the MCP `/execute` endpoint at runtime through the shared MCP client.
 """
 from typing import Any, Dict, List, Optional, Type
 import json
-import requests
 from pydantic import BaseModel, Field, PrivateAttr
 from langchain.tools import BaseTool
 
-from open_agent.core.config import get_settings
 from open_agent.utils.logger import get_logger
-import os
+from open_agent.services.mcp.mcp_client import get_mcp_client
 
 logger = get_logger("mcp_dynamic_tools")
 
@@ -66,10 +64,9 @@ class MCPDynamicTool(BaseTool):
     description: str
     args_schema: Type[BaseModel]
 
-    _mcp_base_url: str = PrivateAttr()
     _tool_name: str = PrivateAttr()
 
-    def __init__(self, mcp_base_url: str, tool_info: Dict[str, Any]):
+    def __init__(self, tool_info: Dict[str, Any]):
         # Initialize BaseTool with dynamic metadata
         super().__init__(
             name=tool_info.get("name", "tool"),
@@ -77,33 +74,10 @@ class MCPDynamicTool(BaseTool):
             args_schema=_build_args_schema(tool_info.get("parameters", [])),
         )
         # set private attrs after BaseTool init to avoid pydantic stripping
-        self._mcp_base_url = mcp_base_url.rstrip("/")
         self._tool_name = tool_info["name"]
 
-    def _execute(self, params: Dict[str, Any]) -> Dict[str, Any]:
-        url = f"{self._mcp_base_url}/execute"
-        payload = {
-            "tool_name": self._tool_name,
-            "parameters": params,
-        }
-        logger.info(f"调用 MCP 工具: {self._tool_name} 参数: {params}")
-        try:
-            resp = requests.post(url, json=payload, timeout=30)
-            resp.raise_for_status()
-            data = resp.json()
-            return data
-        except Exception as e:
-            logger.error(f"MCP 工具调用失败: {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "result": None,
-                "tool_name": self._tool_name,
-            }
-
-    def _run(self, **kwargs: Any) -> str:
-        """Synchronous execution for LangChain tools."""
-        data = self._execute(kwargs)
+    @staticmethod
+    def _format_result(data: Any) -> str:
         if not isinstance(data, dict):
             return json.dumps({"success": False, "error": "Invalid MCP response"}, ensure_ascii=False)
         # Return string content; LangChain expects textual content for ToolMessage
@@ -111,37 +85,49 @@ class MCPDynamicTool(BaseTool):
             return json.dumps(data.get("result", {}), ensure_ascii=False)
         return json.dumps({"error": data.get("error")}, ensure_ascii=False)
 
+    def _run(self, **kwargs: Any) -> str:
+        """Synchronous execution for LangChain tools."""
+        return self._format_result(get_mcp_client().call_tool_sync(self._tool_name, kwargs))
+
     async def _arun(self, **kwargs: Any) -> str:
-        # LangChain will call async version when available; we simply delegate to sync for now.
-        return self._run(**kwargs)
+        """Async execution on the shared HTTP client; does not block the event loop."""
+        return self._format_result(await get_mcp_client().call_tool(self._tool_name, kwargs))
+
+
+def _build_dynamic_tools(tools_info: List[Dict[str, Any]], include: Optional[List[str]]) -> List[MCPDynamicTool]:
+    dynamic_tools: List[MCPDynamicTool] = []
+    for tool in tools_info:
+        name = tool.get("name")
+        if include and name not in include:
+            continue
+        try:
+            dynamic_tools.append(MCPDynamicTool(tool_info=tool))
+        except Exception as e:
+            logger.warning(f"构建 MCP 工具'{name}'失败: {e}")
+    logger.debug(f"已加载 MCP 工具: {[t.name for t in dynamic_tools]}")
+    return dynamic_tools
 
 
 def load_mcp_tools(include: Optional[List[str]] = None) -> List[MCPDynamicTool]:
     """Load MCP tools from the MCP server and construct dynamic tools.
 
     include: optional list of tool names to include (e.g., ["weather", "search"]).
+    The tool list is cached by the MCP client (TTL + ETag revalidation).
+    Blocking; async code should use ``aload_mcp_tools``.
     """
-    settings = get_settings()
-    # Try settings.tool.mcp_server_url, fallback to default
-    mcp_base_url = getattr(settings.tool, "mcp_server_url", None) or os.getenv("MCP_SERVER_URL") or "http://127.0.0.1:8001"
-
-    url = f"{mcp_base_url.rstrip('/')}/tools"
     try:
-        resp = requests.get(url, timeout=15)
-        resp.raise_for_status()
-        tools_info = resp.json()
+        tools_info = get_mcp_client().list_tools()
     except Exception as e:
         logger.error(f"获取 MCP 工具列表失败: {e}")
         return []
+    return _build_dynamic_tools(tools_info, include)
 
-    dynamic_tools: List[MCPDynamicTool] = []
-    for tool in tools_info:
-        name = tool.get("name")
-        if include and name not in include:
-            continue
-        try:
-            dynamic_tools.append(MCPDynamicTool(mcp_base_url=mcp_base_url, tool_info=tool))
-        except Exception as e:
-            logger.warning(f"构建 MCP 工具'{name}'失败: {e}")
-    logger.info(f"已加载 MCP 工具: {[t.name for t in dynamic_tools]}")
-    return dynamic_tools
\ No newline at end of file
+
+async def aload_mcp_tools(include: Optional[List[str]] = None) -> List[MCPDynamicTool]:
+    """Async variant of ``load_mcp_tools`` on the shared async HTTP client."""
+    try:
+        tools_info = await get_mcp_client().alist_tools()
+    except Exception as e:
+        logger.error(f"获取 MCP 工具列表失败: {e}")
+        return []
+    return _build_dynamic_tools(tools_info, include)
@@ -3,20 +3,26 @@
 import json
 import pymysql
 from typing import List, Dict, Any, Optional
-from datetime import datetime
 
+from open_agent.core.config import get_settings
+from open_agent.core.executor import get_executor_pools
 from open_agent.services.agent.base import BaseTool, ToolParameter, ToolParameterType, ToolResult
+from open_agent.services.mcp.datasource_pool import PooledDatasourceMixin
+from open_agent.services.mcp.query_fetch import wrap_limit, fetch_arrow, arrow_to_records
+from open_agent.services.sql_guard import summarize_mysql_plan
 from open_agent.utils.logger import get_logger
 
 logger = get_logger("mysql_mcp_tool")
 
 
-class MySQLMCPTool(BaseTool):
+class MySQLMCPTool(PooledDatasourceMixin, BaseTool):
     """MySQL MCP tool for database operations and intelligent querying."""
     
+    pool_prefix = "mysql"
+    
     def __init__(self):
         super().__init__()
-        self.connections = {}  # 存储用户的数据库连接
+        self.connections = {}  # 用户当前使用的数据源（连接由数据源连接池管理）
     
     def get_name(self) -> str:
         return "mysql_mcp"
@@ -31,7 +37,7 @@ class MySQLMCPTool(BaseTool):
                 type=ToolParameterType.STRING,
                 description="操作类型",
                 required=True,
-                enum=["connect", "list_tables", "describe_table", "execute_query", "test_connection", "disconnect"]
+                enum=["connect", "list_tables", "describe_table", "describe_tables", "execute_query", "explain_query", "test_connection", "disconnect"]
             ),
             ToolParameter(
                 name="connection_config",
@@ -51,10 +57,16 @@ class MySQLMCPTool(BaseTool):
                 description="表名（用于describe_table操作）",
                 required=False
             ),
+            ToolParameter(
+                name="table_names",
+                type=ToolParameterType.ARRAY,
+                description="表名列表（用于describe_tables操作，批量获取表结构）",
+                required=False
+            ),
             ToolParameter(
                 name="sql_query",
                 type=ToolParameterType.STRING,
-                description="SQL查询语句（用于execute_query操作）",
+                description="SQL查询语句（用于execute_query、explain_query操作）",
                 required=False
             ),
             ToolParameter(
@@ -63,6 +75,12 @@ class MySQLMCPTool(BaseTool):
                 description="查询结果限制数量，默认100",
                 required=False,
                 default=100
+            ),
+            ToolParameter(
+                name="timeout_seconds",
+                type=ToolParameterType.INTEGER,
+                description="查询超时时间（秒，用于execute_query操作，超时后由数据库中止查询）",
+                required=False
             )
         ]
     
@@ -202,42 +220,192 @@ class MySQLMCPTool(BaseTool):
         finally:
             cursor.close()
     
-    def _execute_query(self, connection, sql_query: str, limit: int = 100) -> Dict[str, Any]:
-        """执行SQL查询"""
+    def _describe_tables(self, connection, table_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量获取多个表的结构信息（每类目录信息一次查询），行数使用TABLE_ROWS估算值"""
+        tables = {}
+        if not table_names:
+            return tables
+        placeholders = ', '.join(['%s'] * len(table_names))
+        params = tuple(table_names)
         cursor = connection.cursor()
         try:
-            # 添加LIMIT限制（如果查询中没有LIMIT）
-            if limit and limit > 0 and "LIMIT" not in sql_query.upper():
-                sql_query = f"{sql_query.rstrip(';')} LIMIT {limit}"
-            
-            cursor.execute(sql_query)
+            # 表注释和估算行数
+            cursor.execute(f"""
+                SELECT table_name, table_comment, table_rows
+                FROM information_schema.tables
+                WHERE table_schema = DATABASE() AND table_name IN ({placeholders});
+            """, params)
+            for row in cursor.fetchall():
+                tables[row[0]] = {
+                    "table_name": row[0],
+                    "columns": [],
+                    "primary_keys": [],
+                    "foreign_keys": [],
+                    "indexes": [],
+                    "table_comment": row[1] or "",
+                    "row_count": int(row[2] or 0)
+                }
             
-            # 获取列名
-            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            # 列信息
+            cursor.execute(f"""
+                SELECT 
+                    table_name,
+                    column_name,
+                    data_type,
+                    is_nullable,
+                    column_default,
+                    character_maximum_length,
+                    numeric_precision,
+                    numeric_scale,
+                    column_comment
+                FROM information_schema.columns 
+                WHERE table_schema = DATABASE() AND table_name IN ({placeholders})
+                ORDER BY table_name, ordinal_position;
+            """, params)
+            for row in cursor.fetchall():
+                if row[0] in tables:
+                    tables[row[0]]["columns"].append({
+                        "column_name": row[1],
+                        "data_type": row[2],
+                        "is_nullable": row[3] == 'YES',
+                        "column_default": row[4],
+                        "character_maximum_length": row[5],
+                        "numeric_precision": row[6],
+                        "numeric_scale": row[7],
+                        "column_comment": row[8] or ""
+                    })
             
-            # 获取数据
-            rows = cursor.fetchall()
+            # 主键和外键
+            cursor.execute(f"""
+                SELECT 
+                    table_name,
+                    column_name,
+                    constraint_name,
+                    referenced_table_name,
+                    referenced_column_name
+                FROM information_schema.key_column_usage
+                WHERE table_schema = DATABASE() 
+                AND table_name IN ({placeholders})
+                AND (constraint_name = 'PRIMARY' OR referenced_table_name IS NOT NULL)
+                ORDER BY table_name, ordinal_position;
+            """, params)
+            for row in cursor.fetchall():
+                if row[0] not in tables:
+                    continue
+                if row[2] == 'PRIMARY':
+                    tables[row[0]]["primary_keys"].append(row[1])
+                else:
+                    tables[row[0]]["foreign_keys"].append({
+                        "column_name": row[1],
+                        "referenced_table": row[3],
+                        "referenced_column": row[4]
+                    })
             
-            # 转换为字典列表
-            data = []
-            for row in rows:
-                row_dict = {}
-                for i, value in enumerate(row):
-                    if i < len(columns):
-                        # 处理特殊数据类型
-                        if isinstance(value, datetime):
-                            row_dict[columns[i]] = value.isoformat()
-                        else:
-                            row_dict[columns[i]] = value
-                data.append(row_dict)
-            return {
-                "success": True,
-                "data": data,
-                "columns": columns,
-                "row_count": len(data),
-                "query": sql_query
-            }
+            # 索引
+            cursor.execute(f"""
+                SELECT 
+                    table_name,
+                    index_name,
+                    column_name,
+                    non_unique
+                FROM information_schema.statistics
+                WHERE table_schema = DATABASE() 
+                AND table_name IN ({placeholders})
+                ORDER BY table_name, index_name, seq_in_index;
+            """, params)
+            for row in cursor.fetchall():
+                if row[0] in tables:
+                    tables[row[0]]["indexes"].append({
+                        "index_name": row[1],
+                        "column_name": row[2],
+                        "is_unique": row[3] == 0
+                    })
             
+            return tables
+        finally:
+            cursor.close()
+    
+    def _set_execution_timeout(self, connection, timeout_ms: int) -> None:
+        """设置会话级 MAX_EXECUTION_TIME（只作用于只读SELECT，0表示不限制；不支持的版本忽略）"""
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SET SESSION MAX_EXECUTION_TIME = %s", (int(timeout_ms),))
+        except pymysql.MySQLError as e:
+            logger.debug(f"设置MAX_EXECUTION_TIME失败: {e}")
+        finally:
+            cursor.close()
+    
+    def _set_select_limit(self, connection, max_rows: Optional[int]) -> None:
+        """设置会话级 sql_select_limit（只限制最外层SELECT，语句自带的LIMIT优先；None恢复默认）"""
+        cursor = connection.cursor()
+        try:
+            if max_rows is None:
+                cursor.execute("SET SESSION sql_select_limit = DEFAULT")
+            else:
+                cursor.execute("SET SESSION sql_select_limit = %s", (int(max_rows),))
+        finally:
+            cursor.close()
+    
+    def _fetch(self, connection, statement: str, max_rows: Optional[int]):
+        """服务端游标（SSCursor）执行并分批读取，结果不在客户端整体缓冲"""
+        cursor = connection.cursor(pymysql.cursors.SSCursor)
+        try:
+            cursor.execute(statement)
+            return fetch_arrow(cursor, max_rows)
+        finally:
+            cursor.close()
+    
+    def _execute_query(self, connection, sql_query: str, limit: int = 100, columnar: bool = False,
+                       timeout_seconds: Optional[int] = None) -> Dict[str, Any]:
+        """执行SQL查询（columnar=True时返回Arrow表，否则返回行字典列表）"""
+        max_rows = limit if limit and limit > 0 else None
+        statement, wrapped = wrap_limit(sql_query, limit)
+        # 连接由连接池复用，超时设置在查询结束后恢复
+        if timeout_seconds:
+            self._set_execution_timeout(connection, timeout_seconds * 1000)
+        try:
+            # 由数据库拒绝写入和加锁，SQL文本检查之外的第二道防线
+            with connection.cursor() as cursor:
+                cursor.execute("START TRANSACTION READ ONLY")
+            try:
+                columns, table, truncated = self._fetch(connection, statement, max_rows)
+            except pymysql.MySQLError as e:
+                # 超时（ER_QUERY_TIMEOUT）不再按原语句重试
+                if not wrapped or (e.args and e.args[0] == 3024):
+                    raise
+                # 无法作为子查询执行（如结果中有重名列）时按原语句执行；由 sql_select_limit 在服务端限制行数，
+                # 否则读取截断后关闭服务端游标（SSCursor）会把剩余结果全部读完
+                statement = sql_query.strip().rstrip(';')
+                self._set_select_limit(connection, max_rows + 1)
+                try:
+                    columns, table, truncated = self._fetch(connection, statement, max_rows)
+                finally:
+                    self._set_select_limit(connection, None)
+        finally:
+            connection.rollback()
+            if timeout_seconds:
+                self._set_execution_timeout(connection, 0)
+        
+        result = {
+            "success": True,
+            "columns": columns or [],
+            "row_count": table.num_rows if table is not None else 0,
+            "truncated": truncated,
+            "query": statement
+        }
+        if columnar:
+            result["table"] = table
+        else:
+            result["data"] = arrow_to_records(table)
+        return result
+    
+    def _explain_query(self, connection, sql_query: str) -> Dict[str, Any]:
+        """EXPLAIN FORMAT=JSON 估算查询代价（不执行查询）"""
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f"EXPLAIN FORMAT=JSON {sql_query.strip().rstrip(';')}")
+            plan = cursor.fetchone()[0]
+            return summarize_mysql_plan(json.loads(plan) if isinstance(plan, str) else plan)
         finally:
             cursor.close()
     
@@ -250,13 +418,21 @@ class MySQLMCPTool(BaseTool):
                 user=config['username'],
                 password=config['password'],
                 database=config['database'],
-                connect_timeout=10,
+                connect_timeout=get_settings().datasource_pool.connect_timeout_seconds,
                 charset='utf8mb4'
             )
             return connection
         except Exception as e:
             raise Exception(f"MySQL连接失败: {str(e)}")
     
+    def _ping(self, connection: pymysql.Connection) -> bool:
+        """连接探活（空闲连接被服务端wait_timeout关闭后返回False）"""
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+    
     def _test_connection(self, config: Dict[str, Any]) -> Dict[str, Any]:
         """测试数据库连接"""
         try:
@@ -297,8 +473,12 @@ class MySQLMCPTool(BaseTool):
             connection_config = kwargs.get("connection_config", {})
             user_id = kwargs.get("user_id")
             table_name = kwargs.get("table_name")
+            table_names = kwargs.get("table_names")
             sql_query = kwargs.get("sql_query")
             limit = kwargs.get("limit", 100)
+            datasource_id = kwargs.get("datasource_id")
+            columnar = kwargs.get("columnar", False)
+            timeout_seconds = kwargs.get("timeout_seconds")
             
             logger.info(f"执行MySQL MCP操作: {operation}")
             if operation == "test_connection":
@@ -308,7 +488,7 @@ class MySQLMCPTool(BaseTool):
                         error="缺少连接配置参数"
                     )
 
-                result = self._test_connection(connection_config)
+                result = await get_executor_pools().run_db(self._test_connection, connection_config)
                 return ToolResult(
                     success=result["success"],
                     result=result,
@@ -328,26 +508,9 @@ class MySQLMCPTool(BaseTool):
                     )
                 
                 try:
-                    # 建立MySQL连接
-                    connection = pymysql.connect(
-                        host=connection_config["host"],
-                        port=int(connection_config["port"]),
-                        user=connection_config["username"],
-                        password=connection_config["password"],
-                        database=connection_config["database"],
-                        charset='utf8mb4',
-                        cursorclass=pymysql.cursors.Cursor
-                    )
-                    
-                    # 存储连接
-                    self.connections[user_id] = {
-                        "connection": connection,
-                        "config": connection_config,
-                        "connected_at": datetime.now().isoformat()
-                    }
-                    
-                    # 获取表列表
-                    tables = self._get_tables(connection)
+                    # 登记数据源并通过连接池获取表列表（同时验证连接）
+                    self.register_datasource(user_id, connection_config, datasource_id)
+                    tables = await self._run_pooled(user_id, datasource_id, self._get_tables)
                     
                     return ToolResult(
                         success=True,
@@ -359,20 +522,20 @@ class MySQLMCPTool(BaseTool):
                         }
                     )
                 except Exception as e:
+                    self._disconnect_user(user_id)
                     return ToolResult(
                         success=False,
                         error=f"连接失败: {str(e)}"
                     )
             
             elif operation == "list_tables":
-                if not user_id or user_id not in self.connections:
+                if not self.is_connected(user_id, datasource_id):
                     return ToolResult(
                         success=False,
                         error="用户未连接数据库，请先执行connect操作"
                     )
                 
-                connection = self.connections[user_id]["connection"]
-                tables = self._get_tables(connection)
+                tables = await self._run_pooled(user_id, datasource_id, self._get_tables)
                 
                 return ToolResult(
                     success=True,
@@ -383,7 +546,7 @@ class MySQLMCPTool(BaseTool):
                 )
             
             elif operation == "describe_table":
-                if not user_id or user_id not in self.connections:
+                if not self.is_connected(user_id, datasource_id):
                     return ToolResult(
                         success=False,
                         error="用户未连接数据库，请先执行connect操作"
@@ -395,16 +558,38 @@ class MySQLMCPTool(BaseTool):
                         error="缺少table_name参数"
                     )
                 
-                connection = self.connections[user_id]["connection"]
-                table_info = self._describe_table(connection, table_name)
+                table_info = await self._run_pooled(user_id, datasource_id, self._describe_table, table_name)
                 
                 return ToolResult(
                     success=True,
                     result=table_info
                 )
             
+            elif operation == "describe_tables":
+                if not self.is_connected(user_id, datasource_id):
+                    return ToolResult(
+                        success=False,
+                        error="用户未连接数据库，请先执行connect操作"
+                    )
+                
+                if not table_names:
+                    return ToolResult(
+                        success=False,
+                        error="缺少table_names参数"
+                    )
+                
+                tables_info = await self._run_pooled(user_id, datasource_id, self._describe_tables, table_names)
+                
+                return ToolResult(
+                    success=True,
+                    result={
+                        "tables": tables_info,
+                        "missing_tables": [name for name in table_names if name not in tables_info]
+                    }
+                )
+            
             elif operation == "execute_query":
-                if not user_id or user_id not in self.connections:
+                if not self.is_connected(user_id, datasource_id):
                     return ToolResult(
                         success=False,
                         error="用户未连接数据库，请先执行connect操作"
@@ -416,19 +601,39 @@ class MySQLMCPTool(BaseTool):
                         error="缺少sql_query参数"
                     )
                 
-                connection = self.connections[user_id]["connection"]
-                query_result = self._execute_query(connection, sql_query, limit)
+                query_result = await self._run_pooled(
+                    user_id, datasource_id, self._execute_query, sql_query, limit, columnar, timeout_seconds
+                )
                 
                 return ToolResult(
                     success=True,
                     result=query_result
                 )
             
+            elif operation == "explain_query":
+                if not self.is_connected(user_id, datasource_id):
+                    return ToolResult(
+                        success=False,
+                        error="用户未连接数据库，请先执行connect操作"
+                    )
+                
+                if not sql_query:
+                    return ToolResult(
+                        success=False,
+                        error="缺少sql_query参数"
+                    )
+                
+                plan_summary = await self._run_pooled(user_id, datasource_id, self._explain_query, sql_query)
+                
+                return ToolResult(
+                    success=True,
+                    result=plan_summary
+                )
+            
             elif operation == "disconnect":
                 if user_id and user_id in self.connections:
                     try:
-                        self.connections[user_id]["connection"].close()
-                        del self.connections[user_id]
+                        self._disconnect_user(user_id)
                         return ToolResult(
                             success=True,
                             result={"message": "数据库连接已断开"}
@@ -1,22 +1,31 @@
 """PostgreSQL MCP (Model Context Protocol) tool for database operations."""
 
 import json
+import uuid
 import psycopg2
 from typing import List, Dict, Any, Optional
-from datetime import datetime
 
+from open_agent.core.config import get_settings
+from open_agent.core.executor import get_executor_pools
 from open_agent.services.agent.base import BaseTool, ToolParameter, ToolParameterType, ToolResult
+from open_agent.services.mcp.datasource_pool import PooledDatasourceMixin
+from open_agent.services.mcp.query_fetch import (
+    FETCH_BATCH_SIZE, is_row_query, wrap_limit, fetch_arrow, arrow_to_records
+)
+from open_agent.services.sql_guard import summarize_postgresql_plan
 from open_agent.utils.logger import get_logger
 
 logger = get_logger("postgresql_mcp_tool")
 
 
-class PostgreSQLMCPTool(BaseTool):
+class PostgreSQLMCPTool(PooledDatasourceMixin, BaseTool):
     """PostgreSQL MCP tool for database operations and intelligent querying."""
     
+    pool_prefix = "postgresql"
+    
     def __init__(self):
         super().__init__()
-        self.connections = {}  # 存储用户的数据库连接
+        self.connections = {}  # 用户当前使用的数据源（连接由数据源连接池管理）
     
     def get_name(self) -> str:
         return "postgresql_mcp"
@@ -31,7 +40,7 @@ class PostgreSQLMCPTool(BaseTool):
                 type=ToolParameterType.STRING,
                 description="操作类型",
                 required=True,
-                enum=["connect", "list_tables", "describe_table", "execute_query", "test_connection", "disconnect"]
+                enum=["connect", "list_tables", "describe_table", "describe_tables", "execute_query", "explain_query", "test_connection", "disconnect"]
             ),
             ToolParameter(
                 name="connection_config",
@@ -51,10 +60,16 @@ class PostgreSQLMCPTool(BaseTool):
                 description="表名（用于describe_table操作）",
                 required=False
             ),
+            ToolParameter(
+                name="table_names",
+                type=ToolParameterType.ARRAY,
+                description="表名列表（用于describe_tables操作，批量获取表结构）",
+                required=False
+            ),
             ToolParameter(
                 name="sql_query",
                 type=ToolParameterType.STRING,
-                description="SQL查询语句（用于execute_query操作）",
+                description="SQL查询语句（用于execute_query、explain_query操作）",
                 required=False
             ),
             ToolParameter(
@@ -63,6 +78,12 @@ class PostgreSQLMCPTool(BaseTool):
                 description="查询结果限制数量，默认100",
                 required=False,
                 default=100
+            ),
+            ToolParameter(
+                name="timeout_seconds",
+                type=ToolParameterType.INTEGER,
+                description="查询超时时间（秒，用于execute_query操作，超时后由数据库中止查询）",
+                required=False
             )
         ]
     
@@ -75,12 +96,30 @@ class PostgreSQLMCPTool(BaseTool):
                 user=config['username'],
                 password=config['password'],
                 database=config['database'],
-                connect_timeout=10
+                connect_timeout=get_settings().datasource_pool.connect_timeout_seconds,
+                # TCP keepalive，避免长时间空闲的池化连接被防火墙/NAT静默断开
+                keepalives=1,
+                keepalives_idle=60
             )
             return connection
         except Exception as e:
             raise Exception(f"PostgreSQL连接失败: {str(e)}")
     
+    def _ping(self, connection) -> bool:
+        """连接探活"""
+        if connection.closed:
+            return False
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT 1;")
+            finally:
+                cursor.close()
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+    
     def _test_connection(self, config: Dict[str, Any]) -> Dict[str, Any]:
         """测试数据库连接"""
         try:
@@ -182,9 +221,15 @@ class PostgreSQLMCPTool(BaseTool):
             
             primary_keys = [row[0] for row in cursor.fetchall()]
             
-            # 获取表行数
-            cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
-            row_count = cursor.fetchone()[0]
+            # 获取表行数（使用统计信息估算值，不做全表COUNT）
+            cursor.execute("""
+                SELECT GREATEST(c.reltuples, 0)::bigint
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'public' AND c.relname = %s;
+            """, (table_name,))
+            result = cursor.fetchone()
+            row_count = result[0] if result else 0
             
             return {
                 "table_name": table_name,
@@ -195,55 +240,192 @@ class PostgreSQLMCPTool(BaseTool):
         finally:
             cursor.close()
     
-    def _execute_query(self, connection, sql_query: str, limit: int = 100) -> Dict[str, Any]:
-        """执行SQL查询"""
+    def _describe_tables(self, connection, table_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量获取多个表的结构信息（每类目录信息一次查询），行数使用reltuples估算值"""
+        tables = {}
+        if not table_names:
+            return tables
+        names = list(table_names)
         cursor = connection.cursor()
         try:
-            # 添加LIMIT限制（如果查询中没有）
-            if limit and "LIMIT" not in sql_query.upper():
-                sql_query = f"{sql_query.rstrip(';')} LIMIT {limit};"
+            # 表注释和估算行数
+            cursor.execute("""
+                SELECT c.relname, obj_description(c.oid, 'pg_class'), GREATEST(c.reltuples, 0)::bigint
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'v', 'm', 'f') AND c.relname = ANY(%s);
+            """, (names,))
+            for row in cursor.fetchall():
+                tables[row[0]] = {
+                    "table_name": row[0],
+                    "columns": [],
+                    "primary_keys": [],
+                    "foreign_keys": [],
+                    "indexes": [],
+                    "table_comment": row[1] or "",
+                    "row_count": int(row[2] or 0)
+                }
             
-            cursor.execute(sql_query)
+            # 列信息（含列注释）
+            cursor.execute("""
+                SELECT 
+                    col.table_name,
+                    col.column_name,
+                    col.data_type,
+                    col.is_nullable,
+                    col.column_default,
+                    col.character_maximum_length,
+                    col.numeric_precision,
+                    col.numeric_scale,
+                    col_description(c.oid, col.ordinal_position::int)
+                FROM information_schema.columns col
+                JOIN pg_namespace n ON n.nspname = col.table_schema
+                JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = col.table_name
+                WHERE col.table_schema = 'public' AND col.table_name = ANY(%s)
+                ORDER BY col.table_name, col.ordinal_position;
+            """, (names,))
+            for row in cursor.fetchall():
+                if row[0] in tables:
+                    tables[row[0]]["columns"].append({
+                        "column_name": row[1],
+                        "data_type": row[2],
+                        "is_nullable": row[3],
+                        "column_default": row[4],
+                        "character_maximum_length": row[5],
+                        "numeric_precision": row[6],
+                        "numeric_scale": row[7],
+                        "column_comment": row[8] or ""
+                    })
             
-            # 获取列名
-            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            # 主键和外键
+            cursor.execute("""
+                SELECT 
+                    tc.table_name,
+                    kcu.column_name,
+                    tc.constraint_type,
+                    ccu.table_name,
+                    ccu.column_name
+                FROM information_schema.table_constraints tc
+                JOIN information_schema.key_column_usage kcu
+                    ON kcu.constraint_name = tc.constraint_name AND kcu.table_schema = tc.table_schema
+                LEFT JOIN information_schema.constraint_column_usage ccu
+                    ON tc.constraint_type = 'FOREIGN KEY'
+                    AND ccu.constraint_name = tc.constraint_name AND ccu.constraint_schema = tc.table_schema
+                WHERE tc.table_schema = 'public'
+                AND tc.table_name = ANY(%s)
+                AND tc.constraint_type IN ('PRIMARY KEY', 'FOREIGN KEY')
+                ORDER BY tc.table_name, kcu.ordinal_position;
+            """, (names,))
+            for row in cursor.fetchall():
+                if row[0] not in tables:
+                    continue
+                if row[2] == 'PRIMARY KEY':
+                    tables[row[0]]["primary_keys"].append(row[1])
+                else:
+                    tables[row[0]]["foreign_keys"].append({
+                        "column_name": row[1],
+                        "referenced_table": row[3],
+                        "referenced_column": row[4]
+                    })
             
-            # 获取结果
-            if cursor.description:  # SELECT查询
-                rows = cursor.fetchall()
-                data = []
-                for row in rows:
-                    row_dict = {}
-                    for i, value in enumerate(row):
-                        if i < len(columns):
-                            # 处理特殊数据类型
-                            if isinstance(value, datetime):
-                                row_dict[columns[i]] = value.isoformat()
-                            else:
-                                row_dict[columns[i]] = value
-                    data.append(row_dict)
-                
-                return {
-                    "success": True,
-                    "data": data,
-                    "columns": columns,
-                    "row_count": len(data),
-                    "query": sql_query
-                }
-            else:  # INSERT/UPDATE/DELETE查询
-                affected_rows = cursor.rowcount
-                return {
-                    "success": True,
-                    "affected_rows": affected_rows,
-                    "query": sql_query,
-                    "message": f"查询执行成功，影响 {affected_rows} 行"
-                }
+            # 索引
+            cursor.execute("""
+                SELECT t.relname, i.relname, a.attname, NOT ix.indisunique
+                FROM pg_index ix
+                JOIN pg_class t ON t.oid = ix.indrelid
+                JOIN pg_class i ON i.oid = ix.indexrelid
+                JOIN pg_namespace n ON n.oid = t.relnamespace
+                JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = ANY(ix.indkey)
+                WHERE n.nspname = 'public' AND t.relname = ANY(%s)
+                ORDER BY t.relname, i.relname, array_position(ix.indkey::int2[], a.attnum);
+            """, (names,))
+            for row in cursor.fetchall():
+                if row[0] in tables:
+                    tables[row[0]]["indexes"].append({
+                        "index_name": row[1],
+                        "column_name": row[2],
+                        "is_unique": not row[3]
+                    })
+            
+            return tables
         finally:
             cursor.close()
     
+    def _fetch(self, connection, statement: str, max_rows: Optional[int], timeout_seconds: Optional[int] = None):
+        """在只读事务中执行：查询语句使用命名游标（服务端游标）分批读取，其他语句使用普通游标"""
+        # SET TRANSACTION 必须是事务中的第一条语句，先结束连接上可能残留的事务
+        connection.rollback()
+        with connection.cursor() as setup_cursor:
+            # 由数据库拒绝写入、加锁等操作，SQL文本检查之外的第二道防线
+            setup_cursor.execute("SET TRANSACTION READ ONLY")
+            if timeout_seconds:
+                # SET LOCAL 只在当前事务内有效，连接归还连接池时回滚即恢复
+                setup_cursor.execute("SET LOCAL statement_timeout = %s", (int(timeout_seconds * 1000),))
+        if is_row_query(statement):
+            cursor = connection.cursor(name=f"open_agent_{uuid.uuid4().hex}")
+            cursor.itersize = FETCH_BATCH_SIZE
+        else:
+            cursor = connection.cursor()
+        try:
+            cursor.execute(statement)
+            columns, table, truncated = fetch_arrow(cursor, max_rows)
+            return columns, table, truncated, cursor.rowcount
+        finally:
+            try:
+                cursor.close()
+                connection.rollback()
+            except psycopg2.Error:
+                pass
+    
+    def _execute_query(self, connection, sql_query: str, limit: int = 100, columnar: bool = False,
+                       timeout_seconds: Optional[int] = None) -> Dict[str, Any]:
+        """执行SQL查询（columnar=True时返回Arrow表，否则返回行字典列表）"""
+        max_rows = limit if limit and limit > 0 else None
+        statement, wrapped = wrap_limit(sql_query, limit)
+        try:
+            columns, table, truncated, affected_rows = self._fetch(connection, statement, max_rows, timeout_seconds)
+        except psycopg2.errors.QueryCanceled:
+            raise
+        except psycopg2.Error:
+            if not wrapped:
+                raise
+            # 无法作为子查询执行时按原语句执行，并在读取时截断
+            statement = sql_query.strip().rstrip(';')
+            columns, table, truncated, affected_rows = self._fetch(connection, statement, max_rows, timeout_seconds)
+        
+        if table is None:  # 不返回结果集的语句
+            return {
+                "success": True,
+                "affected_rows": affected_rows,
+                "query": statement,
+                "message": f"查询执行成功，影响 {affected_rows} 行"
+            }
+        
+        result = {
+            "success": True,
+            "columns": columns,
+            "row_count": table.num_rows,
+            "truncated": truncated,
+            "query": statement
+        }
+        if columnar:
+            result["table"] = table
+        else:
+            result["data"] = arrow_to_records(table)
+        return result
+    
+    def _explain_query(self, connection, sql_query: str) -> Dict[str, Any]:
+        """EXPLAIN (FORMAT JSON) 估算查询代价（不执行查询）"""
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql_query.strip().rstrip(';')}")
+            plan = cursor.fetchone()[0]
+            return summarize_postgresql_plan(json.loads(plan) if isinstance(plan, str) else plan)
+    
     async def execute(self, operation: str, connection_config: Optional[Dict[str, Any]] = None, 
                      user_id: Optional[str] = None, table_name: Optional[str] = None,
-                     sql_query: Optional[str] = None, limit: int = 100) -> ToolResult:
+                     sql_query: Optional[str] = None, limit: int = 100,
+                     datasource_id: Optional[int] = None, columnar: bool = False,
+                     table_names: Optional[List[str]] = None, timeout_seconds: Optional[int] = None) -> ToolResult:
         """执行PostgreSQL MCP操作"""
         try:
             logger.info(f"执行PostgreSQL MCP操作: {operation}")
@@ -255,7 +437,7 @@ class PostgreSQLMCPTool(BaseTool):
                         error="缺少连接配置参数"
                     )
                 
-                result = self._test_connection(connection_config)
+                result = await get_executor_pools().run_db(self._test_connection, connection_config)
                 return ToolResult(
                     success=result["success"],
                     result=result,
@@ -270,15 +452,9 @@ class PostgreSQLMCPTool(BaseTool):
                     )
                 
                 try:
-                    connection = self._create_connection(connection_config)
-                    self.connections[user_id] = {
-                        "connection": connection,
-                        "config": connection_config,
-                        "connected_at": datetime.now().isoformat()
-                    }
-                    
-                    # 获取表列表
-                    tables = self._get_tables(connection)
+                    # 登记数据源并通过连接池获取表列表（同时验证连接）
+                    self.register_datasource(user_id, connection_config, datasource_id)
+                    tables = await self._run_pooled(user_id, datasource_id, self._get_tables)
                     
                     return ToolResult(
                         success=True,
@@ -290,20 +466,20 @@ class PostgreSQLMCPTool(BaseTool):
                         }
                     )
                 except Exception as e:
+                    self._disconnect_user(user_id)
                     return ToolResult(
                         success=False,
                         error=f"连接失败: {str(e)}"
                     )
             
             elif operation == "list_tables":
-                if not user_id or user_id not in self.connections:
+                if not self.is_connected(user_id, datasource_id):
                     return ToolResult(
                         success=False,
                         error="用户未连接数据库，请先执行connect操作"
                     )
                 
-                connection = self.connections[user_id]["connection"]
-                tables = self._get_tables(connection)
+                tables = await self._run_pooled(user_id, datasource_id, self._get_tables)
                 
                 return ToolResult(
                     success=True,
@@ -314,7 +490,7 @@ class PostgreSQLMCPTool(BaseTool):
                 )
             
             elif operation == "describe_table":
-                if not user_id or user_id not in self.connections:
+                if not self.is_connected(user_id, datasource_id):
                     return ToolResult(
                         success=False,
                         error="用户未连接数据库，请先执行connect操作"
@@ -326,16 +502,38 @@ class PostgreSQLMCPTool(BaseTool):
                         error="缺少table_name参数"
                     )
                 
-                connection = self.connections[user_id]["connection"]
-                table_info = self._describe_table(connection, table_name)
+                table_info = await self._run_pooled(user_id, datasource_id, self._describe_table, table_name)
                 
                 return ToolResult(
                     success=True,
                     result=table_info
                 )
             
+            elif operation == "describe_tables":
+                if not self.is_connected(user_id, datasource_id):
+                    return ToolResult(
+                        success=False,
+                        error="用户未连接数据库，请先执行connect操作"
+                    )
+                
+                if not table_names:
+                    return ToolResult(
+                        success=False,
+                        error="缺少table_names参数"
+                    )
+                
+                tables_info = await self._run_pooled(user_id, datasource_id, self._describe_tables, table_names)
+                
+                return ToolResult(
+                    success=True,
+                    result={
+                        "tables": tables_info,
+                        "missing_tables": [name for name in table_names if name not in tables_info]
+                    }
+                )
+            
             elif operation == "execute_query":
-                if not user_id or user_id not in self.connections:
+                if not self.is_connected(user_id, datasource_id):
                     return ToolResult(
                         success=False,
                         error="用户未连接数据库，请先执行connect操作"
@@ -347,19 +545,39 @@ class PostgreSQLMCPTool(BaseTool):
                         error="缺少sql_query参数"
                     )
                 
-                connection = self.connections[user_id]["connection"]
-                query_result = self._execute_query(connection, sql_query, limit)
+                query_result = await self._run_pooled(
+                    user_id, datasource_id, self._execute_query, sql_query, limit, columnar, timeout_seconds
+                )
                 
                 return ToolResult(
                     success=True,
                     result=query_result
                 )
             
+            elif operation == "explain_query":
+                if not self.is_connected(user_id, datasource_id):
+                    return ToolResult(
+                        success=False,
+                        error="用户未连接数据库，请先执行connect操作"
+                    )
+                
+                if not sql_query:
+                    return ToolResult(
+                        success=False,
+                        error="缺少sql_query参数"
+                    )
+                
+                plan_summary = await self._run_pooled(user_id, datasource_id, self._explain_query, sql_query)
+                
+                return ToolResult(
+                    success=True,
+                    result=plan_summary
+                )
+            
             elif operation == "disconnect":
                 if user_id and user_id in self.connections:
                     try:
-                        self.connections[user_id]["connection"].close()
-                        del self.connections[user_id]
+                        self._disconnect_user(user_id)
                         return ToolResult(
                             success=True,
                             result={"message": "数据库连接已断开"}
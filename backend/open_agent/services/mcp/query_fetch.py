@@ -0,0 +1,137 @@
+"""Streaming, columnar result fetching for the database MCP tools."""
+
+import json
+import re
+from typing import Any, List, Optional, Sequence, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# 服务端游标每批读取的行数
+FETCH_BATCH_SIZE = 1000
+# 可以包装为子查询的语句（返回结果集的SELECT/WITH/VALUES/TABLE）
+_ROW_QUERY_RE = re.compile(r"^\s*(?:(?:--[^\n]*\n|/\*.*?\*/)\s*)*\(*\s*(select|with|values|table)\b", re.IGNORECASE | re.DOTALL)
+_ZERO_FRACTION = r"\.0+$"
+
+
+def is_row_query(sql: str) -> bool:
+    """是否为返回结果集、可作为子查询的语句"""
+    return bool(_ROW_QUERY_RE.match(sql or ''))
+
+
+def wrap_limit(sql: str, limit: Optional[int]) -> Tuple[str, bool]:
+    """
+    把查询包装为子查询来限制行数，不再按"LIMIT"子串判断
+    （原查询里已有的LIMIT、子查询或字符串中的LIMIT都不影响）
+
+    多取一行用于判断结果是否被截断。
+
+    Returns:
+        (执行的SQL, 是否已包装)
+    """
+    statement = (sql or '').strip().rstrip(';').strip()
+    if not limit or limit <= 0 or not is_row_query(statement):
+        return statement, False
+    # 换行后再闭合括号，避免原查询末尾的 -- 注释吞掉括号
+    return f"SELECT * FROM (\n{statement}\n) AS _limited_query LIMIT {int(limit) + 1}", True
+
+
+def _column_array(values: Sequence[Any]) -> pa.Array:
+    """一列值转换为Arrow数组：由Arrow按列推断类型，嵌套值存为JSON文本，无法推断时按文本保存"""
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+    if pa.types.is_nested(array.type):
+        return pa.array([None if value is None else json.dumps(value, ensure_ascii=False, default=str)
+                         for value in values], type=pa.string())
+    return array
+
+
+def _unify_batches(batches: List[pa.Table]) -> pa.Table:
+    """合并各批次；同一列在不同批次中类型不兼容（如先数字后文本）时统一按文本保存"""
+    try:
+        return pa.concat_tables(batches, promote_options="permissive")
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    names = batches[0].schema.names
+    conflicting = {
+        name for name in names
+        if len({batch.schema.field(name).type for batch in batches if batch.schema.field(name).type != pa.null()}) > 1
+    }
+    unified = []
+    for batch in batches:
+        for name in conflicting:
+            position = batch.schema.get_field_index(name)
+            column = batch.column(position)
+            try:
+                text = pc.cast(column, pa.string())
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                text = pa.chunked_array([pa.array([None if value is None else str(value)
+                                                   for value in column.to_pylist()], type=pa.string())])
+            batch = batch.set_column(position, name, text)
+        unified.append(batch)
+    return pa.concat_tables(unified, promote_options="permissive")
+
+
+def fetch_arrow(cursor, max_rows: Optional[int] = None,
+                batch_size: int = FETCH_BATCH_SIZE) -> Tuple[Optional[List[str]], Optional[pa.Table], bool]:
+    """
+    从（服务端）游标分批读取结果，每批按列转换为Arrow后即释放Python行对象
+
+    命名游标（psycopg2）在第一次读取后才有description，因此先读第一批再取列名。
+
+    Returns:
+        (列名, Arrow表, 是否因超过max_rows被截断)；语句不返回结果集时列名和表为None
+    """
+    if cursor.description is None and not _lazy_description(cursor):
+        return None, None, False
+    rows = cursor.fetchmany(batch_size)
+    if cursor.description is None:
+        return None, None, False
+    columns = [desc[0] for desc in cursor.description]
+    # 批次内部使用位置列名，允许结果中出现重名列（如 a.id, b.id）
+    names = [f"c{position}" for position in range(len(columns))]
+
+    batches, fetched, truncated = [], 0, False
+    while rows:
+        if max_rows is not None and fetched + len(rows) > max_rows:
+            rows = rows[:max_rows - fetched]
+            truncated = True
+        if rows:
+            values = list(zip(*rows))
+            batches.append(pa.table([_column_array(column) for column in values], names=names))
+            fetched += len(rows)
+        if truncated:
+            break
+        rows = cursor.fetchmany(batch_size)
+
+    if not batches:
+        table = pa.table([pa.array([], type=pa.null()) for _ in names], names=names)
+    else:
+        table = _unify_batches(batches)
+    return columns, table.rename_columns(columns), truncated
+
+
+def _lazy_description(cursor) -> bool:
+    """命名游标在读取前没有description"""
+    return getattr(cursor, 'name', None) is not None
+
+
+def _format_timestamps(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """时间戳列按ISO格式转为文本（与 datetime.isoformat 一致，整秒时不带小数部分）"""
+    if column.type.tz is not None:
+        return pa.chunked_array([pa.array([None if value is None else value.isoformat()
+                                           for value in column.to_pylist()], type=pa.string())])
+    text = pc.strftime(column, format="%Y-%m-%dT%H:%M:%S")
+    return pc.replace_substring_regex(text, pattern=_ZERO_FRACTION, replacement="")
+
+
+def arrow_to_records(table: pa.Table) -> List[dict]:
+    """Arrow结果转换为行字典列表（工具接口的JSON兼容输出），时间戳列按列批量格式化"""
+    if table is None:
+        return []
+    for position, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type):
+            table = table.set_column(position, field.name, _format_timestamps(table.column(position)))
+    return table.to_pylist()
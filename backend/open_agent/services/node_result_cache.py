@@ -0,0 +1,103 @@
+"""Node result memoization for workflow execution."""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+from sqlalchemy.orm import Session
+
+from ..models.workflow import NodeResultCache
+from ..utils.logger import get_logger
+
+logger = get_logger("node_result_cache")
+
+# 开始/结束节点只做数据搬运，缓存没有意义
+CACHEABLE_NODE_TYPES = {'llm', 'http', 'code', 'condition', 'map'}
+
+
+class NodeResultCacheService:
+    """节点结果缓存服务
+
+    缓存键由 (节点类型, 节点配置, 工作流输入, 解析后的参数, 配置引用的上游输出, 模型版本) 计算得到，
+    节点需在配置中设置 cache_enabled 才会参与缓存。
+    """
+
+    DEFAULT_TTL_SECONDS = 3600
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    @staticmethod
+    def is_enabled(node: Dict[str, Any]) -> bool:
+        """节点是否开启了结果缓存"""
+        config = node.get('config') or {}
+        return bool(config.get('cache_enabled')) and node.get('type') in CACHEABLE_NODE_TYPES
+
+    @staticmethod
+    def _referenced_outputs(config: Dict[str, Any], parameters: Any,
+                            previous_outputs: Dict[str, Any]) -> Dict[str, Any]:
+        """节点配置中引用到的上游节点输出（提示词中的 node_<id>、条件表达式、Map 的 items_variable 等都包含节点ID）"""
+        referenced_text = json.dumps([config, parameters], ensure_ascii=False, default=str)
+        return {
+            node_id: output for node_id, output in (previous_outputs or {}).items()
+            if node_id in referenced_text
+        }
+
+    @classmethod
+    def build_key(cls, node: Dict[str, Any], input_data: Dict[str, Any], model_version: Optional[str] = None) -> str:
+        """计算缓存键：只包含节点实际使用的输入，不相关的上游节点输出变化不影响命中"""
+        config = {k: v for k, v in (node.get('config') or {}).items() if k not in ('cache_enabled', 'cache_ttl_seconds')}
+        parameters = node.get('parameters')
+        payload = {
+            'type': node.get('type'),
+            'config': config,
+            'parameters': parameters,
+            'inputs': {
+                'workflow_input': input_data.get('workflow_input'),
+                'resolved_inputs': input_data.get('resolved_inputs'),
+                'referenced_outputs': cls._referenced_outputs(config, parameters, input_data.get('previous_outputs'))
+            },
+            'model_version': model_version
+        }
+        serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    def get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """读取未过期的缓存结果"""
+        entry = self.db.query(NodeResultCache).filter(
+            NodeResultCache.cache_key == cache_key,
+            NodeResultCache.expires_at > datetime.now()
+        ).first()
+        if entry is None:
+            return None
+
+        entry.hit_count = (entry.hit_count or 0) + 1
+        self.db.commit()
+        return entry.output_data
+
+    def set(self, cache_key: str, node: Dict[str, Any], output_data: Dict[str, Any]) -> None:
+        """写入（或覆盖）缓存结果"""
+        config = node.get('config') or {}
+        ttl_seconds = int(config.get('cache_ttl_seconds') or self.DEFAULT_TTL_SECONDS)
+        expires_at = datetime.now() + timedelta(seconds=ttl_seconds)
+
+        try:
+            entry = self.db.query(NodeResultCache).filter(NodeResultCache.cache_key == cache_key).first()
+            if entry is None:
+                entry = NodeResultCache(cache_key=cache_key, node_type=node.get('type'), hit_count=0)
+                self.db.add(entry)
+            entry.output_data = output_data
+            entry.expires_at = expires_at
+            self.db.commit()
+        except Exception as e:
+            # 缓存写入失败不影响工作流执行
+            self.db.rollback()
+            logger.warning(f"写入节点结果缓存失败: {str(e)}")
+
+    def purge_expired(self) -> int:
+        """删除已过期的缓存记录"""
+        deleted = self.db.query(NodeResultCache).filter(
+            NodeResultCache.expires_at <= datetime.now()
+        ).delete(synchronize_session=False)
+        self.db.commit()
+        return deleted
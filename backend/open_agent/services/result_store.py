@@ -0,0 +1,213 @@
+"""Server-side store of query results with paginated access."""
+
+import json
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from ..core.config import get_settings
+from ..utils.logger import get_logger
+from .columnar_store import ColumnarStore, to_arrow_array
+
+logger = get_logger("result_store")
+
+RESULT_SUFFIX = ".arrow"
+# DataFrame索引（分组标签等）单独存为一列，分页时作为 _index 返回
+INDEX_COLUMN = "__index__"
+# 过期文件清理的最小间隔
+SWEEP_INTERVAL_SECONDS = 60
+_HANDLE_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class ResultNotFoundError(Exception):
+    """结果句柄不存在、已过期或不属于当前用户"""
+    pass
+
+
+def frame_to_arrow(df: pd.DataFrame) -> pa.Table:
+    """DataFrame结果转换为Arrow表，列属性名与列名相同，值保留原类型"""
+    arrays = [to_arrow_array(df.index.to_series().astype(str))]
+    arrays.extend(to_arrow_array(df.iloc[:, position]) for position in range(df.shape[1]))
+    labels = [str(col) for col in df.columns]
+    table = pa.Table.from_arrays(arrays, names=[INDEX_COLUMN] + labels)
+    return _with_layout(table, props=labels, stringify=False)
+
+
+def rows_to_arrow(columns: Sequence[Any], rows: List[Any]) -> pa.Table:
+    """数据库查询结果（字典或列表行）转换为Arrow表，列属性名为 col_i，值按文本返回"""
+    labels = [str(col) for col in columns]
+    arrays = []
+    for position, name in enumerate(columns):
+        values = [
+            row.get(name) if isinstance(row, dict) else (row[position] if position < len(row) else None)
+            for row in rows
+        ]
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays.append(pa.array([None if value is None else str(value) for value in values], type=pa.string()))
+    return query_table(pa.Table.from_arrays(arrays, names=labels))
+
+
+def query_table(table: pa.Table) -> pa.Table:
+    """数据库查询得到的Arrow表，列属性名为 col_i（允许重名列），值按文本返回"""
+    return _with_layout(table, props=[f'col_{position}' for position in range(table.num_columns)], stringify=True)
+
+
+def _with_layout(table: pa.Table, props: List[str], stringify: bool) -> pa.Table:
+    """在schema元数据中记录前端表格的列属性名和取值方式"""
+    return table.replace_schema_metadata({
+        'props': json.dumps(props, ensure_ascii=False),
+        'stringify': '1' if stringify else '0'
+    })
+
+
+def _cell(value: Any, stringify: bool) -> Any:
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    if not stringify and isinstance(value, (bool, int, float)):
+        return value
+    return str(value)
+
+
+def table_page(table: pa.Table, offset: int = 0, limit: Optional[int] = None) -> Dict[str, Any]:
+    """按偏移量取一页，转换为前端Table组件的 {columns, data, total} 结构"""
+    metadata = table.schema.metadata or {}
+    stringify = metadata.get(b'stringify') == b'1'
+    total = table.num_rows
+    page = table.slice(offset, limit if limit is not None else total)
+
+    has_index = page.schema.names[:1] == [INDEX_COLUMN]
+    data_columns = page.schema.names[1:] if has_index else page.schema.names
+    props = json.loads(metadata[b'props']) if b'props' in metadata else list(data_columns)
+
+    start = 1 if has_index else 0
+    values = [page.column(position).to_pylist() for position in range(start, page.num_columns)]
+    indexes = (page.column(0).to_pylist() if has_index
+               else [str(offset + row) for row in range(page.num_rows)])
+
+    data = []
+    for row in range(page.num_rows):
+        row_data = {'_index': indexes[row]}
+        for prop, column in zip(props, values):
+            row_data[prop] = _cell(column[row], stringify)
+        data.append(row_data)
+
+    return {
+        'columns': [{'prop': prop, 'label': label, 'width': 'auto'} for prop, label in zip(props, data_columns)],
+        'data': data,
+        'total': total,
+        'offset': offset,
+        'limit': page.num_rows
+    }
+
+
+class ResultStore:
+    """查询结果的服务端存储
+
+    结果以Arrow IPC文件保存在 {目录}/{用户ID}/{句柄}.arrow，SSE事件只携带第一页和句柄，
+    其余数据通过分页接口按需读取（内存映射、只转换所需的行），也可直接下载Arrow文件。
+    文件修改时间超过TTL即视为过期，写入新结果时顺带清理。
+    """
+
+    def __init__(self, directory: str, ttl_seconds: int, page_size: int, max_page_size: int):
+        self.directory = Path(directory)
+        self.ttl_seconds = ttl_seconds
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self._last_sweep = 0.0
+
+    def _path(self, handle: str, owner_id: int) -> Path:
+        if not _HANDLE_RE.match(handle or ''):
+            raise ResultNotFoundError(f"无效的结果句柄: {handle}")
+        return self.directory / str(owner_id) / f"{handle}{RESULT_SUFFIX}"
+
+    def _expired(self, path: Path) -> bool:
+        return self.ttl_seconds > 0 and time.time() - path.stat().st_mtime > self.ttl_seconds
+
+    def put(self, table: pa.Table, owner_id: int) -> str:
+        """保存结果，返回句柄（阻塞调用）"""
+        self.sweep()
+        handle = uuid.uuid4().hex
+        path = self._path(handle, owner_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix('.tmp')
+        ColumnarStore.write_table(table, temp_path)
+        os.replace(temp_path, path)
+        return handle
+
+    def put_frame(self, df: pd.DataFrame, owner_id: int) -> str:
+        return self.put(frame_to_arrow(df), owner_id)
+
+    def put_rows(self, columns: Sequence[Any], rows: List[Any], owner_id: int) -> str:
+        return self.put(rows_to_arrow(columns, rows), owner_id)
+
+    def get_path(self, handle: str, owner_id: int) -> Path:
+        """结果文件路径（用于下载），不存在或已过期时抛出 ResultNotFoundError"""
+        path = self._path(handle, owner_id)
+        if not path.is_file() or self._expired(path):
+            raise ResultNotFoundError(f"结果不存在或已过期: {handle}")
+        return path
+
+    def page(self, handle: str, owner_id: int, offset: int = 0, limit: Optional[int] = None) -> Dict[str, Any]:
+        """读取一页结果（阻塞调用）"""
+        limit = min(limit or self.page_size, self.max_page_size)
+        path = self.get_path(handle, owner_id)
+        with pa.memory_map(str(path), 'r') as source:
+            table = ipc.open_file(source).read_all()
+            page = table_page(table, offset, limit)
+        page['result_handle'] = handle
+        return page
+
+    def store_first_page(self, table: pa.Table, owner_id: int) -> Dict[str, Any]:
+        """保存结果并返回第一页（带句柄）"""
+        handle = self.put(table, owner_id)
+        page = table_page(table, 0, self.page_size)
+        page['result_handle'] = handle
+        return page
+
+    def sweep(self) -> None:
+        """清理过期的结果文件"""
+        now = time.monotonic()
+        if self.ttl_seconds <= 0 or now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        if not self.directory.is_dir():
+            return
+        removed = 0
+        for path in self.directory.glob(f"*/*{RESULT_SUFFIX}"):
+            try:
+                if self._expired(path):
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            logger.info(f"清理过期查询结果 {removed} 个")
+
+
+# 全局实例
+_result_store: Optional[ResultStore] = None
+
+
+def get_result_store() -> Optional[ResultStore]:
+    """获取查询结果存储实例，未启用时返回None"""
+    global _result_store
+    if _result_store is None:
+        smart_query_settings = get_settings().smart_query
+        if not smart_query_settings.result_store_enabled:
+            return None
+        _result_store = ResultStore(
+            directory=smart_query_settings.result_store_dir,
+            ttl_seconds=smart_query_settings.result_store_ttl_seconds,
+            page_size=smart_query_settings.result_page_size,
+            max_page_size=smart_query_settings.result_max_page_size
+        )
+    return _result_store
@@ -0,0 +1,164 @@
+"""Compact result digests and streamed LLM summaries for smart query answers."""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from ..utils.logger import get_logger
+from .result_store import frame_to_arrow, INDEX_COLUMN
+
+logger = get_logger("result_summary")
+
+# 单元格数不超过该值的结果直接放入提示词（如排名、分组统计），否则只给统计摘要和前几行
+DIGEST_MAX_CELLS = 100
+DIGEST_PREVIEW_ROWS = 3
+DIGEST_MAX_COLUMNS = 30
+DIGEST_TOP_VALUES = 3
+DIGEST_MAX_TEXT = 50
+
+
+def _short(value: Any) -> str:
+    text = str(value)
+    return text if len(text) <= DIGEST_MAX_TEXT else text[:DIGEST_MAX_TEXT] + '...'
+
+
+def _number(value: Any) -> Any:
+    return round(value, 4) if isinstance(value, float) else value
+
+
+def _column_digest(name: str, column: pa.ChunkedArray) -> str:
+    """单列统计：数值列给出范围、均值和合计，时间列给出范围，其他列给出不同值个数和最常见的值"""
+    column_type = column.type
+    parts = [f"{name} ({column_type})"]
+    if column.null_count:
+        parts.append(f"空值{column.null_count}")
+    valid = len(column) - column.null_count
+    if valid == 0 or pa.types.is_null(column_type):
+        return '，'.join(parts)
+    try:
+        if pa.types.is_integer(column_type) or pa.types.is_floating(column_type) or pa.types.is_decimal(column_type):
+            min_max = pc.min_max(column).as_py()
+            parts.append(
+                f"最小 {_number(min_max['min'])}，最大 {_number(min_max['max'])}，"
+                f"均值 {_number(pc.mean(column).as_py())}，合计 {_number(pc.sum(column).as_py())}"
+            )
+        elif pa.types.is_temporal(column_type):
+            min_max = pc.min_max(column).as_py()
+            parts.append(f"范围 {min_max['min']} ~ {min_max['max']}")
+        elif pa.types.is_boolean(column_type):
+            parts.append(f"为真 {pc.sum(column).as_py()} 行")
+        else:
+            counts = pc.value_counts(column.drop_null() if hasattr(column, 'drop_null') else column)
+            top = sorted(counts.to_pylist(), key=lambda item: item['counts'], reverse=True)[:DIGEST_TOP_VALUES]
+            parts.append(f"不同值 {len(counts)} 个，最常见: " +
+                         '、'.join(f"{_short(item['values'])}({item['counts']})" for item in top))
+    except (pa.ArrowException, TypeError, ValueError) as e:
+        logger.debug(f"列 {name} 统计失败: {e}")
+    return '，'.join(parts)
+
+
+def result_digest(table: Optional[pa.Table], total_rows: Optional[int] = None, truncated: bool = False) -> str:
+    """
+    查询结果的紧凑摘要，代替原始数据行放入总结提示词
+
+    小结果（单元格数不超过 DIGEST_MAX_CELLS）原样给出全部行；大结果给出各列统计
+    和前几行，提示词长度与结果行数无关。
+    """
+    if table is None or table.num_rows == 0:
+        return "查询结果为空"
+    total_rows = total_rows if total_rows is not None else table.num_rows
+    lines = [f"结果共 {total_rows} 行、{table.num_columns} 列" + ("（结果已截断，统计基于已读取的行）" if truncated else "")]
+
+    if table.num_rows * table.num_columns <= DIGEST_MAX_CELLS:
+        rows = table.to_pylist()
+        lines.append("全部数据:")
+    else:
+        lines.append("各列统计:")
+        for position in range(min(table.num_columns, DIGEST_MAX_COLUMNS)):
+            lines.append(f"- {_column_digest(table.schema.field(position).name, table.column(position))}")
+        if table.num_columns > DIGEST_MAX_COLUMNS:
+            lines.append(f"- 其余 {table.num_columns - DIGEST_MAX_COLUMNS} 列省略")
+        rows = table.slice(0, DIGEST_PREVIEW_ROWS).to_pylist()
+        lines.append(f"前{len(rows)}行:")
+    lines.extend(
+        json.dumps({key: _short(value) if isinstance(value, str) else value for key, value in row.items()},
+                   ensure_ascii=False, default=str)
+        for row in rows
+    )
+    return "\n".join(lines)
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """DataFrame结果的紧凑摘要（非默认索引如分组标签作为普通列）"""
+    if not isinstance(df.index, pd.RangeIndex):
+        df = df.reset_index()
+    table = frame_to_arrow(df)
+    return result_digest(table.drop_columns([INDEX_COLUMN]))
+
+
+async def stream_llm_text(llm, prompt: str, max_chars: int = 0) -> AsyncIterator[str]:
+    """LLM流式生成文本，逐段返回增量；超过 max_chars 时截断并结束"""
+    length = 0
+    async for chunk in llm.astream(prompt):
+        text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+        if not text:
+            continue
+        if max_chars and length + len(text) > max_chars:
+            yield text[:max_chars - length] + "..."
+            return
+        length += len(text)
+        yield text
+
+
+class SummaryStream:
+    """在后台消费LLM流式输出
+
+    生成与其他步骤（结果格式化、保存）并行，调用方随后通过 deltas() 依次读取已生成
+    和后续的文本增量；LLM失败且没有任何输出时返回兜底总结。
+    """
+
+    def __init__(self, deltas: AsyncIterator[str], fallback: str):
+        self.fallback = fallback
+        self.error: Optional[BaseException] = None
+        self._parts: List[str] = []
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._pump(deltas))
+
+    async def _pump(self, deltas: AsyncIterator[str]) -> None:
+        try:
+            async for delta in deltas:
+                self._queue.put_nowait(delta)
+        except Exception as e:
+            self.error = e
+            logger.warning(f"LLM总结生成失败: {str(e)}")
+        finally:
+            self._queue.put_nowait(None)
+
+    async def deltas(self) -> AsyncIterator[str]:
+        """按顺序返回文本增量，直到生成结束"""
+        while True:
+            delta = await self._queue.get()
+            if delta is None:
+                break
+            self._parts.append(delta)
+            yield delta
+        if not ''.join(self._parts).strip():
+            self._parts = [self.fallback]
+            yield self.fallback
+
+    async def collect(self) -> str:
+        """等待生成结束并返回完整总结（非流式接口）"""
+        async for _ in self.deltas():
+            pass
+        return self.text
+
+    @property
+    def text(self) -> str:
+        return ''.join(self._parts).strip()
+
+    def cancel(self) -> None:
+        self._task.cancel()
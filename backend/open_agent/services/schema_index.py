@@ -0,0 +1,228 @@
+"""Embedding-based schema retrieval for file and table pre-selection."""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from ..core.config import get_settings
+from ..utils.logger import get_logger
+
+logger = get_logger("schema_index")
+
+# 文档中最多列出的列数
+MAX_DOCUMENT_COLUMNS = 200
+# 向量存储精度（小数位），减小JSON体积
+VECTOR_DECIMALS = 6
+# 嵌入服务出错后暂停使用的时间，避免每次提问都等待失败的请求
+FAILURE_BACKOFF_SECONDS = 60
+
+
+def excel_documents(filename: str, columns_info: Optional[Dict[str, List[Any]]],
+                    data_types: Optional[Dict[str, Dict[str, str]]] = None) -> Dict[str, str]:
+    """Excel文件每个工作表的检索文档：文件名、工作表名、列名和列类型"""
+    documents = {}
+    for sheet_name, columns in (columns_info or {}).items():
+        dtypes = (data_types or {}).get(sheet_name, {})
+        column_text = ', '.join(
+            f"{col}({dtypes[str(col)]})" if str(col) in dtypes else str(col)
+            for col in columns[:MAX_DOCUMENT_COLUMNS]
+        )
+        documents[sheet_name] = f"文件: {filename}\n工作表: {sheet_name}\n列: {column_text}"
+    return documents
+
+
+def table_documents(schema: Dict[str, Any]) -> Dict[str, str]:
+    """数据库表的检索文档：表名、表注释、问答描述、业务上下文和字段（含注释）"""
+    lines = [f"表: {schema['table_name']}"]
+    for label, key in (('表注释', 'table_comment'), ('表描述', 'qa_description'), ('业务上下文', 'business_context')):
+        if schema.get(key):
+            lines.append(f"{label}: {schema[key]}")
+    columns = []
+    for col in (schema.get('columns') or [])[:MAX_DOCUMENT_COLUMNS]:
+        name = col.get('column_name', col.get('name', ''))
+        comment = col.get('column_comment') or col.get('comment')
+        columns.append(f"{name}({comment})" if comment else str(name))
+    lines.append(f"字段: {', '.join(columns)}")
+    return {schema['table_name']: '\n'.join(lines)}
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _normalize(vector: Any) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm > 0 else array
+
+
+class SchemaIndex:
+    """Schema检索索引
+
+    上传文件、收集表元数据时为每个工作表/表生成描述文档并嵌入，向量随元数据持久化
+    （{model, vectors: {文档键: {hash, vector}}}）。提问时先按向量相似度取Top-N候选，
+    只把这些候选交给LLM选择；缺失或过期（文档内容、嵌入模型变化）的向量在检索时批量补齐。
+    嵌入服务不可用时返回None，由调用方回退到完整列表。
+    """
+
+    def __init__(self, top_n: int, query_cache_size: int = 512, embeddings=None, model_name: Optional[str] = None):
+        self.top_n = top_n
+        self.query_cache_size = query_cache_size
+        self._embeddings = embeddings
+        self._model_name = model_name
+        self._query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disabled_until = 0.0
+        self._retrievals = 0
+        self._documents_embedded = 0
+        self._failures = 0
+
+    @property
+    def model_name(self) -> str:
+        if self._model_name is None:
+            embedding_settings = get_settings().embedding
+            self._model_name = f"{embedding_settings.provider}:{embedding_settings.get_current_config().get('model')}"
+        return self._model_name
+
+    def _get_embeddings(self):
+        if self._embeddings is None:
+            from .embedding_factory import EmbeddingFactory
+            self._embeddings = EmbeddingFactory.create_embeddings()
+        return self._embeddings
+
+    def available(self) -> bool:
+        return time.monotonic() >= self._disabled_until
+
+    def _mark_failed(self, error: Exception) -> None:
+        self._failures += 1
+        self._disabled_until = time.monotonic() + FAILURE_BACKOFF_SECONDS
+        logger.warning(f"Schema嵌入失败，{FAILURE_BACKOFF_SECONDS}秒内跳过向量检索: {error}")
+
+    def _is_current(self, embedding: Optional[Dict[str, Any]], documents: Dict[str, str]) -> bool:
+        """已保存的向量是否与当前文档和嵌入模型一致"""
+        if not embedding or embedding.get('model') != self.model_name:
+            return False
+        vectors = embedding.get('vectors') or {}
+        return all(key in vectors and vectors[key].get('hash') == _text_hash(text) for key, text in documents.items())
+
+    def index(self, items: List[Tuple[Dict[str, str], Optional[Dict[str, Any]]]]) -> Optional[List[Dict[str, Any]]]:
+        """上传文件、收集元数据时尽力生成向量，失败时返回None（之后在检索时补齐）"""
+        if not self.available():
+            return None
+        try:
+            return self.build_embeddings(items)
+        except Exception as e:
+            self._mark_failed(e)
+            return None
+
+    def build_embeddings(self, items: List[Tuple[Dict[str, str], Optional[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """批量嵌入多个候选的文档，只发起一次嵌入请求"""
+        model = self.model_name
+        results, pending = [], []
+        for documents, previous in items:
+            previous_vectors = (previous or {}).get('vectors', {}) if (previous or {}).get('model') == model else {}
+            vectors = {}
+            for key, text in documents.items():
+                text_hash = _text_hash(text)
+                if key in previous_vectors and previous_vectors[key].get('hash') == text_hash:
+                    vectors[key] = previous_vectors[key]
+                else:
+                    pending.append((vectors, key, text, text_hash))
+            results.append({'model': model, 'vectors': vectors})
+
+        if pending:
+            embedded = self._get_embeddings().embed_documents([text for _, _, text, _ in pending])
+            for (vectors, key, _, text_hash), vector in zip(pending, embedded):
+                vectors[key] = {
+                    'hash': text_hash,
+                    'vector': np.round(_normalize(vector), VECTOR_DECIMALS).tolist()
+                }
+            self._documents_embedded += len(pending)
+        return results
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        """嵌入问题（LRU缓存，重复问题不再请求嵌入服务）"""
+        with self._lock:
+            vector = self._query_cache.get(query)
+            if vector is not None:
+                self._query_cache.move_to_end(query)
+                return vector
+        vector = _normalize(self._get_embeddings().embed_query(query))
+        with self._lock:
+            self._query_cache[query] = vector
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def retrieve(self, query: str, candidates: List[Tuple[Dict[str, str], Optional[Dict[str, Any]]]],
+                 top_n: Optional[int] = None) -> Optional[Tuple[List[int], Dict[int, Dict[str, Any]]]]:
+        """
+        按向量相似度选出Top-N候选（阻塞调用）
+
+        Args:
+            query: 用户问题
+            candidates: 每个候选的 (检索文档, 已保存的向量)
+            top_n: 返回的候选数，默认使用配置值
+
+        Returns:
+            (按相似度降序的候选下标, {候选下标: 新生成的向量}) ，嵌入服务不可用时返回None
+        """
+        top_n = top_n or self.top_n
+        if not self.available():
+            return None
+        try:
+            stale = [index for index, (documents, embedding) in enumerate(candidates)
+                     if documents and not self._is_current(embedding, documents)]
+            updated = dict(zip(stale, self.build_embeddings([candidates[index] for index in stale])))
+            query_vector = self._embed_query(query)
+        except Exception as e:
+            self._mark_failed(e)
+            return None
+
+        # 所有文档向量组成矩阵一次计算相似度，候选得分取其各文档（工作表）的最大值
+        rows, owners = [], []
+        for index, (documents, embedding) in enumerate(candidates):
+            vectors = updated.get(index, embedding)
+            for key in documents:
+                rows.append(vectors['vectors'][key]['vector'])
+                owners.append(index)
+        scores = np.full(len(candidates), -np.inf, dtype=np.float32)
+        if rows:
+            similarities = np.asarray(rows, dtype=np.float32) @ query_vector
+            np.maximum.at(scores, np.asarray(owners), similarities)
+
+        ranked = np.argsort(-scores, kind='stable')[:top_n].tolist()
+        self._retrievals += 1
+        return ranked, updated
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'model': self._model_name,
+            'retrievals': self._retrievals,
+            'documents_embedded': self._documents_embedded,
+            'cached_queries': len(self._query_cache),
+            'failures': self._failures,
+            'available': self.available()
+        }
+
+
+# 全局实例
+_schema_index: Optional[SchemaIndex] = None
+
+
+def get_schema_index() -> Optional[SchemaIndex]:
+    """获取Schema检索索引实例，未启用时返回None"""
+    global _schema_index
+    if _schema_index is None:
+        smart_query_settings = get_settings().smart_query
+        if not smart_query_settings.schema_retrieval_enabled:
+            return None
+        _schema_index = SchemaIndex(
+            top_n=smart_query_settings.schema_retrieval_top_n,
+            query_cache_size=smart_query_settings.schema_query_cache_size
+        )
+    return _schema_index
@@ -1,14 +1,20 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import logging
 from datetime import datetime
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 from langchain_openai import ChatOpenAI
 from open_agent.core.context import UserContext
 from .smart_query import DatabaseQueryService
 from .postgresql_tool_manager import get_postgresql_tool
 from .mysql_tool_manager import get_mysql_tool
 from .table_metadata_service import TableMetadataService
+from .schema_index import get_schema_index, table_documents
+from .result_store import get_result_store, query_table, table_page
+from .generated_sql_cache import get_generated_sql_cache, tables_fingerprint, SQLCacheHit
+from .sql_guard import get_sql_guard, SQLGuard, SQLGuardError
+from .result_summary import SummaryStream, result_digest, stream_llm_text
+from .datasource_credentials import get_credential_resolver, ResolvedDatasource
+from ..core.executor import get_executor_pools
 from ..core.config import get_settings
 
 # 配置日志
@@ -42,7 +48,6 @@ class SmartDatabaseWorkflowManager:
     """
     
     def __init__(self, db=None):
-        self.executor = ThreadPoolExecutor(max_workers=4)
         self.database_service = DatabaseQueryService()
         self.postgresql_tool = get_postgresql_tool()
         self.mysql_tool = get_mysql_tool()
@@ -62,9 +67,12 @@ class SmartDatabaseWorkflowManager:
             raise ValueError(f"不支持的数据库类型: {db_type}")
     
     async def _run_in_executor(self, func, *args):
-        """在线程池中运行阻塞函数"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.executor, func, *args)
+        """在共享I/O线程池中运行阻塞函数（数据库、LLM调用、文件读取）"""
+        return await get_executor_pools().run_io(func, *args)
+
+    async def _run_cpu_bound(self, func, *args):
+        """在共享CPU线程池中运行pandas等CPU密集型函数"""
+        return await get_executor_pools().run_cpu(func, *args)
     
     def _convert_query_result_to_table_data(self, query_result: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -72,11 +80,10 @@ class SmartDatabaseWorkflowManager:
         参考Excel处理方式，以表格形式返回结果
         """
         try:
-            data = query_result.get('data', [])
-            columns = query_result.get('columns', [])
+            table = query_result.get('arrow')
             row_count = query_result.get('row_count', 0)
             
-            if not data or not columns:
+            if table is None or table.num_rows == 0 or table.num_columns == 0:
                 return {
                     'result_type': 'table',
                     'columns': [],
@@ -85,49 +92,11 @@ class SmartDatabaseWorkflowManager:
                     'message': '查询未返回数据'
                 }
             
-            # 构建列定义
-            table_columns = []
-            for i, col_name in enumerate(columns):
-                table_columns.append({
-                    'prop': f'col_{i}',
-                    'label': str(col_name),
-                    'width': 'auto'
-                })
-            
-            # 转换数据行
-            table_data = []
-            for row_index, row in enumerate(data):
-                row_data = {'_index': str(row_index)}
-                # 处理字典格式的行数据
-                if isinstance(row, dict):
-                    for i, col_name in enumerate(columns):
-                        col_prop = f'col_{i}'
-                        value = row.get(col_name)
-                        # 处理None值和特殊值
-                        if value is None:
-                            row_data[col_prop] = ''
-                        elif isinstance(value, (int, float, str, bool)):
-                            row_data[col_prop] = str(value)
-                        else:
-                            row_data[col_prop] = str(value)
-                else:
-                    # 处理列表格式的行数据（兼容性处理）
-                    for i, value in enumerate(row):
-                        col_prop = f'col_{i}'
-                        # 处理None值和特殊值
-                        if value is None:
-                            row_data[col_prop] = ''
-                        elif isinstance(value, (int, float, str, bool)):
-                            row_data[col_prop] = str(value)
-                        else:
-                            row_data[col_prop] = str(value)
-                
-                table_data.append(row_data)
-            
+            # 查询结果已是Arrow表，按列转换，不逐行处理
+            table_data = table_page(query_table(table))
             return {
                 'result_type': 'table_data',
-                'columns': table_columns,
-                'data': table_data,
+                **table_data,
                 'total': row_count,
                 'message': f'查询成功，共返回 {row_count} 条记录'
             }
@@ -142,6 +111,29 @@ class SmartDatabaseWorkflowManager:
                 'message': f'结果转换失败: {str(e)}'
             }
     
+    async def _build_result_table_data(self, query_result: Dict[str, Any], user_id: int) -> Dict[str, Any]:
+        """表格结果：启用结果存储时保存完整结果并返回第一页，否则整体转换"""
+        result_store = get_result_store()
+        table = query_result.get('arrow')
+        if result_store is None or table is None or table.num_rows == 0 or table.num_columns == 0:
+            return self._convert_query_result_to_table_data(query_result)
+        try:
+            table_data = await self._run_in_executor(result_store.store_first_page, query_table(table), user_id)
+        except OSError as e:
+            logger.warning(f"保存查询结果失败，返回完整结果: {str(e)}")
+            return self._convert_query_result_to_table_data(query_result)
+        row_count = query_result.get('row_count', table_data['total'])
+        return {
+            'result_type': 'table_data',
+            **table_data,
+            'message': f'查询成功，共返回 {row_count} 条记录'
+        }
+    
+    @staticmethod
+    def _compact_query_result(query_result: Dict[str, Any]) -> Dict[str, Any]:
+        """最终事件中的原始查询结果不携带数据（数据行在table_data中，结果已保存时只有第一页）"""
+        return {key: value for key, value in query_result.items() if key not in ('arrow', 'data')}
+    
     async def process_database_query_stream(
         self, 
         user_query: str, 
@@ -153,12 +145,12 @@ class SmartDatabaseWorkflowManager:
         实时推送每个工作流步骤
         
         新流程：
-        1. 根据database_config_id获取数据库配置并创建连接
-        2. 从系统数据库读取表元数据（只包含启用问答的表）
+        1. 根据database_config_id获取数据库配置，在后台检查数据源连接（复用连接池健康状态）
+        2. 从系统数据库读取表元数据（只包含启用问答的表，与连接检查并行）
         3. 根据表元数据生成SQL
-        4. 执行SQL查询
-        5. 查询数据后处理成表格形式
-        6. 生成数据总结
+        4. 连接检查完成后执行SQL查询
+        5. 查询数据后处理成表格形式，先推送表格结果（result_table事件）
+        6. 生成数据总结（与步骤5并行）
         7. 返回结果
         
         Args:
@@ -170,56 +162,22 @@ class SmartDatabaseWorkflowManager:
             包含工作流步骤或最终结果的字典
         """
         workflow_steps = []
+        connection_task = None
+        summary_stream = None
         
         try:
             logger.info(f"开始执行流式数据库查询工作流 - 用户ID: {user_id}, 数据库配置ID: {database_config_id}, 查询: {user_query[:50]}...")
             
-            # 步骤1: 根据database_config_id获取数据库配置并创建连接
-            try:
-                step_data = {
-                    'type': 'workflow_step',
-                    'step': 'database_connection',
-                    'status': 'running',
-                    'message': '正在建立数据库连接...',
-                    'timestamp': datetime.now().isoformat()
-                }
-                yield step_data
-                
-                # 获取数据库配置并建立连接
-                connection_result = await self._connect_database(user_id, database_config_id)
-                if not connection_result['success']:
-                    raise DatabaseConnectionError(connection_result['message'])
-                
-                step_data.update({
-                    'status': 'completed',
-                    'message': '数据库连接成功',
-                    'details': {'database': connection_result.get('database_name', 'Unknown')}
-                })
-                yield step_data
-                
-                workflow_steps.append({
-                    'step': 'database_connection',
-                    'status': 'completed',
-                    'message': '数据库连接成功'
-                })
-                
-            except Exception as e:
-                error_msg = f'数据库连接失败: {str(e)}'
-                step_data = {
-                    'type': 'workflow_step',
-                    'step': 'database_connection',
-                    'status': 'failed',
-                    'message': error_msg,
-                    'timestamp': datetime.now().isoformat()
-                }
-                yield step_data
-                
-                yield {
-                    'type': 'error',
-                    'message': error_msg,
-                    'workflow_steps': workflow_steps
-                }
-                return
+            # 步骤1: 读取数据库配置，连接检查在后台进行（与读取表元数据、选表和SQL生成并行）
+            step_data = {
+                'type': 'workflow_step',
+                'step': 'database_connection',
+                'status': 'running',
+                'message': '正在检查数据库连接...',
+                'timestamp': datetime.now().isoformat()
+            }
+            yield step_data
+            connection_task = self._start_datasource_check(user_id, database_config_id)
             
             # 步骤2: 从系统数据库读取表元数据（只包含启用问答的表）
             try:
@@ -248,6 +206,19 @@ class SmartDatabaseWorkflowManager:
                     'message': f'成功读取表元数据'
                 })
                 
+                # 连接检查已完成时先推送结果，连接失败则不再调用LLM
+                connection_step = await self._connection_step(connection_task, workflow_steps, wait=False)
+                if connection_step:
+                    connection_task = None
+                    yield connection_step
+                    if connection_step['status'] == 'failed':
+                        yield {
+                            'type': 'error',
+                            'message': connection_step['message'],
+                            'workflow_steps': workflow_steps
+                        }
+                        return
+                
             except Exception as e:
                 error_msg = f'获取表元数据失败: {str(e)}'
                 step_data = {
@@ -277,8 +248,13 @@ class SmartDatabaseWorkflowManager:
                 }
                 yield step_data
                 
-                # 根据表元数据选择相关表并生成SQL
-                target_tables, target_schemas = await self._select_target_table(user_query, tables_info)
+                # 根据表元数据选择相关表并生成SQL（命中SQL缓存时跳过两次LLM调用）
+                cache_hit = self._lookup_cached_sql(user_query, tables_info, database_config_id)
+                if cache_hit:
+                    target_tables = cache_hit.tables
+                    target_schemas = [tables_info[table] for table in target_tables]
+                else:
+                    target_tables, target_schemas = await self._select_target_table(user_query, tables_info)
                 step_data = {
                     'type': 'workflow_step',
                     'step': 'table_selected',
@@ -293,14 +269,18 @@ class SmartDatabaseWorkflowManager:
                     'status': 'completed',
                     'message': f'已经智能选择了相关表: {", ".join(target_tables)}',
                 })
-                sql_query = await self._generate_sql_query(user_query, target_tables, target_schemas)
+                if cache_hit:
+                    sql_query = cache_hit.sql
+                else:
+                    sql_query = await self._generate_sql_query(user_query, target_tables, target_schemas)
                 
                 step_data.update({
                     'status': 'completed',
-                    'message': 'SQL查询生成成功',
+                    'message': 'SQL查询生成成功（使用缓存）' if cache_hit else 'SQL查询生成成功',
                     'details': {
                         'target_tables': target_tables,
-                        'generated_sql': sql_query[:100] + '...' if len(sql_query) > 100 else sql_query
+                        'generated_sql': sql_query[:100] + '...' if len(sql_query) > 100 else sql_query,
+                        'sql_cache_hit': cache_hit is not None
                     }
                 })
                 yield step_data
@@ -329,7 +309,18 @@ class SmartDatabaseWorkflowManager:
                 }
                 return
             
-            # 步骤4: 执行SQL查询
+            # 步骤4: 执行SQL查询（等待后台的连接检查）
+            connection_step = await self._connection_step(connection_task, workflow_steps, wait=True)
+            if connection_step:
+                connection_task = None
+                yield connection_step
+                if connection_step['status'] == 'failed':
+                    yield {
+                        'type': 'error',
+                        'message': connection_step['message'],
+                        'workflow_steps': workflow_steps
+                    }
+                    return
             try:
                 step_data = {
                     'type': 'workflow_step',
@@ -340,7 +331,9 @@ class SmartDatabaseWorkflowManager:
                 }
                 yield step_data
                 
-                query_result = await self._execute_database_query(user_id, sql_query, database_config_id)
+                target_tables, sql_query, query_result = await self._execute_generated_query(
+                    user_id, user_query, database_config_id, tables_info, target_tables, sql_query, cache_hit
+                )
                 
                 step_data.update({
                     'status': 'completed',
@@ -373,99 +366,114 @@ class SmartDatabaseWorkflowManager:
                 }
                 return
             
-            # 步骤5: 查询数据后处理成表格形式（在步骤6中完成）
-            # 步骤6: 生成数据总结
+            # 步骤5、6: 数据总结在后台流式生成，表格结果格式化完成后先推送给前端，随后推送总结增量
+            summary_stream = self._start_database_summary(user_query, query_result, ', '.join(target_tables))
             try:
                 step_data = {
                     'type': 'workflow_step',
-                    'step': 'ai_summary',
+                    'step': 'result_formatting',
                     'status': 'running',
-                    'message': '正在生成查询结果总结...',
+                    'message': '正在格式化查询结果...',
                     'timestamp': datetime.now().isoformat()
                 }
                 yield step_data
                 
-                summary = await self._generate_database_summary(user_query, query_result, ', '.join(target_tables))
+                # 转换为表格格式（完整结果保存在服务端，只返回第一页和结果句柄）
+                table_data = await self._build_result_table_data(query_result, user_id)
                 
                 step_data.update({
                     'status': 'completed',
-                    'message': '总结生成完成',
-                    'details': {
-                        'tables_analyzed': target_tables,
-                        'summary_length': len(summary)
-                    }
+                    'message': '结果格式化完成'
                 })
                 yield step_data
                 
                 workflow_steps.append({
-                    'step': 'ai_summary',
+                    'step': 'result_formatting',
                     'status': 'completed',
-                    'message': '总结生成完成'
+                    'message': '结果格式化完成'
                 })
                 
-            except Exception as e:
-                logger.warning(f'生成总结失败: {str(e)}')
-                summary = '查询执行完成，但生成总结时出现问题。'
+                yield {
+                    'type': 'result_table',
+                    'data': {
+                        **table_data,
+                        'generated_sql': sql_query,
+                        'table_name': target_tables
+                    },
+                    'timestamp': datetime.now().isoformat()
+                }
                 
-                workflow_steps.append({
-                    'step': 'ai_summary',
-                    'status': 'warning',
-                    'message': '总结生成失败，但查询成功'
-                })
+            except Exception as e:
+                summary_stream.cancel()
+                error_msg = f'结果格式化失败: {str(e)}'
+                yield {
+                    'type': 'error',
+                    'message': error_msg,
+                    'workflow_steps': workflow_steps
+                }
+                return
             
-            # 步骤7: 返回最终结果，且结果参考excel的处理方式，尽量以表格形式返回
             try:
                 step_data = {
                     'type': 'workflow_step',
-                    'step': 'result_formatting',
+                    'step': 'ai_summary',
                     'status': 'running',
-                    'message': '正在格式化查询结果...',
+                    'message': '正在生成查询结果总结...',
                     'timestamp': datetime.now().isoformat()
                 }
                 yield step_data
                 
-                # 转换为表格格式
-                table_data = self._convert_query_result_to_table_data(query_result)
+                async for delta in summary_stream.deltas():
+                    yield {
+                        'type': 'summary_delta',
+                        'delta': delta
+                    }
+                summary = summary_stream.text
                 
                 step_data.update({
                     'status': 'completed',
-                    'message': '结果格式化完成'
+                    'message': '总结生成完成',
+                    'details': {
+                        'tables_analyzed': target_tables,
+                        'summary_length': len(summary)
+                    }
                 })
                 yield step_data
                 
                 workflow_steps.append({
-                    'step': 'result_formatting',
+                    'step': 'ai_summary',
                     'status': 'completed',
-                    'message': '结果格式化完成'
+                    'message': '总结生成完成'
                 })
                 
-                # 返回最终结果
-                final_result = {
-                    'type': 'final_result',
-                    'success': True,
-                    'data': {
-                        **table_data,
-                        'generated_sql': sql_query,
-                        'summary': summary,
-                        'table_name': target_tables,
-                        'query_result': query_result,
-                        'metadata_source': 'saved_database'  # 标记元数据来源
-                    },
-                    'workflow_steps': workflow_steps,
-                    'timestamp': datetime.now().isoformat()
-                }
-                
-                yield final_result
-                logger.info(f"数据库查询工作流完成 - 用户ID: {user_id}")
-                
             except Exception as e:
-                error_msg = f'结果格式化失败: {str(e)}'
-                yield {
-                    'type': 'error',
-                    'message': error_msg,
-                    'workflow_steps': workflow_steps
-                }
-                return
+                logger.warning(f'生成总结失败: {str(e)}')
+                summary = '查询执行完成，但生成总结时出现问题。'
+                
+                workflow_steps.append({
+                    'step': 'ai_summary',
+                    'status': 'warning',
+                    'message': '总结生成失败，但查询成功'
+                })
+            
+            # 步骤7: 返回最终结果，且结果参考excel的处理方式，尽量以表格形式返回
+            final_result = {
+                'type': 'final_result',
+                'success': True,
+                'data': {
+                    **table_data,
+                    'generated_sql': sql_query,
+                    'summary': summary,
+                    'table_name': target_tables,
+                    'query_result': self._compact_query_result(query_result),
+                    'metadata_source': 'saved_database'  # 标记元数据来源
+                },
+                'workflow_steps': workflow_steps,
+                'timestamp': datetime.now().isoformat()
+            }
+            
+            yield final_result
+            logger.info(f"数据库查询工作流完成 - 用户ID: {user_id}")
             
         except Exception as e:
             logger.error(f"数据库查询工作流异常: {str(e)}", exc_info=True)
@@ -474,59 +482,94 @@ class SmartDatabaseWorkflowManager:
                 'message': f'系统异常: {str(e)}',
                 'workflow_steps': workflow_steps
             }
+        finally:
+            # 提前结束（如读取表元数据失败）时不再等待后台的连接检查
+            if connection_task is not None and not connection_task.done():
+                connection_task.cancel()
+            # 客户端断开或提前结束时停止后台的总结生成
+            if summary_stream is not None:
+                summary_stream.cancel()
     
-    async def _connect_database(self, user_id: int, database_config_id: int) -> Dict[str, Any]:
-        """连接数据库（判断用户现有连接）"""
+    async def _connection_step(self, connection_task: Optional[asyncio.Future], workflow_steps: List[Dict],
+                               wait: bool) -> Optional[Dict[str, Any]]:
+        """后台连接检查的步骤事件；wait=False 且检查尚未结束（或已推送过）时返回None"""
+        if connection_task is None or (not wait and not connection_task.done()):
+            return None
+        connection_result = await connection_task
+        if not connection_result['success']:
+            return {
+                'type': 'workflow_step',
+                'step': 'database_connection',
+                'status': 'failed',
+                'message': f"数据库连接失败: {connection_result['message']}",
+                'timestamp': datetime.now().isoformat()
+            }
+        workflow_steps.append({
+            'step': 'database_connection',
+            'status': 'completed',
+            'message': '数据库连接成功'
+        })
+        return {
+            'type': 'workflow_step',
+            'step': 'database_connection',
+            'status': 'completed',
+            'message': '数据库连接成功',
+            'details': {'database': connection_result.get('database_name', 'Unknown')},
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def _resolve_datasource(self, user_id: int, database_config_id: int) -> Tuple[ResolvedDatasource, Any]:
+        """
+        获取数据源连接信息和对应的数据库工具（连接信息在进程内缓存，不再每步读取配置和解密）
+
+        Raises:
+            ValueError: 配置不存在或数据库类型不支持
+        """
+        config = get_credential_resolver().resolve(self.db, database_config_id, user_id)
+        if not config:
+            raise ValueError('数据库配置不存在')
+        return config, self._get_database_tool(config.db_type)
+    
+    def _prepare_datasource(self, user_id: int, database_config_id: int) -> Dict[str, Any]:
+        """读取数据库配置并登记数据源连接池（不访问业务数据库）"""
         try:
-            # 获取数据库配置
-            from ..services.database_config_service import DatabaseConfigService
-            config_service = DatabaseConfigService(self.db)
-            config = config_service.get_config_by_id(database_config_id, user_id)
-            
-            if not config:
-                return {'success': False, 'message': '数据库配置不存在'}
-            
-            # 根据数据库类型选择对应的工具
             try:
-                db_tool = self._get_database_tool(config.db_type)
+                config, db_tool = self._resolve_datasource(user_id, database_config_id)
             except ValueError as e:
                 return {'success': False, 'message': str(e)}
             
-            # 测试连接（如果已经有连接则直接复用）
-            connection_config = {
-                'host': config.host,
-                'port': config.port,
-                'database': config.database,
-                'username': config.username,
-                'password': config_service._decrypt_password(config.password)
+            # 配置变化（如修改密码）时连接池按连接配置指纹重建
+            db_tool.register_datasource(str(user_id), config.connection_config, config.id)
+            return {
+                'success': True,
+                'db_tool': db_tool,
+                'datasource_id': config.id,
+                'database_name': config.database,
+                'db_type': config.db_type
             }
-            
-            try:
-                connection = db_tool._test_connection(connection_config)
-                if connection['success'] == True:
-                    return {
-                        'success': True,
-                        'database_name': config.database,
-                        'db_type': config.db_type,
-                        'message': '连接成功'
-                    }
-                else:
-                    return {
-                        'success': False,
-                        'database_name': config.database,
-                        'db_type': config.db_type,
-                        'message': '连接失败'
-                    }
-            except Exception as e:
-                return {
-                    'success': False,
-                    'message': f'连接失败: {str(e)}'
-                }
                 
         except Exception as e:
             logger.error(f"数据库连接异常: {str(e)}")
             return {'success': False, 'message': f'连接异常: {str(e)}'}
     
+    async def _check_datasource_health(self, user_id: int, datasource: Dict[str, Any]) -> Dict[str, Any]:
+        """数据源健康检查：连接池最近成功使用过时直接返回，否则从池中取连接验证（不再每次新建测试连接）"""
+        result = {key: value for key, value in datasource.items() if key != 'db_tool'}
+        try:
+            checked = await datasource['db_tool'].check_datasource_health(str(user_id), datasource['datasource_id'])
+            return {**result, 'success': True, 'health_checked': checked, 'message': '连接成功'}
+        except Exception as e:
+            return {**result, 'success': False, 'message': f'连接失败: {str(e)}'}
+    
+    def _start_datasource_check(self, user_id: int, database_config_id: int) -> asyncio.Future:
+        """登记数据源并在后台检查连接，与表元数据读取、选表和SQL生成并行"""
+        datasource = self._prepare_datasource(user_id, database_config_id)
+        if not datasource['success']:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(datasource)
+            return future
+        return asyncio.create_task(self._check_datasource_health(user_id, datasource))
+    
     async def _get_saved_tables_metadata(self, user_id: int, database_config_id: int) -> Dict[str, Dict[str, Any]]:
         """从系统数据库中读取已保存的表元数据"""
         try:
@@ -534,8 +577,8 @@ class SmartDatabaseWorkflowManager:
                 raise TableSchemaError("表元数据服务未初始化")
             
             # 从数据库中获取表元数据
-            saved_metadata = self.table_metadata_service.get_user_table_metadata(
-                user_id, database_config_id
+            saved_metadata = await self._run_in_executor(
+                self.table_metadata_service.get_user_table_metadata, user_id, database_config_id
             )
             
             if not saved_metadata:
@@ -554,6 +597,8 @@ class SmartDatabaseWorkflowManager:
                         'table_comment': meta.table_comment or '',
                         'qa_description': meta.qa_description or '',
                         'business_context': meta.business_context or '',
+                        'metadata_id': meta.id,
+                        'schema_embedding': meta.schema_embedding,
                         'from_saved_metadata': True  # 标记来源
                     }
             
@@ -570,17 +615,9 @@ class SmartDatabaseWorkflowManager:
     async def _get_table_schema(self, user_id: int, table_name: str, database_config_id: int) -> Dict[str, Any]:
         """获取指定表结构"""
         try:
-            # 获取数据库配置
-            from ..services.database_config_service import DatabaseConfigService
-            config_service = DatabaseConfigService(self.db)
-            config = config_service.get_config_by_id(database_config_id, user_id)
-            
-            if not config:
-                raise TableSchemaError('数据库配置不存在')
-            
             # 根据数据库类型选择对应的工具
             try:
-                db_tool = self._get_database_tool(config.db_type)
+                _, db_tool = self._resolve_datasource(user_id, database_config_id)
             except ValueError as e:
                 raise TableSchemaError(str(e))
             
@@ -596,6 +633,32 @@ class SmartDatabaseWorkflowManager:
             logger.error(f"获取表结构异常: {str(e)}")
             raise TableSchemaError(f'获取表结构失败: {str(e)}')
     
+    async def _retrieve_candidate_tables(self, user_query: str, tables_info: Dict[str, Dict]) -> Dict[str, Dict]:
+        """表数量超过Top-N时按向量相似度预选候选表，嵌入服务不可用时返回全部表"""
+        schema_index = get_schema_index()
+        if schema_index is None or len(tables_info) <= schema_index.top_n:
+            return tables_info
+        
+        schemas = list(tables_info.values())
+        retrieved = await self._run_in_executor(
+            schema_index.retrieve,
+            user_query,
+            [(table_documents(schema), schema.get('schema_embedding')) for schema in schemas]
+        )
+        if retrieved is None:
+            return tables_info
+        
+        ranked, updated = retrieved
+        # 补齐的向量写回表元数据，下次检索不再重复嵌入
+        if updated and self.table_metadata_service:
+            await self._run_in_executor(
+                self.table_metadata_service.save_schema_embeddings,
+                {schemas[index]['metadata_id']: embedding for index, embedding in updated.items()}
+            )
+        candidates = {schemas[index]['table_name']: schemas[index] for index in ranked}
+        logger.info(f"向量预选 {len(candidates)}/{len(tables_info)} 个候选表: {list(candidates.keys())}")
+        return candidates
+    
     async def _select_target_table(self, user_query: str, tables_info: Dict[str, Dict]) -> tuple[List[str], List[Dict]]:
         """根据用户查询选择相关的表，支持返回多个表"""
         try:
@@ -604,6 +667,12 @@ class SmartDatabaseWorkflowManager:
                 table_name = list(tables_info.keys())[0]
                 return [table_name], [tables_info[table_name]]
             
+            # 表较多时先按向量相似度预选候选，只把候选交给LLM
+            tables_info = await self._retrieve_candidate_tables(user_query, tables_info)
+            if len(tables_info) == 1:
+                table_name = list(tables_info.keys())[0]
+                return [table_name], [tables_info[table_name]]
+            
             # 多个表时，使用LLM选择相关的表
             tables_summary = []
             for table_name, schema in tables_info.items():
@@ -652,8 +721,9 @@ class SmartDatabaseWorkflowManager:
             table_name = list(tables_info.keys())[0]
             return [table_name], [tables_info[table_name]]
     
-    async def _generate_sql_query(self, user_query: str, table_names: List[str], table_schemas: List[Dict]) -> str:
-        """生成SQL语句，支持多表关联查询"""
+    async def _generate_sql_query(self, user_query: str, table_names: List[str], table_schemas: List[Dict],
+                                  feedback: Optional[str] = None) -> str:
+        """生成SQL语句，支持多表关联查询；feedback为上一次SQL未通过执行前检查的原因和执行计划"""
         try:
             # 构建所有表的结构信息
             tables_info = []
@@ -684,6 +754,8 @@ class SmartDatabaseWorkflowManager:
             3. 使用合适的JOIN类型（INNER JOIN、LEFT JOIN等）
             4. 确保SELECT的字段来源明确，必要时使用表名前缀
             """
+            if feedback:
+                prompt += f"\n{feedback}\n"
             
             # 使用LLM生成SQL
             response = await self.llm.ainvoke(prompt)
@@ -704,63 +776,151 @@ class SmartDatabaseWorkflowManager:
             logger.error(f"SQL生成异常: {str(e)}")
             raise SQLGenerationError(f'SQL生成失败: {str(e)}')
     
+    def _lookup_cached_sql(self, user_query: str, tables_info: Dict[str, Dict],
+                           database_config_id: int) -> Optional[SQLCacheHit]:
+        """同一数据源、表结构未变化时，重复（或只是数字/引号内文本不同）的问题直接使用缓存的SQL"""
+        sql_cache = get_generated_sql_cache()
+        if sql_cache is None:
+            return None
+        cache_hit = sql_cache.lookup(database_config_id, tables_fingerprint(tables_info), user_query)
+        if cache_hit is None or not all(table in tables_info for table in cache_hit.tables):
+            return None
+        logger.info(f"命中生成SQL缓存，跳过选表和SQL生成: {user_query[:50]}")
+        return cache_hit
+    
+    async def _execute_generated_query(
+        self,
+        user_id: int,
+        user_query: str,
+        database_config_id: int,
+        tables_info: Dict[str, Dict],
+        target_tables: List[str],
+        sql_query: str,
+        cache_hit: Optional[SQLCacheHit]
+    ) -> Tuple[List[str], str, Dict[str, Any]]:
+        """
+        执行SQL并维护SQL缓存：缓存的SQL执行失败时移除并重新生成，新生成的SQL执行成功后写入缓存；
+        SQL未通过执行前检查（非只读、无法执行或估算代价过高）时带着原因和执行计划让LLM改写，
+        最多重试 sql_guard_max_retries 次
+        
+        Returns:
+            (目标表, 实际执行的SQL, 查询结果)
+        """
+        sql_cache = get_generated_sql_cache()
+        cached_result = sql_cache.get_result(database_config_id, sql_query) if sql_cache else None
+        if cached_result is not None:
+            logger.info(f"命中查询结果缓存: {sql_query[:50]}")
+            return target_tables, sql_query, cached_result
+        
+        sql_guard = get_sql_guard()
+        rewrites = 0
+        while True:
+            try:
+                query_result = await self._execute_database_query(user_id, sql_query, database_config_id)
+                break
+            except SQLGuardError as e:
+                if cache_hit is not None:
+                    sql_cache.invalidate(cache_hit)
+                    cache_hit = None
+                if rewrites >= sql_guard.max_retries:
+                    raise QueryExecutionError(f'SQL未通过执行前检查: {str(e)}')
+                rewrites += 1
+                logger.warning(f"SQL未通过执行前检查，第{rewrites}次重新生成: {str(e)}")
+                target_schemas = [tables_info[table] for table in target_tables if table in tables_info]
+                sql_query = await self._generate_sql_query(
+                    user_query, target_tables, target_schemas, feedback=SQLGuard.rewrite_feedback(sql_query, e)
+                )
+            except QueryExecutionError as e:
+                if cache_hit is None:
+                    raise
+                logger.warning(f"缓存的SQL执行失败，重新生成: {str(e)}")
+                sql_cache.invalidate(cache_hit)
+                cache_hit = None
+                target_tables, target_schemas = await self._select_target_table(user_query, tables_info)
+                sql_query = await self._generate_sql_query(user_query, target_tables, target_schemas)
+        
+        if sql_cache:
+            if cache_hit is None:
+                sql_cache.store(database_config_id, tables_fingerprint(tables_info), user_query, target_tables, sql_query)
+            sql_cache.put_result(database_config_id, sql_query, query_result)
+        return target_tables, sql_query, query_result
+    
     async def _execute_database_query(self, user_id: int, sql_query: str, database_config_id: int) -> Dict[str, Any]:
         """执行SQL语句"""
         try:
-            # 获取数据库配置
-            from ..services.database_config_service import DatabaseConfigService
-            config_service = DatabaseConfigService(self.db)
-            config = config_service.get_config_by_id(database_config_id, user_id)
-            
-            if not config:
-                raise QueryExecutionError('数据库配置不存在')
-            
             # 根据数据库类型选择对应的工具
             try:
-                db_tool = self._get_database_tool(config.db_type)
+                config, db_tool = self._resolve_datasource(user_id, database_config_id)
             except ValueError as e:
                 raise QueryExecutionError(str(e))
             
-            # 使用对应的数据库工具执行查询
-            if str(user_id) in db_tool.connections:
-                query_result = db_tool._execute_query(db_tool.connections[str(user_id)]['connection'], sql_query)
-            else:
-                raise QueryExecutionError('请重新进行数据库连接')
+            # 在数据源连接池上执行查询，连接池已关闭时用缓存的连接信息重新登记
+            if not db_tool.is_connected(str(user_id), database_config_id):
+                db_tool.register_datasource(str(user_id), config.connection_config, config.id)
+            sql_guard = get_sql_guard()
+            if sql_guard:
+                sql_query = await self._check_generated_sql(
+                    db_tool, sql_guard, user_id, sql_query, database_config_id, config.db_type
+                )
+            tool_result = await db_tool.execute(
+                operation="execute_query",
+                user_id=str(user_id),
+                sql_query=sql_query,
+                limit=100,
+                datasource_id=database_config_id,
+                columnar=True,
+                timeout_seconds=get_settings().smart_query.sql_statement_timeout_seconds or None
+            )
+            if not tool_result.success:
+                raise QueryExecutionError(tool_result.error or '查询执行失败')
+            query_result = tool_result.result
             
-            if query_result.get('success'):
-                data = query_result.get('data', [])
-                return {
-                    'success': True,
-                    'data': data,
-                    'row_count': len(data),
-                    'columns': query_result.get('columns', []),
-                    'sql_query': sql_query
-                }
-            else:
-                raise QueryExecutionError(query_result.get('error', '查询执行失败'))
+            table = query_result.get('table')
+            return {
+                'success': True,
+                'arrow': table,
+                'row_count': query_result.get('row_count', 0),
+                'truncated': query_result.get('truncated', False),
+                'columns': query_result.get('columns', []),
+                'sql_query': sql_query
+            }
                 
+        except SQLGuardError:
+            raise
         except Exception as e:
             logger.error(f"查询执行异常: {str(e)}")
             raise QueryExecutionError(f'查询执行失败: {str(e)}')
     
-    async def _generate_database_summary(self, user_query: str, query_result: Dict, tables_str: str) -> str:
-        """生成AI总结，支持多表查询结果"""
-        try:
-            data = query_result.get('data', [])
-            row_count = query_result.get('row_count', 0)
-            columns = query_result.get('columns', [])
-            sql_query = query_result.get('sql_query', '')
-            
-            # 构建总结提示词
-            prompt = f"""
+    async def _check_generated_sql(self, db_tool, sql_guard: SQLGuard, user_id: int, sql_query: str,
+                                   database_config_id: int, db_type: str) -> str:
+        """执行前检查：单条只读语句，EXPLAIN估算的代价和全表扫描不超过阈值（不执行查询本身）"""
+        statement = sql_guard.check_read_only(sql_query, db_type)
+        explain_result = await db_tool.execute(
+            operation="explain_query",
+            user_id=str(user_id),
+            sql_query=statement,
+            datasource_id=database_config_id
+        )
+        if not explain_result.success:
+            raise SQLGuardError(f'SQL无法执行: {explain_result.error}', reason='invalid')
+        sql_guard.check_plan(explain_result.result)
+        logger.info(f"SQL执行前检查通过: 估算代价 {explain_result.result.get('cost')}，估算行数 {explain_result.result.get('rows')}")
+        return statement
+    
+    def _start_database_summary(self, user_query: str, query_result: Dict, tables_str: str) -> SummaryStream:
+        """在后台流式生成AI总结，支持多表查询结果；提示词使用结果的统计摘要而不是原始数据行"""
+        row_count = query_result.get('row_count', 0)
+        digest = result_digest(query_result.get('arrow'), row_count, query_result.get('truncated', False))
+        sql_query = query_result.get('sql_query', '')
+        
+        # 构建总结提示词
+        prompt = f"""
 用户查询: {user_query}
 涉及的表: {tables_str}
-查询结果: 共 {row_count} 条记录
-查询的字段: {', '.join(columns)}
 执行的SQL: {sql_query}
 
-前几条数据示例:
-{str(data[:3]) if data else '无数据'}
+查询结果摘要:
+{digest}
 
 请基于以上信息，用中文生成一个简洁的查询结果总结，包括：
 1. 查询涉及的表及其关系
@@ -774,17 +934,8 @@ class SmartDatabaseWorkflowManager:
 3. 如果是多表查询，需要说明表之间的关系
 4. 总结不超过300字
 """
-            
-            # 使用LLM生成总结
-            response = await self.llm.ainvoke(prompt)
-            summary = response.content.strip()
-            
-            logger.info(f"生成的总结: {summary[:100]}...")
-            return summary
-            
-        except Exception as e:
-            logger.error(f"总结生成异常: {str(e)}")
-            return f"查询完成，共返回 {query_result.get('row_count', 0)} 条记录。涉及的表: {tables_str}"
+        fallback = f"查询完成，共返回 {row_count} 条记录。涉及的表: {tables_str}"
+        return SummaryStream(stream_llm_text(self.llm, prompt), fallback)
     
     async def process_database_query(
         self, 
@@ -819,36 +970,46 @@ class SmartDatabaseWorkflowManager:
         Returns:
             包含查询结果的字典
         """
+        connection_task = None
+        summary_stream = None
         try:
             logger.info(f"开始执行数据库查询工作流 - 用户ID: {user_id}, 数据库配置ID: {database_config_id}, 查询: {user_query[:50]}...")
             
-            # 步骤1: 根据database_config_id获取数据库配置并创建连接
-            connection_result = await self._connect_database(user_id, database_config_id)
-            if not connection_result['success']:
-                raise DatabaseConnectionError(connection_result['message'])
-            
-            logger.info("数据库连接成功")
+            # 步骤1: 根据database_config_id获取数据库配置，连接检查与步骤2、3并行
+            connection_task = self._start_datasource_check(user_id, database_config_id)
             
             # 步骤2: 从系统数据库读取表元数据（只包含启用问答的表）
             tables_info = await self._get_saved_tables_metadata(user_id, database_config_id)
             
             logger.info(f"表元数据读取完成 - 共{len(tables_info)}个启用问答的表")
             
-            # 步骤3: 根据表元数据选择相关表并生成SQL
-            target_tables, target_schemas = await self._select_target_table(user_query, tables_info)
-            sql_query = await self._generate_sql_query(user_query, target_tables, target_schemas)
+            # 步骤3: 根据表元数据选择相关表并生成SQL（命中SQL缓存时跳过两次LLM调用）
+            cache_hit = self._lookup_cached_sql(user_query, tables_info, database_config_id)
+            if cache_hit:
+                target_tables, sql_query = cache_hit.tables, cache_hit.sql
+            else:
+                target_tables, target_schemas = await self._select_target_table(user_query, tables_info)
+                sql_query = await self._generate_sql_query(user_query, target_tables, target_schemas)
             
             logger.info(f"SQL生成完成 - 目标表: {', '.join(target_tables)}")
             
+            connection_result = await connection_task
+            if not connection_result['success']:
+                raise DatabaseConnectionError(connection_result['message'])
+            logger.info("数据库连接成功")
+            
             # 步骤4: 执行SQL查询
-            query_result = await self._execute_database_query(user_id, sql_query, database_config_id)
+            target_tables, sql_query, query_result = await self._execute_generated_query(
+                user_id, user_query, database_config_id, tables_info, target_tables, sql_query, cache_hit
+            )
             logger.info("查询执行完成")
             
-            # 步骤5: 查询数据后处理成表格形式
-            table_data = self._convert_query_result_to_table_data(query_result)
-            
-            # 步骤6: 生成数据总结
-            summary = await self._generate_database_summary(user_query, query_result, ', '.join(target_tables))
+            # 步骤5、6: 查询数据后处理成表格形式，同时生成数据总结
+            summary_stream = self._start_database_summary(user_query, query_result, ', '.join(target_tables))
+            table_data, summary = await asyncio.gather(
+                self._build_result_table_data(query_result, user_id),
+                summary_stream.collect()
+            )
             
             # 步骤7: 返回结果
             return {
@@ -858,7 +1019,7 @@ class SmartDatabaseWorkflowManager:
                     'generated_sql': sql_query,
                     'summary': summary,
                     'table_names': target_tables,
-                    'query_result': query_result,
+                    'query_result': self._compact_query_result(query_result),
                     'metadata_source': 'saved_database'  # 标记元数据来源
                 }
             }
@@ -876,4 +1037,9 @@ class SmartDatabaseWorkflowManager:
                 'success': False,
                 'error': f'系统异常: {str(e)}',
                 'error_type': 'SystemError'
-            }
\ No newline at end of file
+            }
+        finally:
+            if connection_task is not None and not connection_task.done():
+                connection_task.cancel()
+            if summary_stream is not None:
+                summary_stream.cancel()
\ No newline at end of file
@@ -1,12 +1,13 @@
-from typing import Dict, Any, List, Optional, Union
+from typing import Dict, Any, List, Optional, Tuple, Union
 import pandas as pd
+import pyarrow as pa
 import os
 import tempfile
 import json
 import logging
 from datetime import datetime
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import functools
+from concurrent.futures import Future
 from langchain_core.runnables import RunnableLambda
 from langchain_experimental.agents import create_pandas_dataframe_agent
 from langchain_community.chat_models import ChatZhipuAI
@@ -17,7 +18,26 @@ from langchain.chains import LLMChain
 from open_agent.core.context import UserContext
 from .smart_query import ExcelAnalysisService
 from .excel_metadata_service import ExcelMetadataService
+from .columnar_store import (
+    ColumnarStore,
+    ColumnarDataset,
+    InMemoryDataset,
+    resolve_column_projection
+)
 from ..core.config import get_settings
+from ..core.executor import get_executor_pools
+from .code_sandbox import CodeSandbox, get_code_sandbox
+from .dataset_profile import build_dataset_context
+from .schema_index import get_schema_index, excel_documents
+from .result_store import get_result_store, frame_to_arrow, table_page
+from .result_summary import SummaryStream, frame_digest, stream_llm_text
+from .generated_code_cache import (
+    get_generated_code_cache,
+    schema_fingerprint,
+    data_version,
+    is_error_result
+)
+from ..utils.exceptions import ExecutorOverloadedError
 from pathlib import Path
 
 # 配置日志
@@ -47,7 +67,6 @@ class SmartExcelWorkflowManager:
     """
 
     def __init__(self, db=None):
-        self.executor = ThreadPoolExecutor(max_workers=4)
         self.excel_service = ExcelAnalysisService()
         self.db = db
         if db:
@@ -60,9 +79,12 @@ class SmartExcelWorkflowManager:
         self.llm = create_llm(streaming=False)
 
     async def _run_in_executor(self, func, *args):
-        """在线程池中运行阻塞函数"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.executor, func, *args)
+        """在共享I/O线程池中运行阻塞函数（数据库、LLM调用、文件读取）"""
+        return await get_executor_pools().run_io(func, *args)
+
+    async def _run_cpu_bound(self, func, *args):
+        """在共享CPU线程池中运行pandas等CPU密集型函数"""
+        return await get_executor_pools().run_cpu(func, *args)
 
     def _convert_dataframe_to_markdown(self, df_string: str) -> str:
         """
@@ -239,35 +261,8 @@ class SmartExcelWorkflowManager:
             包含columns和data的字典
         """
         try:
-            # 获取列信息
-            columns = []
-            for col in df.columns:
-                columns.append({
-                    'prop': str(col),
-                    'label': str(col),
-                    'width': 'auto'
-                })
-
-            # 获取数据
-            data = []
-            for index, row in df.iterrows():
-                row_data = {'_index': str(index)}
-                for col in df.columns:
-                    # 处理各种数据类型
-                    value = row[col]
-                    if pd.isna(value):
-                        row_data[str(col)] = ''
-                    elif isinstance(value, (int, float)):
-                        row_data[str(col)] = value
-                    else:
-                        row_data[str(col)] = str(value)
-                data.append(row_data)
-
-            return {
-                'columns': columns,
-                'data': data,
-                'total': len(df)
-            }
+            # 按列批量转换（Arrow），不逐行迭代
+            return table_page(frame_to_arrow(df))
 
         except Exception as e:
             logger.warning(f"DataFrame转Table数据失败: {str(e)}")
@@ -298,6 +293,7 @@ class SmartExcelWorkflowManager:
             包含工作流步骤或最终结果的字典
         """
         workflow_steps = []
+        summary_stream = None
 
         try:
             logger.info(f"开始执行流式智能查询工作流 - 用户ID: {user_id}, 查询: {user_query[:50]}...")
@@ -409,7 +405,7 @@ class SmartExcelWorkflowManager:
                 }
                 yield step_data
 
-                dataframes = await self._load_selected_dataframes(selected_files, user_id)
+                dataframes = await self._load_selected_dataframes(selected_files, user_id, user_query)
 
                 step_completed = {
                     'type': 'workflow_step',
@@ -456,7 +452,7 @@ class SmartExcelWorkflowManager:
                 }
                 yield step_data
 
-                result = await self._execute_smart_query(user_query, dataframes, selected_files)
+                result, summary_stream = await self._execute_smart_query(user_query, dataframes, selected_files, user_id)
 
                 step_completed = {
                     'type': 'workflow_step',
@@ -473,6 +469,35 @@ class SmartExcelWorkflowManager:
                 yield step_completed
                 logger.info("查询执行完成")
 
+                # 先推送查询结果，再随生成推送总结增量
+                yield {
+                    'type': 'result_table',
+                    'data': result,
+                    'timestamp': datetime.now().isoformat()
+                }
+                yield {
+                    'type': 'workflow_step',
+                    'step': 'ai_summary',
+                    'status': 'running',
+                    'message': '正在生成查询结果总结...',
+                    'timestamp': datetime.now().isoformat()
+                }
+                async for delta in summary_stream.deltas():
+                    yield {
+                        'type': 'summary_delta',
+                        'delta': delta
+                    }
+                result['summary'] = summary_stream.text
+                step_completed = {
+                    'type': 'workflow_step',
+                    'step': 'ai_summary',
+                    'status': 'completed',
+                    'message': '总结生成完成',
+                    'timestamp': datetime.now().isoformat()
+                }
+                workflow_steps.append(step_completed)
+                yield step_completed
+
                 # 发送最终结果
                 yield {
                     'type': 'final_result',
@@ -518,6 +543,10 @@ class SmartExcelWorkflowManager:
                 'message': f'系统异常: {str(e)}',
                 'workflow_steps': workflow_steps
             }
+        finally:
+            # 客户端断开或提前结束时停止后台的总结生成
+            if summary_stream is not None:
+                summary_stream.cancel()
 
     async def process_smart_query(
         self,
@@ -539,6 +568,7 @@ class SmartExcelWorkflowManager:
             包含查询结果的字典
         """
         workflow_steps = []
+        summary_stream = None
 
         try:
             logger.info(f"开始执行智能查询工作流 - 用户ID: {user_id}, 查询: {user_query[:50]}...")
@@ -602,7 +632,7 @@ class SmartExcelWorkflowManager:
 
             # 步骤3: 加载DataFrame
             try:
-                dataframes = await self._load_selected_dataframes(selected_files, user_id)
+                dataframes = await self._load_selected_dataframes(selected_files, user_id, user_query)
 
                 if not dataframes:
                     raise FileLoadError('无法加载选中的Excel文件数据')
@@ -634,7 +664,8 @@ class SmartExcelWorkflowManager:
 
             # 步骤4: 执行查询
             try:
-                result = await self._execute_smart_query(user_query, dataframes, selected_files)
+                result, summary_stream = await self._execute_smart_query(user_query, dataframes, selected_files, user_id)
+                result['summary'] = await summary_stream.collect()
 
                 workflow_steps.append({
                     'step': 'code_execution',
@@ -686,6 +717,9 @@ class SmartExcelWorkflowManager:
                 'message': f'工作流执行失败: {str(e)}',
                 'workflow_steps': workflow_steps
             }
+        finally:
+            if summary_stream is not None:
+                summary_stream.cancel()
 
     async def _load_user_file_list(self, user_id: int) -> List[Dict[str, Any]]:
         """
@@ -702,16 +736,8 @@ class SmartExcelWorkflowManager:
             else:
                 logger.warning("metadata_service未初始化，跳过数据库文件查询")
 
-            # 检查持久化目录中的文件
-            persistent_dir = os.path.join("backend", "data", 'uploads', f"excel_{user_id}")
-            persistent_files = []
-            if os.path.exists(persistent_dir):
-                persistent_files = [f for f in os.listdir(persistent_dir)
-                                 if f.endswith('.pkl')]
-
             file_list = []
 
-            # 合并数据库和持久化文件信息
             for metadata in file_metadata:
                 # 获取默认sheet的信息
                 default_sheet = metadata.default_sheet or (metadata.sheet_names[0] if metadata.sheet_names else None)
@@ -727,7 +753,11 @@ class SmartExcelWorkflowManager:
                     'row_count': row_count,
                     'column_count': column_count,
                     'description': f'Excel文件，包含{str(len(metadata.sheet_names))}个工作表' if metadata.sheet_names else '',
-                    'created_at': metadata.created_at.isoformat() if metadata.created_at else None
+                    'created_at': metadata.created_at.isoformat() if metadata.created_at else None,
+                    'schema_documents': excel_documents(
+                        metadata.original_filename, metadata.columns_info, metadata.data_types
+                    ),
+                    'schema_embedding': metadata.schema_embedding
                 }
                 file_list.append(file_info)
 
@@ -767,6 +797,11 @@ class SmartExcelWorkflowManager:
         try:
             logger.info(f"开始智能文件选择 - 可用文件数: {len(file_list)}")
 
+            # 文件较多时先按向量相似度预选候选，只把候选交给LLM
+            file_list = await self._retrieve_candidate_files(user_query, file_list)
+            if len(file_list) == 1:
+                return file_list
+
             # 构建文件选择提示
             file_descriptions = []
             for i, file_info in enumerate(file_list):
@@ -842,86 +877,226 @@ class SmartExcelWorkflowManager:
             logger.info("回退到选择所有文件")
             return file_list
 
+    async def _retrieve_candidate_files(
+        self,
+        user_query: str,
+        file_list: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """文件数超过Top-N时按向量相似度预选候选文件，嵌入服务不可用时返回完整列表"""
+        schema_index = get_schema_index()
+        if schema_index is None or len(file_list) <= schema_index.top_n:
+            return file_list
+
+        retrieved = await self._run_in_executor(
+            schema_index.retrieve,
+            user_query,
+            [(file_info['schema_documents'], file_info['schema_embedding']) for file_info in file_list]
+        )
+        if retrieved is None:
+            return file_list
+
+        ranked, updated = retrieved
+        # 补齐的向量写回元数据，下次检索不再重复嵌入
+        if updated and self.metadata_service:
+            await self._run_in_executor(
+                self.metadata_service.save_schema_embeddings,
+                {file_list[index]['id']: embedding for index, embedding in updated.items()}
+            )
+        candidates = [file_list[index] for index in ranked]
+        logger.info(f"向量预选 {len(candidates)}/{len(file_list)} 个候选文件: {[f['filename'] for f in candidates]}")
+        return candidates
+
     async def _load_selected_dataframes(
         self,
         selected_files: List[Dict[str, Any]],
-        user_id: int
-    ) -> Dict[str, pd.DataFrame]:
+        user_id: int,
+        user_query: str = ''
+    ) -> Dict[str, Union[ColumnarDataset, InMemoryDataset]]:
         """
-        加载选中的Excel文件为DataFrame
-        使用新的持久化目录结构和文件匹配逻辑
+        加载选中的Excel文件为数据集
+        通过ExcelFile文件目录一次索引查询解析文件，优先打开各sheet的列式存储
+        （只读取元信息，数据在生成代码后按列加载），没有列式存储的旧文件回退到pickle或原始文件
         """
-        dataframes = {}
+        if not self.metadata_service:
+            raise FileLoadError("metadata_service未初始化，无法解析文件")
 
-        # 构建用户专属目录路径
-        # base_dir = os.path.join("backend", "data", f"excel_{user_id}")
         current_user_id = UserContext.get_current_user().id
-        backend_dir = Path(__file__).parent.parent.parent  # 获取backend目录
-        base_dir = backend_dir / "data/uploads" / f'excel_{current_user_id}'
-        if not os.path.exists(base_dir):
-            logger.warning(f"用户目录不存在: {base_dir}")
-            return dataframes
+        filenames = [file_info.get('filename', '') for file_info in selected_files]
 
         try:
-            # 获取目录中所有文件
-            all_files = os.listdir(base_dir)
+            catalog = await self._run_in_executor(
+                self.metadata_service.resolve_user_files, current_user_id, [name for name in filenames if name]
+            )
+        except Exception as e:
+            logger.error(f"查询文件目录时发生错误: {e}")
+            raise FileLoadError(f"无法加载选中的文件: {e}")
 
-            for file_info in selected_files:
-                filename = file_info.get('filename', '')
-                if not filename:
-                    logger.warning(f"文件信息缺少filename: {file_info}")
-                    continue
+        # 同名文件按上传时间倒序，优先使用选中的那一条，否则使用最新上传的
+        records_by_id = {record.id: record for record in catalog}
+        latest_by_name = {}
+        for record in catalog:
+            latest_by_name.setdefault(record.original_filename, record)
+
+        dataframes = {}
+        for file_info in selected_files:
+            filename = file_info.get('filename', '')
+            if not filename:
+                logger.warning(f"文件信息缺少filename: {file_info}")
+                continue
 
-                # 查找匹配的文件（格式：{uuid}_{original_filename}）
-                matching_files = []
-                for file in all_files:
-                    if file.endswith(f"_{filename}") or file.endswith(f"_{filename}.pkl"):
-                        matching_files.append(file)
+            record = records_by_id.get(file_info.get('id')) or latest_by_name.get(filename)
+            if record is None:
+                logger.warning(f"未找到匹配的文件: {filename}")
+                continue
 
-                if not matching_files:
-                    logger.warning(f"未找到匹配的文件: {filename}")
+            try:
+                dataset = await self._run_in_executor(self._open_dataset, record)
+                if dataset is None:
+                    logger.warning(f"文件不存在或格式不支持: {record.file_path}")
                     continue
 
-                # 如果有多个匹配文件，选择最新的
-                if len(matching_files) > 1:
-                    matching_files.sort(key=lambda x: os.path.getmtime(os.path.join(base_dir, x)), reverse=True)
-                    logger.info(f"找到多个匹配文件，选择最新的: {matching_files[0]}")
+                # 使用原始文件名作为key
+                dataframes[filename] = dataset
+                logger.info(f"成功加载数据集: {filename}, 形状: ({len(dataset)}, {len(dataset.columns)})")
 
-                selected_file = matching_files[0]
-                file_path = os.path.join(base_dir, selected_file)
+            except Exception as e:
+                logger.error(f"加载文件失败 {record.file_path}: {e}")
+                continue
 
-                try:
-                    # 优先加载pickle文件
-                    if selected_file.endswith('.pkl'):
-                        df = await self._run_in_executor(pd.read_pickle, file_path)
-                        logger.info(f"成功从pickle加载文件: {selected_file}")
-                    else:
-                        # 如果没有pickle文件，尝试加载原始文件
-                        if selected_file.endswith(('.xlsx', '.xls')):
-                            df = await self._run_in_executor(pd.read_excel, file_path)
-                        elif selected_file.endswith('.csv'):
-                            df = await self._run_in_executor(pd.read_csv, file_path)
-                        else:
-                            logger.warning(f"不支持的文件格式: {selected_file}")
-                            continue
-                        logger.info(f"成功从原始文件加载: {selected_file}")
+        if not dataframes:
+            raise FileLoadError("没有成功加载任何文件")
 
-                    # 使用原始文件名作为key
-                    dataframes[filename] = df
-                    logger.info(f"成功加载DataFrame: {filename}, 形状: {df.shape}")
+        self._warm_datasets(dataframes, user_query)
+        return dataframes
 
-                except Exception as e:
-                    logger.error(f"加载文件失败 {selected_file}: {e}")
-                    continue
+    @staticmethod
+    def _open_dataset(record) -> Optional[Union[ColumnarDataset, InMemoryDataset]]:
+        """
+        根据文件目录记录打开默认sheet的数据集
+        """
+        sheet_name = record.default_sheet or (record.sheet_names[0] if record.sheet_names else None)
+        artifact_path = (record.sheet_artifacts or {}).get(sheet_name)
+        if artifact_path and os.path.exists(artifact_path):
+            return ColumnarStore.open(Path(artifact_path).parent, sheet_name, record.id)
+
+        # 兼容列式存储之前上传的文件
+        pickle_path = f"{record.file_path}.pkl"
+        if os.path.exists(pickle_path):
+            return InMemoryDataset(pd.read_pickle(pickle_path), pickle_path)
+        if not os.path.exists(record.file_path):
+            return None
+        if record.file_path.endswith(('.xlsx', '.xls')):
+            return InMemoryDataset(pd.read_excel(record.file_path), record.file_path)
+        if record.file_path.endswith('.csv'):
+            return InMemoryDataset(pd.read_csv(record.file_path), record.file_path)
+        return None
+
+    def _warm_datasets(self, datasets: Dict[str, Union[ColumnarDataset, InMemoryDataset]], user_query: str) -> None:
+        """
+        后台预热选中文件中问题提到的列
+        预热与代码生成（LLM调用）并行进行，生成的代码按列加载时这些列大多已在缓存中；
+        预热逐列进行，不会让查询等待整个文件加载
+        """
+        if get_code_sandbox():
+            # DataFrame缓存只服务本进程执行代码的路径，沙箱进程直接内存映射Arrow文件
+            return
+
+        cpu_pool = get_executor_pools().cpu
+        for filename, dataset in datasets.items():
+            columns = self._question_columns(user_query, dataset.columns)
+            if not columns:
+                continue
+            try:
+                future = cpu_pool.submit(dataset.warm, columns)
+            except ExecutorOverloadedError:
+                # 预热只是优化，CPU线程池繁忙时直接跳过
+                logger.info("CPU线程池繁忙，跳过文件缓存预热")
+                return
+            future.add_done_callback(functools.partial(self._on_warm_done, filename))
 
-        except Exception as e:
-            logger.error(f"加载DataFrames时发生错误: {e}")
-            raise FileLoadError(f"无法加载选中的文件: {e}")
+    @staticmethod
+    def _question_columns(user_query: str, columns: List[str]) -> List[str]:
+        """问题中直接提到的列名（生成代码最可能用到的列）"""
+        query = (user_query or '').lower()
+        return [col for col in columns if col and col.strip() and col.strip().lower() in query]
 
-        if not dataframes:
-            raise FileLoadError("没有成功加载任何文件")
+    @staticmethod
+    def _on_warm_done(filename: str, future: Future) -> None:
+        """预热完成回调，预热失败不影响查询"""
+        if not future.cancelled() and future.exception():
+            logger.warning(f"预热文件缓存失败 {filename}: {future.exception()}")
 
-        return dataframes
+    async def _load_projected_dataframes(
+        self,
+        code: str,
+        datasets: Dict[str, Union[ColumnarDataset, InMemoryDataset]]
+    ) -> Dict[str, pd.DataFrame]:
+        """
+        按生成代码实际引用的列加载数据框
+
+        Args:
+            code: 生成的Python代码
+            datasets: 变量名到数据集的映射
+
+        Returns:
+            变量名到DataFrame的映射
+        """
+        def load_all():
+            frames = {}
+            for var_name, dataset in datasets.items():
+                columns = resolve_column_projection(code, var_name, dataset.columns)
+                frames[var_name] = dataset.load(columns)
+                if columns is not None:
+                    logger.info(f"{var_name} 按列加载: {columns}")
+            return frames
+
+        return await self._run_cpu_bound(load_all)
+
+    async def _execute_in_sandbox(
+        self,
+        code_sandbox: CodeSandbox,
+        code: str,
+        datasets: Dict[str, Union[ColumnarDataset, InMemoryDataset]]
+    ) -> Any:
+        """
+        在多进程沙箱中执行生成的代码
+        列式存储的数据集直接传递Arrow文件路径，旧版内存数据集转换为Arrow文件（按源文件缓存复用）
+
+        Args:
+            code_sandbox: 代码沙箱
+            code: 生成的Python代码
+            datasets: 变量名到数据集的映射
+
+        Returns:
+            代码执行结果
+        """
+        specs = {}
+        temp_files = []
+        try:
+            for var_name, dataset in datasets.items():
+                columns = resolve_column_projection(code, var_name, dataset.columns)
+                if isinstance(dataset, ColumnarDataset):
+                    path = str(dataset.path)
+                elif dataset.source_key is not None:
+                    path = await self._run_cpu_bound(
+                        code_sandbox.frame_files.get_or_write, dataset.source_key, dataset.df
+                    )
+                else:
+                    fd, path = tempfile.mkstemp(suffix='.arrow')
+                    os.close(fd)
+                    temp_files.append(path)
+                    await self._run_cpu_bound(ColumnarStore.write_frame, dataset.df, path)
+                specs[var_name] = {'path': path, 'columns': columns}
+                if columns is not None:
+                    logger.info(f"{var_name} 按列加载: {columns}")
+
+            return await code_sandbox.run(code, specs)
+        finally:
+            for path in temp_files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
 
     def _parse_dataframe_string_to_table_data(self, df_string: str, subindex: int = -2) -> Dict[str, Any]:
         """
@@ -1011,22 +1186,115 @@ class SmartExcelWorkflowManager:
                 'total': 1
             }
 
+    async def _generate_code(
+        self,
+        user_query: str,
+        df_locals: Dict[str, Union[ColumnarDataset, InMemoryDataset]],
+        var_name_to_filename: Dict[str, str],
+        python_tool
+    ) -> str:
+        """
+        构建包含数据集结构和预览的提示，由LLM生成pandas代码
+
+        Args:
+            user_query: 用户查询
+            df_locals: 变量名到数据集的映射
+            var_name_to_filename: 变量名到文件名的映射
+            python_tool: 绑定到LLM的Python工具
+
+        Returns:
+            生成的代码
+        """
+        from langchain_core.output_parsers import JsonOutputKeyToolsParser
+        from langchain_core.prompts import ChatPromptTemplate
+
+        # 根据上传时计算的数据集画像构建数据集描述（不重新读取数据，文本长度有上限）
+        smart_query_settings = get_settings().smart_query
+        dataset_info = []
+        for var_name, df in df_locals.items():
+            profile = await self._run_cpu_bound(df.profile)
+            dataset_info.append(build_dataset_context(
+                var_name,
+                var_name_to_filename[var_name],
+                profile,
+                max_columns=smart_query_settings.prompt_max_columns,
+                max_chars=smart_query_settings.prompt_max_chars
+            ))
+
+        # 构建系统提示
+        system_prompt = f"""
+                你所有可以访问的数据来自于传递给您的python_tool里的locals里的pandas数据信（可能有多个）。
+                pandas数据集详细信息（文件来源、列名、列统计信息和数据预览）如下：
+                {chr(10).join(dataset_info)}
+                请根据用户提出的问题，结合给出的数据集的详细信息，直接编写Python相关代码来计算pandas中的值。要求：
+                1. 只返回代码，不返回其他内容
+                2. 只允许使用pandas和内置库
+                3. 确保代码能够直接执行并返回结果，包括import必要的内置库
+                4. 返回的结果应该是详细的、完整的数据，而不仅仅是简单答案 
+                5. 结果应该包含足够的上下文信息，让用户能够验证和理解答案 
+                6. 优先返回DataFrame格式的结果，便于展示为表格 
+                7. 务必不要再去写代码查看数据集的结构，提示词里已经给出了每个数据集的结构信息，直接根据提示词里的结构信息进行判断。
+                8. 要求代码中最后一次print的结果，必需是最后的正确结果（用户所需要的数据）
+
+                示例：
+                - 如果问"哪个项目合同额最高"，不仅要返回项目名称，还要返回跟该项目其他有用的信息，比如合同额，合同时间，项目类型等（如果表格有该这些字段信息）
+                - 如果问"销售额最高的产品"，要返回产品名称、销售额、销售数量、市场占比等完整信息（如果表格有该这些字段信息）
+                """
+
+        # 创建提示模板
+        prompt = ChatPromptTemplate([
+            ("system", system_prompt),
+            ("user", "{question}")
+        ])
+
+        # 创建解析器
+        parser = JsonOutputKeyToolsParser(key_name=python_tool.name, first_tool_only=True)
+
+        # 绑定工具到LLM
+        llm_with_tools = self.llm.bind_tools([python_tool])
+
+        def debug_print(x):
+            print('中间结果：', x)
+            return x
+
+        debug_node = RunnableLambda(debug_print)
+        # 创建执行链
+        code_chain = prompt | llm_with_tools | debug_node| parser | debug_node
+
+        tool_input = await self._run_in_executor(code_chain.invoke, {"question": user_query})
+        return tool_input.get('query', '') if isinstance(tool_input, dict) else ''
+
+    async def _run_generated_code(
+        self,
+        python_tool,
+        code: str,
+        df_locals: Dict[str, Union[ColumnarDataset, InMemoryDataset]]
+    ) -> Any:
+        """执行生成的代码（启用沙箱时在沙箱进程中执行，否则在CPU线程池中执行）"""
+        code_sandbox = get_code_sandbox()
+        if code_sandbox:
+            return await self._execute_in_sandbox(code_sandbox, code, df_locals)
+        python_tool.locals = await self._load_projected_dataframes(code, df_locals)
+        return await self._run_cpu_bound(python_tool.invoke, {'query': code})
+
     async def _execute_smart_query(
         self,
         user_query: str,
-        dataframes: Dict[str, pd.DataFrame],
-        selected_files: List[Dict[str, Any]]
-    ) -> Dict[str, Any]:
+        dataframes: Dict[str, Union[ColumnarDataset, InMemoryDataset]],
+        selected_files: List[Dict[str, Any]],
+        user_id: Optional[int] = None
+    ) -> Tuple[Dict[str, Any], SummaryStream]:
         """
         执行智能查询，生成和运行pandas代码
 
         Args:
             user_query: 用户查询
-            dataframes: 加载的数据框字典
+            dataframes: 加载的数据集字典
             selected_files: 选中的文件信息
+            user_id: 用户ID（表格结果保存在服务端时的归属）
 
         Returns:
-            查询结果字典
+            (查询结果字典, 后台生成中的总结)，结果字典中的summary在总结生成后由调用方填入
 
         Raises:
             CodeExecutionError: 代码执行失败
@@ -1049,14 +1317,12 @@ class SmartExcelWorkflowManager:
             logger.info(f"选择主数据文件: {main_filename}, 行数: {len(main_df)}, 列数: {len(main_df.columns)}")
 
             # 验证数据框
-            if main_df.empty:
+            if len(main_df) == 0:
                 raise CodeExecutionError(f"主数据文件 {main_filename} 为空")
 
             # 使用PythonAstREPLTool替代pandas代理
             try:
                 from langchain_experimental.tools import PythonAstREPLTool
-                from langchain_core.output_parsers import JsonOutputKeyToolsParser
-                from langchain_core.prompts import ChatPromptTemplate
 
                 # 准备数据框字典，支持多个文件
                 df_locals = {}
@@ -1067,119 +1333,66 @@ class SmartExcelWorkflowManager:
                     df_locals[var_name] = df
                     var_name_to_filename[var_name] = filename
 
-                # 创建Python代码执行工具
-                python_tool = PythonAstREPLTool(locals=df_locals)
+                # 创建Python代码执行工具，数据框在代码生成后按引用列加载
+                python_tool = PythonAstREPLTool(locals={})
 
                 logger.info(f"创建Python工具成功，可用数据框: {list(df_locals.keys())}")
 
             except Exception as e:
                 raise CodeExecutionError(f"创建Python工具失败: {str(e)}")
 
-            # 构建数据集信息（包含文件名和前5行数据）
-            dataset_info = []
-            for var_name, df in df_locals.items():
-                filename = var_name_to_filename[var_name]
-                
-                # 基本信息
-                basic_info = f"- {var_name} (来源文件: {filename}): {len(df)}行 x {len(df.columns)}列"
-                
-                # 列名信息
-                columns_info = f"  列名: {', '.join(str(col) for col in df.columns.tolist())}"
-                
-                # 前5行数据预览
-                try:
-                    preview_df = df.head(5)
-                    preview_data = []
-                    for idx, row in preview_df.iterrows():
-                        row_data = []
-                        for col in df.columns:
-                            value = row[col]
-                            # 处理空值和特殊值
-                            if pd.isna(value):
-                                row_data.append('NaN')
-                            elif isinstance(value, (int, float)):
-                                row_data.append(str(value))
-                            else:
-                                # 限制字符串长度避免过长
-                                str_value = str(value)
-                                if len(str_value) > 20:
-                                    str_value = str_value[:17] + '...'
-                                row_data.append(str_value)
-                        preview_data.append(f"    行{idx}: {', '.join(row_data)}")
-                    
-                    preview_info = f"  前5行数据预览:\n{chr(10).join(preview_data)}"
-                except Exception as e:
-                    preview_info = f"  前5行数据预览: 无法生成预览 ({str(e)})"
-                
-                # 组合完整信息
-                dataset_info.append(f"{basic_info}\n{columns_info}\n{preview_info}")
-
-            # 构建系统提示
-            system_prompt = f"""
-                    你所有可以访问的数据来自于传递给您的python_tool里的locals里的pandas数据信（可能有多个）。
-                    pandas数据集详细信息（文件来源、列名信息和数据预览）如下：
-                    {chr(10).join(dataset_info)}
-                    请根据用户提出的问题，结合给出的数据集的详细信息，直接编写Python相关代码来计算pandas中的值。要求：
-                    1. 只返回代码，不返回其他内容
-                    2. 只允许使用pandas和内置库
-                    3. 确保代码能够直接执行并返回结果，包括import必要的内置库
-                    4. 返回的结果应该是详细的、完整的数据，而不仅仅是简单答案 
-                    5. 结果应该包含足够的上下文信息，让用户能够验证和理解答案 
-                    6. 优先返回DataFrame格式的结果，便于展示为表格 
-                    7. 务必不要再去写代码查看数据集的结构，提示词里已经给出了每个数据集的结构信息，直接根据提示词里的结构信息进行判断。
-                    8. 要求代码中最后一次print的结果，必需是最后的正确结果（用户所需要的数据）
-                    
-                    示例：
-                    - 如果问"哪个项目合同额最高"，不仅要返回项目名称，还要返回跟该项目其他有用的信息，比如合同额，合同时间，项目类型等（如果表格有该这些字段信息）
-                    - 如果问"销售额最高的产品"，要返回产品名称、销售额、销售数量、市场占比等完整信息（如果表格有该这些字段信息）
-                    """
-
-            # 创建提示模板
-            prompt = ChatPromptTemplate([
-                ("system", system_prompt),
-                ("user", "{question}")
-            ])
-
-            # 创建解析器
-            parser = JsonOutputKeyToolsParser(key_name=python_tool.name, first_tool_only=True)
-
-            # 绑定工具到LLM
-            llm_with_tools = self.llm.bind_tools([python_tool])
-
-            def debug_print(x):
-                print('中间结果：', x)
-                return x
-
-            debug_node = RunnableLambda(debug_print)
-            # 创建执行链
-            llm_chain = prompt | llm_with_tools | debug_node| parser | debug_node| python_tool| debug_node
+            # 同一用户在相同数据结构下的重复问题直接执行缓存的代码，跳过提示构建和LLM代码生成
+            code_cache = get_generated_code_cache()
+            fingerprint = schema_fingerprint(df_locals) if code_cache else None
+            version = data_version(df_locals) if code_cache else None
+            cached_code = code_cache.lookup(user_id, user_query, fingerprint) if code_cache else None
+            code_cache_hit = False
+            if cached_code:
+                logger.info(f"命中生成代码缓存，跳过LLM代码生成: {user_query[:50]}")
+                result = code_cache.get_result(cached_code, version)
+                if result is None:
+                    try:
+                        result = await self._run_generated_code(python_tool, cached_code.code, df_locals)
+                    except Exception as e:
+                        logger.warning(f"缓存代码执行失败，重新生成: {str(e)}")
+                        result = None
+                    if result is None or is_error_result(result):
+                        code_cache.invalidate(cached_code)
+                        cached_code = None
+                    else:
+                        code_cache.put_result(cached_code, version, result)
+                code_cache_hit = cached_code is not None
 
             # 执行查询
-            try:
-                logger.debug("开始执行Python工具查询")
-                result = await self._run_in_executor(llm_chain.invoke, {"question": user_query})
-                logger.debug(f"查询执行完成，结果: {str(result)[:200]}...")
-            except Exception as e:
-                error_msg = f"Python工具执行失败: {str(e)}"
-                logger.error(error_msg)
-                raise CodeExecutionError(error_msg)
+            if not code_cache_hit:
+                try:
+                    logger.debug("开始执行Python工具查询")
+                    code = await self._generate_code(user_query, df_locals, var_name_to_filename, python_tool)
+                    result = await self._run_generated_code(python_tool, code, df_locals)
+                    logger.debug(f"查询执行完成，结果: {str(result)[:200]}...")
+                except Exception as e:
+                    error_msg = f"Python工具执行失败: {str(e)}"
+                    logger.error(error_msg)
+                    raise CodeExecutionError(error_msg)
+                if code_cache:
+                    code_cache.store(user_id, user_query, fingerprint, code, result, version)
 
             # 处理结果
 
             try:
                 # 检查结果是否为pandas DataFrame
-                print('result type:',type(result))
-                parse_result = ''
+                logger.debug(f"查询结果类型: {type(result)}")
+                result_handle = None
                 if isinstance(result, pd.DataFrame):
-                    # 转换为表格数据
-                    table_data = self._convert_dataframe_to_table_data(result)
+                    # 完整结果保存在服务端，只返回第一页和结果句柄
+                    table_data = await self._build_result_table_data(result, user_id)
+                    result_handle = table_data.get('result_handle')
 
                     data = table_data['data']
                     columns = table_data['columns']
                     total = table_data['total']
                     result_type = 'table_data'
                     logger.info(f"处理DataFrame结果: {len(result)}行 x {len(result.columns)}列")
-                    parse_result = table_data
                 # PythonAstREPLTool返回的是字符串结果
                 elif isinstance(result, str):
                     # 尝试解析结果中的数据
@@ -1193,7 +1406,6 @@ class SmartExcelWorkflowManager:
                         columns = table_data['columns']
                         total = 1
                         result_type = 'table_data'
-                        parse_result = table_data
                     elif ('rows' in result_lines[-1] and 'columns' in result_lines[-1]):
                         # 尝试解析DataFrame字符串为表格数据
                         table_data = self._parse_dataframe_string_to_table_data(result)
@@ -1202,11 +1414,9 @@ class SmartExcelWorkflowManager:
                             columns = table_data['columns']
                             total = 1
                             result_type = 'table_data'
-                            parse_result = table_data
                         else:
                             total = 1
                             result_type = 'text'
-                            parse_result = table_data
 
                     else:
                         # 简单的数值或文本结果
@@ -1218,24 +1428,20 @@ class SmartExcelWorkflowManager:
                             total = table_data['total']
                             total = 1
                             result_type = 'table_data'
-                            parse_result = table_data
                         else:
                             total = 1
                             result_type = 'text'
-                            parse_result = table_data
                 elif isinstance(result, (int, float, bool)):
                     data = result
                     columns = result
                     total = 1
                     result_type = 'scalar'
-                    parse_result = result
                 else:
                     # 处理其他类型的结果
                     data = result
                     columns = result
                     total = 1
                     result_type = 'other'
-                    parse_result = result
                 logger.info(f"结果处理完成: {result_type}, 数据行数: {total}")
 
             except Exception as e:
@@ -1243,26 +1449,24 @@ class SmartExcelWorkflowManager:
                 logger.error(error_msg)
                 raise CodeExecutionError(error_msg)
 
-            # 生成总结
-            try:
-                summary = await self._generate_query_summary(user_query, parse_result, main_df)
-            except Exception as e:
-                logger.warning(f"生成总结失败: {str(e)}")
-                summary = f"基于数据分析完成查询，共处理{len(main_df)}行数据。"
+            # 在后台流式生成总结，调用方可以先返回查询结果
+            summary_stream = await self._start_query_summary(user_query, result, main_df)
 
             return {
                 'data': data,
                 'columns': columns,
                 'total': total,
                 'result_type': result_type,
-                'summary': summary,
+                'result_handle': result_handle,
+                'summary': None,
                 'used_files': list(dataframes.keys()),
+                'code_cache_hit': code_cache_hit,
                 'generated_code': f"# 基于文件: {', '.join(dataframes.keys())}\n# 查询: {user_query}\n# 使用LangChain Python工具执行",
                 'data_info': {
                     'source_files': list(dataframes.keys()),
-                    'dataframes': {name: {'rows': len(df), 'columns': len(df.columns), 'column_names': [str(col) for col in df.columns.tolist()]} for name, df in dataframes.items()}
+                    'dataframes': {name: {'rows': len(df), 'columns': len(df.columns), 'column_names': [str(col) for col in df.columns]} for name, df in dataframes.items()}
                 }
-            }
+            }, summary_stream
 
         except CodeExecutionError:
             raise
@@ -1271,85 +1475,73 @@ class SmartExcelWorkflowManager:
             logger.error(error_msg, exc_info=True)
             raise CodeExecutionError(error_msg)
 
-    async def _generate_query_summary(
+    async def _build_result_table_data(self, df: pd.DataFrame, user_id: Optional[int]) -> Dict[str, Any]:
+        """表格结果：启用结果存储时保存完整结果并返回第一页，否则整体转换"""
+        result_store = get_result_store()
+        if result_store is None or user_id is None:
+            return await self._run_cpu_bound(self._convert_dataframe_to_table_data, df)
+        try:
+            table = await self._run_cpu_bound(frame_to_arrow, df)
+            return await self._run_in_executor(result_store.store_first_page, table, user_id)
+        except (OSError, pa.ArrowException) as e:
+            logger.warning(f"保存查询结果失败，返回完整结果: {str(e)}")
+            return await self._run_cpu_bound(self._convert_dataframe_to_table_data, df)
+
+    async def _start_query_summary(
         self,
         query: str,
         result: Any,
-        df: pd.DataFrame
-    ) -> str:
+        df: Union[ColumnarDataset, InMemoryDataset]
+    ) -> SummaryStream:
         """
-        生成查询结果的AI总结
+        在后台流式生成查询结果的AI总结，提示词使用结果的统计摘要而不是原始数据行
         """
+        # 安全地获取数据集信息
         try:
-            logger.debug("开始生成查询总结")
-
-            # 安全地获取数据集信息
-            try:
-                dataset_info = f"""
-                数据集信息:
-                - 总行数: {len(df)}
-                - 总列数: {len(df.columns)}
-                - 列名: {', '.join(str(col) for col in df.columns.tolist())}
-                """
-            except Exception as e:
-                logger.warning(f"获取数据集信息失败: {str(e)}")
-                dataset_info = "数据集信息: 无法获取"
-
-            # 安全地处理查询结果
-            try:
-                if isinstance(result, pd.DataFrame):
-                    if len(result) > 0:
-                        result_preview = result.head(3).to_string(max_cols=5, max_rows=3)
-                    else:
-                        result_preview = "查询结果为空"
-                else:
-                    result_preview = str(result)  # 限制长度避免过长
-            except Exception as e:
-                logger.warning(f"生成结果预览失败: {str(e)}")
-                result_preview = "无法生成结果预览"
-
-            prompt = f"""
-                    用户问题: {query}
-                    
-                    {dataset_info}
-                    
-                    查询结果: {result_preview}...
-                    
-                    系统已经根据用户提问查询出了结果，请根据结果生成一个简洁的中文总结，说明:
-                    1. 查询的主要发现
-                    2. 数据的关键特征
-                    3. 结果的业务含义
-                    
-                    总结应该在100字以内，通俗易懂。
-                    """
-
-            try:
-                response = await self._run_in_executor(
-                    self.llm.invoke, [HumanMessage(content=prompt)]
-                )
-
-                summary = response.content.strip()
+            dataset_info = f"""
+            数据集信息:
+            - 总行数: {len(df)}
+            - 总列数: {len(df.columns)}
+            - 列名: {', '.join(str(col) for col in df.columns)}
+            """
+        except Exception as e:
+            logger.warning(f"获取数据集信息失败: {str(e)}")
+            dataset_info = "数据集信息: 无法获取"
 
-                # 验证总结长度
-                if len(summary) > 200:
-                    logger.warning("AI生成的总结过长，进行截取")
-                    summary = summary[:200] + "..."
+        # 安全地处理查询结果：DataFrame结果按列统计，其他结果限制长度
+        try:
+            if isinstance(result, pd.DataFrame):
+                result_digest = await self._run_cpu_bound(frame_digest, result)
+            else:
+                result_digest = str(result)[:1000]
+        except Exception as e:
+            logger.warning(f"生成结果摘要失败: {str(e)}")
+            result_digest = "无法生成结果摘要"
 
-                logger.debug("查询总结生成完成")
-                return summary
+        prompt = f"""
+                用户问题: {query}
+                
+                {dataset_info}
+                
+                查询结果摘要:
+                {result_digest}
+                
+                系统已经根据用户提问查询出了结果，请根据结果生成一个简洁的中文总结，说明:
+                1. 查询的主要发现
+                2. 数据的关键特征
+                3. 结果的业务含义
+                
+                总结应该在100字以内，通俗易懂。
+                """
 
-            except Exception as e:
-                logger.warning(f"LLM总结生成失败: {str(e)}")
-                # 生成基础总结
-                if isinstance(result, pd.DataFrame):
-                    return f"基于{len(df)}行数据完成了关于'{query}'的分析，返回了{len(result)}条结果。"
-                else:
-                    return f"基于{len(df)}行数据完成了关于'{query}'的分析查询。"
+        # 生成基础总结，LLM失败时使用
+        try:
+            if isinstance(result, pd.DataFrame):
+                fallback = f"基于{len(df)}行数据完成了关于'{query}'的分析，返回了{len(result)}条结果。"
+            else:
+                fallback = f"基于{len(df)}行数据完成了关于'{query}'的分析查询。"
+        except Exception:
+            fallback = "完成了数据分析查询。"
 
-        except Exception as e:
-            logger.error(f"生成查询总结时发生错误: {str(e)}")
-            # 如果所有方法都失败，返回最基础的总结
-            try:
-                return f"基于数据分析完成查询，共处理{len(df)}行数据。"
-            except:
-                return "完成了数据分析查询。"
\ No newline at end of file
+        # 总结过长时截取
+        return SummaryStream(stream_llm_text(self.llm, prompt, max_chars=200), fallback)
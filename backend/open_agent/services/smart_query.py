@@ -5,8 +5,6 @@ import tempfile
 import os
 from typing import Dict, Any, List
 from datetime import datetime
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
 
 from langchain_experimental.agents import create_pandas_dataframe_agent
 from langchain_community.chat_models import ChatZhipuAI
@@ -15,13 +13,14 @@ from langchain_core.messages import HumanMessage
 # 在 SmartQueryService 类中添加方法
 
 from .table_metadata_service import TableMetadataService
+from ..core.executor import get_executor_pools
+from .dataset_profile import compute_column_stats, build_analysis
 
 class SmartQueryService:
     """
     智能问数服务基类
     """
     def __init__(self):
-        self.executor = ThreadPoolExecutor(max_workers=4)
         self.table_metadata_service = None
     
     def set_db_session(self, db_session):
@@ -29,9 +28,12 @@ class SmartQueryService:
         self.table_metadata_service = TableMetadataService(db_session)
     
     async def _run_in_executor(self, func, *args):
-        """在线程池中运行阻塞函数"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.executor, func, *args)
+        """在共享I/O线程池中运行阻塞函数（数据库、LLM调用、文件读取）"""
+        return await get_executor_pools().run_io(func, *args)
+
+    async def _run_cpu_bound(self, func, *args):
+        """在共享CPU线程池中运行pandas等CPU密集型函数"""
+        return await get_executor_pools().run_cpu(func, *args)
 
 class ExcelAnalysisService(SmartQueryService):
     """
@@ -46,65 +48,21 @@ class ExcelAnalysisService(SmartQueryService):
         分析DataFrame并返回基本信息
         """
         try:
-            # 基本统计信息
-            rows, columns = df.shape
-            
-            # 列信息
-            column_info = []
-            for col in df.columns:
-                col_info = {
-                    'name': col,
-                    'dtype': str(df[col].dtype),
-                    'null_count': int(df[col].isnull().sum()),
-                    'unique_count': int(df[col].nunique())
-                }
-                
-                # 如果是数值列，添加统计信息
-                if pd.api.types.is_numeric_dtype(df[col]):
-                    df.fillna({col:0})  #数值列，将空值补0
-                    col_info.update({
-                        'mean': float(df[col].mean()) if not df[col].isnull().all() else None,
-                        'std': float(df[col].std()) if not df[col].isnull().all() else None,
-                        'min': float(df[col].min()) if not df[col].isnull().all() else None,
-                        'max': float(df[col].max()) if not df[col].isnull().all() else None
-                    })
-                
-                column_info.append(col_info)
-            
-            # 数据预览（前5行）
-            preview_data = df.head().fillna('').to_dict('records')
-            
-            # 数据质量检查
-            quality_issues = []
-            
-            # 检查缺失值
-            missing_cols = df.columns[df.isnull().any()].tolist()
-            if missing_cols:
-                quality_issues.append({
-                    'type': 'missing_values',
-                    'description': f'以下列存在缺失值: {", ".join(map(str, missing_cols))}',
-                    'columns': missing_cols
-                })
-            
-            # 检查重复行
-            duplicate_count = df.duplicated().sum()
-            if duplicate_count > 0:
-                quality_issues.append({
-                    'type': 'duplicate_rows',
-                    'description': f'发现 {duplicate_count} 行重复数据',
-                    'count': int(duplicate_count)
-                })
-            
-            return {
-                'filename': filename,
-                'rows': rows,
-                'columns': columns,
-                'column_names': [str(col) for col in df.columns.tolist()],
-                'column_info': column_info,
-                'preview': preview_data,
-                'quality_issues': quality_issues,
-                'memory_usage': f"{df.memory_usage(deep=True).sum() / 1024 / 1024:.2f} MB"
-            }
+            df = df.copy(deep=False)
+            df.columns = [str(col) for col in df.columns]
+
+            # 列统计一次向量化计算（空值、去重、数值列最值/均值/标准差）
+            column_stats = compute_column_stats(df)
+
+            return build_analysis(
+                filename,
+                len(df),
+                list(df.columns),
+                column_stats,
+                df.head().fillna('').to_dict('records'),
+                int(df.duplicated().sum()),
+                int(df.memory_usage(deep=True).sum())
+            )
             
         except Exception as e:
             print(e)
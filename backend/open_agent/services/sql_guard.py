@@ -0,0 +1,232 @@
+"""Pre-execution checks for LLM-generated SQL: read-only enforcement and plan cost guard."""
+
+import re
+from typing import Dict, Any, List, Optional
+
+from ..core.config import get_settings
+from ..utils.logger import get_logger
+
+logger = get_logger("sql_guard")
+
+# 词法规则按方言区分：
+# - MySQL：# 和 "-- "（后面必须是空白）为行注释，/*! */ 中的内容会被执行，不当作注释；字符串中反斜杠是转义符
+# - PostgreSQL：只有 -- 是行注释，# 是运算符（如 JSON 的 #> 和 #>>）；普通字符串中反斜杠不是转义符，
+#   E'' 字符串中是；支持 $tag$ 美元引用
+_TOKEN_PATTERNS = {
+    'mysql': r"""
+    (?P<comment>--(?=\s|$)[^\n]*|\#[^\n]*|/\*(?!!).*?\*/)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`(?:[^`]|``)*`)
+  | (?P<semicolon>;)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<other>\S)
+""",
+    'postgresql': r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>[Ee]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|"(?:[^"]|"")*"|\$(?P<tag>(?:[A-Za-z_]\w*)?)\$.*?\$(?P=tag)\$)
+  | (?P<semicolon>;)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<other>\S)
+"""
+}
+_TOKEN_RES = {dialect: re.compile(pattern, re.VERBOSE | re.DOTALL) for dialect, pattern in _TOKEN_PATTERNS.items()}
+
+# 允许的语句开头
+READ_ONLY_STATEMENTS = {'SELECT', 'WITH', 'VALUES', 'TABLE'}
+# 出现即拒绝的关键字（数据修改、DDL、加锁、SELECT INTO）
+FORBIDDEN_KEYWORDS = {
+    'INSERT', 'UPDATE', 'DELETE', 'MERGE', 'UPSERT', 'DROP', 'ALTER', 'CREATE', 'TRUNCATE', 'RENAME',
+    'GRANT', 'REVOKE', 'CALL', 'COPY', 'LOCK', 'INTO', 'HANDLER', 'VACUUM', 'ANALYZE', 'REINDEX'
+}
+# 有副作用或可能长时间占用连接的函数
+FORBIDDEN_FUNCTIONS = {
+    'SLEEP', 'PG_SLEEP', 'BENCHMARK', 'PG_TERMINATE_BACKEND', 'PG_CANCEL_BACKEND', 'PG_READ_FILE',
+    'PG_READ_BINARY_FILE', 'PG_LS_DIR', 'LO_IMPORT', 'LO_EXPORT', 'LOAD_FILE', 'DBLINK', 'DBLINK_EXEC',
+    'SET_CONFIG', 'NEXTVAL', 'SETVAL', 'GET_LOCK', 'RELEASE_LOCK', 'RELEASE_ALL_LOCKS', 'PG_NOTIFY'
+}
+# 按前缀拒绝的函数：PostgreSQL 大对象操作（lo_unlink、lo_create 等）和咨询锁（pg_advisory_lock 等）
+FORBIDDEN_FUNCTION_PREFIXES = ('LO_', 'PG_ADVISORY_', 'PG_TRY_ADVISORY_')
+# FOR 之后表示加锁子句的关键字：FOR UPDATE / FOR NO KEY UPDATE / FOR SHARE / FOR KEY SHARE
+LOCKING_CLAUSE_WORDS = {'UPDATE', 'NO', 'SHARE', 'KEY'}
+
+
+class SQLGuardError(Exception):
+    """SQL未通过执行前检查
+
+    reason: read_only（非只读语句）、invalid（EXPLAIN失败，SQL无法执行）、cost（估算代价超过阈值）
+    """
+
+    def __init__(self, message: str, reason: str, plan: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.reason = reason
+        self.plan = plan
+
+
+def _token_re(dialect: str) -> re.Pattern:
+    token_re = _TOKEN_RES.get((dialect or '').lower())
+    if token_re is None:
+        raise ValueError(f"不支持的数据库类型: {dialect}")
+    return token_re
+
+
+def _tokens(sql: str, dialect: str) -> List[tuple]:
+    """词法切分，返回 (类型, 文本, 结束位置)；字符串和带引号的标识符作为整体，不参与关键字检查"""
+    return [
+        (match.lastgroup, match.group(), match.end())
+        for match in _token_re(dialect).finditer(sql)
+    ]
+
+
+def ensure_read_only(sql: str, dialect: str) -> str:
+    """
+    检查SQL是否为单条只读查询，返回去掉末尾分号和末尾注释的语句
+
+    Args:
+        sql: SQL语句
+        dialect: 数据库类型（mysql 或 postgresql），决定注释和字符串的词法
+
+    Raises:
+        SQLGuardError: 多条语句、非SELECT开头、包含写入/DDL/加锁关键字或危险函数
+    """
+    statement = (sql or '').strip()
+    all_tokens = _tokens(statement, dialect)
+    # 末尾的分号和注释之前的部分为实际执行的语句
+    while all_tokens and all_tokens[-1][0] in ('semicolon', 'comment'):
+        all_tokens.pop()
+    tokens = [(kind, value) for kind, value, _ in all_tokens if kind != 'comment']
+    if not tokens:
+        raise SQLGuardError("SQL为空", reason='read_only')
+    if any(kind == 'semicolon' for kind, _ in tokens):
+        raise SQLGuardError("只允许执行单条SQL语句", reason='read_only')
+
+    words = [value.upper() for kind, value in tokens if kind == 'word']
+    if not words or words[0] not in READ_ONLY_STATEMENTS:
+        raise SQLGuardError(f"只允许执行只读查询（SELECT），当前语句以 {words[0] if words else statement[:20]} 开头",
+                            reason='read_only')
+    forbidden = sorted(set(words) & FORBIDDEN_KEYWORDS)
+    if forbidden:
+        raise SQLGuardError(f"SQL包含不允许的关键字: {', '.join(forbidden)}", reason='read_only')
+    for position, (kind, value) in enumerate(tokens[:-1]):
+        if kind != 'word':
+            continue
+        name, next_kind, next_value = value.upper(), tokens[position + 1][0], tokens[position + 1][1]
+        if next_value == '(' and (name in FORBIDDEN_FUNCTIONS or name.startswith(FORBIDDEN_FUNCTION_PREFIXES)):
+            raise SQLGuardError(f"SQL包含不允许的函数: {value}", reason='read_only')
+        if name == 'FOR' and next_kind == 'word' and next_value.upper() in LOCKING_CLAUSE_WORDS:
+            raise SQLGuardError(f"SQL不允许加锁（FOR {next_value.upper()} ...）", reason='read_only')
+
+    return statement[:all_tokens[-1][2]]
+
+
+def _walk(node: Any):
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def summarize_mysql_plan(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """EXPLAIN FORMAT=JSON 的摘要：总代价、估算结果行数和全表扫描"""
+    query_block = plan.get('query_block', {})
+    cost = _to_float(query_block.get('cost_info', {}).get('query_cost'))
+    rows, full_scans = 0.0, []
+    for node in _walk(plan):
+        if cost == 0.0 and 'query_cost' in node:
+            cost = max(cost, _to_float(node['query_cost']))
+        table = node.get('table')
+        if isinstance(table, dict) and 'table_name' in table:
+            rows = max(rows, _to_float(table.get('rows_produced_per_join')))
+            if table.get('access_type') == 'ALL':
+                full_scans.append({
+                    'table': table['table_name'],
+                    'rows': int(_to_float(table.get('rows_examined_per_scan')))
+                })
+    return {'cost': cost, 'rows': int(rows), 'full_scans': full_scans}
+
+
+def summarize_postgresql_plan(plan: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """EXPLAIN (FORMAT JSON) 的摘要：总代价、估算结果行数和顺序扫描"""
+    root = (plan[0] if plan else {}).get('Plan', {})
+    full_scans = [
+        {'table': node.get('Relation Name'), 'rows': int(_to_float(node.get('Plan Rows')))}
+        for node in _walk(root)
+        if node.get('Node Type') == 'Seq Scan'
+    ]
+    return {
+        'cost': _to_float(root.get('Total Cost')),
+        'rows': int(_to_float(root.get('Plan Rows'))),
+        'full_scans': full_scans
+    }
+
+
+class SQLGuard:
+    """生成SQL的执行前检查
+
+    只读检查在本地完成；代价检查基于EXPLAIN摘要，估算总代价或单表全表扫描行数超过阈值时拒绝，
+    由调用方带着执行计划重新提示LLM改写。阈值为0表示不检查该项。
+    """
+
+    def __init__(self, max_cost: float, max_full_scan_rows: int, max_retries: int):
+        self.max_cost = max_cost
+        self.max_full_scan_rows = max_full_scan_rows
+        self.max_retries = max_retries
+
+    @staticmethod
+    def check_read_only(sql: str, dialect: str) -> str:
+        return ensure_read_only(sql, dialect)
+
+    def check_plan(self, summary: Dict[str, Any]) -> None:
+        """代价超过阈值时抛出 SQLGuardError"""
+        if self.max_cost > 0 and summary.get('cost', 0) > self.max_cost:
+            raise SQLGuardError(
+                f"SQL估算代价 {summary['cost']:.0f} 超过上限 {self.max_cost:.0f}", reason='cost', plan=summary
+            )
+        if self.max_full_scan_rows > 0:
+            large_scans = [scan for scan in summary.get('full_scans', []) if scan['rows'] > self.max_full_scan_rows]
+            if large_scans:
+                tables = ', '.join(f"{scan['table']}（约{scan['rows']}行）" for scan in large_scans)
+                raise SQLGuardError(f"SQL需要全表扫描大表: {tables}", reason='cost', plan=summary)
+
+    @staticmethod
+    def rewrite_feedback(sql: str, error: SQLGuardError) -> str:
+        """重新生成SQL时附加到提示词中的说明"""
+        lines = [
+            "上一次生成的SQL未通过执行前检查，请改写：",
+            f"SQL: {sql}",
+            f"原因: {error}"
+        ]
+        if error.plan:
+            lines.append(
+                f"执行计划摘要: 估算代价 {error.plan.get('cost', 0):.0f}，估算返回 {error.plan.get('rows', 0)} 行，"
+                f"全表扫描: {error.plan.get('full_scans') or '无'}"
+            )
+        lines.append("要求：只能是单条只读SELECT语句；补充过滤条件，避免笛卡尔积和对大表的全表扫描，必要时先聚合。")
+        return "\n".join(lines)
+
+
+# 全局实例
+_sql_guard: Optional[SQLGuard] = None
+
+
+def get_sql_guard() -> Optional[SQLGuard]:
+    """获取SQL执行前检查实例，未启用时返回None"""
+    global _sql_guard
+    if _sql_guard is None:
+        smart_query_settings = get_settings().smart_query
+        if not smart_query_settings.sql_guard_enabled:
+            return None
+        _sql_guard = SQLGuard(
+            max_cost=smart_query_settings.sql_max_estimated_cost,
+            max_full_scan_rows=smart_query_settings.sql_max_full_scan_rows,
+            max_retries=smart_query_settings.sql_guard_max_retries
+        )
+    return _sql_guard
@@ -1,5 +1,7 @@
 """表元数据管理服务"""
 
+import asyncio
+import hashlib
 import json
 from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
@@ -12,6 +14,9 @@ from ..utils.logger import get_logger
 from ..utils.exceptions import ValidationError, NotFoundError
 from .postgresql_tool_manager import get_postgresql_tool
 from .mysql_tool_manager import get_mysql_tool
+from .schema_index import get_schema_index, table_documents
+from .datasource_credentials import get_credential_resolver
+from ..core.executor import get_executor_pools
 
 logger = get_logger("table_metadata_service")
 
@@ -32,10 +37,8 @@ class TableMetadataService:
     ) -> Dict[str, Any]:
         """收集并保存表元数据"""
         try:
-            # 获取数据库配置
-            db_config = self.db.query(DatabaseConfig).filter(
-                and_(DatabaseConfig.id == database_config_id, DatabaseConfig.created_by == user_id)
-            ).first()
+            # 获取数据库配置（已解密的连接信息在进程内缓存）
+            db_config = get_credential_resolver().resolve(self.db, database_config_id, user_id)
             
             if not db_config:
                 raise NotFoundError("数据库配置不存在")
@@ -50,20 +53,13 @@ class TableMetadataService:
             
             # 检查是否已有连接，如果没有则建立连接
             user_id_str = str(user_id)
-            if user_id_str not in db_tool.connections:
-                connection_config = {
-                    'host': db_config.host,
-                    'port': db_config.port,
-                    'database': db_config.database,
-                    'username': db_config.username,
-                    'password': self._decrypt_password(db_config.password)
-                }
-                
+            if not db_tool.is_connected(user_id_str, database_config_id):
                 # 连接数据库
                 connect_result = await db_tool.execute(
                     operation="connect",
-                    connection_config=connection_config,
-                    user_id=user_id_str
+                    connection_config=db_config.connection_config,
+                    user_id=user_id_str,
+                    datasource_id=database_config_id
                 )
                 
                 if not connect_result.success:
@@ -73,35 +69,78 @@ class TableMetadataService:
             else:
                 logger.info(f"复用用户 {user_id} 的现有{db_config.db_type}数据库连接")
             
-            collected_tables = []
-            failed_tables = []
+            # 批量获取表结构：每类目录信息（列、键、索引、注释和估算行数）一次查询
+            describe_result = await db_tool.execute(
+                operation="describe_tables",
+                user_id=user_id_str,
+                datasource_id=database_config_id,
+                table_names=table_names
+            )
+            if not describe_result.success:
+                raise Exception(f"获取表结构失败: {describe_result.error}")
+            schemas = describe_result.result['tables']
             
-            for table_name in table_names:
-                try:
-                    # 收集表元数据
-                    metadata = await self._collect_single_table_metadata(
-                        user_id, table_name, db_config.db_type
-                    )
-                    
-                    # 保存或更新元数据
-                    table_metadata = await self._save_table_metadata(
-                        user_id, database_config_id, table_name, metadata
+            existing_records = {
+                record.table_name: record
+                for record in self.db.query(TableMetadata).filter(
+                    and_(
+                        TableMetadata.created_by == user_id,
+                        TableMetadata.database_config_id == database_config_id,
+                        TableMetadata.table_name.in_(list(schemas))
                     )
-                    
-                    collected_tables.append({
-                        'table_name': table_name,
-                        'metadata_id': table_metadata.id,
-                        'columns_count': len(metadata['columns_info']),
-                        'sample_rows': len(metadata['sample_data'])
-                    })
-                    
-                except Exception as e:
-                    print(e)
-                    logger.error(f"收集表 {table_name} 元数据失败: {str(e)}")
+                ).all()
+            }
+            
+            # 结构版本哈希未变化的表沿用已保存的示例数据，只为新表和结构变化的表并发读取
+            schema_hashes = {name: self.schema_version_hash(schema) for name, schema in schemas.items()}
+            changed_tables = [
+                name for name in schemas
+                if name not in existing_records or existing_records[name].schema_hash != schema_hashes[name]
+            ]
+            samples = await asyncio.gather(*[
+                self._fetch_sample_data(db_tool, user_id_str, database_config_id, name) for name in changed_tables
+            ])
+            sample_by_table = dict(zip(changed_tables, samples))
+            
+            collected_records = []
+            failed_tables = []
+            for table_name in table_names:
+                if table_name not in schemas:
                     failed_tables.append({
                         'table_name': table_name,
-                        'error': str(e)
+                        'error': '表不存在'
                     })
+                    continue
+                schema_changed = table_name in sample_by_table
+                record = self._apply_table_metadata(
+                    user_id, database_config_id, existing_records.get(table_name),
+                    schemas[table_name], schema_hashes[table_name], schema_changed, sample_by_table.get(table_name)
+                )
+                collected_records.append((record, schema_changed))
+            
+            # 一次提交全部表
+            self.db.flush()
+            collected_tables = [
+                {
+                    'table_name': record.table_name,
+                    'metadata_id': record.id,
+                    'columns_count': len(record.columns_info or []),
+                    'sample_rows': len(record.sample_data or []),
+                    'schema_changed': changed
+                }
+                for record, changed in collected_records
+            ]
+            self.db.commit()
+            logger.info(
+                f"收集表元数据完成: {len(collected_tables)} 个表，其中 {len(changed_tables)} 个新增或结构变化"
+            )
+            
+            # 为收集到的表生成检索向量（批量一次请求，失败时在提问时补齐）
+            if collected_tables and get_schema_index() is not None:
+                records = self.db.query(TableMetadata).filter(
+                    TableMetadata.id.in_([table['metadata_id'] for table in collected_tables])
+                ).all()
+                await get_executor_pools().run_io(self.index_table_schemas, records)
             
             return {
                 'success': True,
@@ -112,129 +151,99 @@ class TableMetadataService:
             }
             
         except Exception as e:
+            self.db.rollback()
             logger.error(f"收集表元数据失败: {str(e)}")
             return {
                 'success': False,
                 'message': str(e)
             }
     
-    async def _collect_single_table_metadata(
-        self, 
-        user_id: int, 
-        table_name: str,
-        db_type: str
-    ) -> Dict[str, Any]:
-        """收集单个表的元数据"""
-        
-        # 根据数据库类型选择相应的工具
-        if db_type.lower() == 'postgresql':
-            db_tool = self.postgresql_tool
-        elif db_type.lower() == 'mysql':
-            db_tool = self.mysql_tool
-        else:
-            raise Exception(f"不支持的数据库类型: {db_type}")
-        
-        # 获取表结构
-        schema_result = await db_tool.execute(
-            operation="describe_table",
-            user_id=str(user_id),
-            table_name=table_name
-        )
-        
-        if not schema_result.success:
-            raise Exception(f"获取表结构失败: {schema_result.error}")
-        
-        schema_data = schema_result.result
-        
-        # 获取示例数据（前5条）
-        sample_result = await db_tool.execute(
-            operation="execute_query",
-            user_id=str(user_id),
-            sql_query=f"SELECT * FROM {table_name} LIMIT 5",
-            limit=5
-        )
-        
-        sample_data = []
-        if sample_result.success:
-            sample_data = sample_result.result.get('data', [])
-        
-        # 获取行数统计
-        count_result = await db_tool.execute(
-            operation="execute_query",
-            user_id=str(user_id),
-            sql_query=f"SELECT COUNT(*) as total_rows FROM {table_name}",
-            limit=1
-        )
-        
-        row_count = 0
-        if count_result.success and count_result.result.get('data'):
-            row_count = count_result.result['data'][0].get('total_rows', 0)
-        
-        return {
-            'columns_info': schema_data.get('columns', []),
-            'primary_keys': schema_data.get('primary_keys', []),
-            'foreign_keys': schema_data.get('foreign_keys', []),
-            'indexes': schema_data.get('indexes', []),
-            'sample_data': sample_data,
-            'row_count': row_count,
-            'table_comment': schema_data.get('table_comment', '')
+    @staticmethod
+    def schema_version_hash(schema: Dict[str, Any]) -> str:
+        """表结构版本哈希：列、主外键、索引和表注释任一变化时改变（不含行数）"""
+        content = {
+            'columns': schema.get('columns', []),
+            'primary_keys': schema.get('primary_keys', []),
+            'foreign_keys': schema.get('foreign_keys', []),
+            'indexes': schema.get('indexes', []),
+            'table_comment': schema.get('table_comment', '')
         }
+        return hashlib.sha256(
+            json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+        ).hexdigest()
     
-    async def _save_table_metadata(
-        self, 
-        user_id: int, 
-        database_config_id: int, 
-        table_name: str, 
-        metadata: Dict[str, Any]
-    ) -> TableMetadata:
-        """保存表元数据"""
-        
-        # 检查是否已存在
-        existing = self.db.query(TableMetadata).filter(
-            and_(
-                TableMetadata.created_by == user_id,
-                TableMetadata.database_config_id == database_config_id,
-                TableMetadata.table_name == table_name
+    async def _fetch_sample_data(
+        self,
+        db_tool,
+        user_id: str,
+        database_config_id: int,
+        table_name: str
+    ) -> Optional[List[Dict[str, Any]]]:
+        """读取表的示例数据（前5条），失败时返回None"""
+        try:
+            sample_result = await db_tool.execute(
+                operation="execute_query",
+                user_id=user_id,
+                datasource_id=database_config_id,
+                sql_query=f"SELECT * FROM {table_name}",
+                limit=5
             )
-        ).first()
-        
+        except Exception as e:
+            logger.warning(f"读取表 {table_name} 示例数据失败: {str(e)}")
+            return None
+        if not sample_result.success:
+            logger.warning(f"读取表 {table_name} 示例数据失败: {sample_result.error}")
+            return None
+        return sample_result.result.get('data', [])
+    
+    def _apply_table_metadata(
+        self,
+        user_id: int,
+        database_config_id: int,
+        existing: Optional[TableMetadata],
+        schema: Dict[str, Any],
+        schema_hash: str,
+        schema_changed: bool,
+        sample_data: Optional[List[Dict[str, Any]]]
+    ) -> TableMetadata:
+        """写入表元数据（不提交）
+
+        结构未变化时只更新行数和同步时间；示例数据读取失败（sample_data为None）时不保存
+        新的结构哈希，下次收集仍视为结构变化并重新读取示例数据。
+        """
         if existing:
-            # 更新现有记录
-            existing.columns_info = metadata['columns_info']
-            existing.primary_keys = metadata['primary_keys']
-            existing.foreign_keys = metadata['foreign_keys']
-            existing.indexes = metadata['indexes']
-            existing.sample_data = metadata['sample_data']
-            existing.row_count = metadata['row_count']
-            existing.table_comment = metadata['table_comment']
+            if schema_changed:
+                existing.columns_info = schema.get('columns', [])
+                existing.primary_keys = schema.get('primary_keys', [])
+                existing.foreign_keys = schema.get('foreign_keys', [])
+                existing.indexes = schema.get('indexes', [])
+                existing.table_comment = schema.get('table_comment', '')
+                if sample_data is not None:
+                    existing.sample_data = sample_data
+                    existing.schema_hash = schema_hash
+            existing.row_count = schema.get('row_count', 0)
             existing.last_synced_at = datetime.utcnow()
-            
-            self.db.commit()
-            self.db.refresh(existing)
             return existing
-        else:
-            # 创建新记录
-            table_metadata = TableMetadata(
-                created_by=user_id,
-                database_config_id=database_config_id,
-                table_name=table_name,
-                table_schema='public',
-                table_type='BASE TABLE',
-                table_comment=metadata['table_comment'],
-                columns_info=metadata['columns_info'],
-                primary_keys=metadata['primary_keys'],
-                foreign_keys=metadata['foreign_keys'],
-                indexes=metadata['indexes'],
-                sample_data=metadata['sample_data'],
-                row_count=metadata['row_count'],
-                is_enabled_for_qa=True,
-                last_synced_at=datetime.utcnow()
-            )
-            
-            self.db.add(table_metadata)
-            self.db.commit()
-            self.db.refresh(table_metadata)
-            return table_metadata
+        
+        table_metadata = TableMetadata(
+            created_by=user_id,
+            database_config_id=database_config_id,
+            table_name=schema['table_name'],
+            table_schema='public',
+            table_type='BASE TABLE',
+            table_comment=schema.get('table_comment', ''),
+            columns_info=schema.get('columns', []),
+            primary_keys=schema.get('primary_keys', []),
+            foreign_keys=schema.get('foreign_keys', []),
+            indexes=schema.get('indexes', []),
+            sample_data=sample_data or [],
+            row_count=schema.get('row_count', 0),
+            schema_hash=schema_hash if sample_data is not None else None,
+            is_enabled_for_qa=True,
+            last_synced_at=datetime.utcnow()
+        )
+        self.db.add(table_metadata)
+        return table_metadata
     
     async def save_table_metadata_config(
         self, 
@@ -439,8 +448,36 @@ class TableMetadataService:
             self.db.rollback()
             raise e
     
-    def _decrypt_password(self, encrypted_password: str) -> str:
-        """解密密码（需要实现加密逻辑）"""
-        # 这里需要实现与DatabaseConfigService相同的解密逻辑
-        # 暂时返回原始密码
-        return encrypted_password
\ No newline at end of file
+    @staticmethod
+    def schema_documents(metadata: TableMetadata) -> Dict[str, str]:
+        """表的检索文档"""
+        return table_documents({
+            'table_name': metadata.table_name,
+            'columns': metadata.columns_info or [],
+            'table_comment': metadata.table_comment or '',
+            'qa_description': metadata.qa_description or '',
+            'business_context': metadata.business_context or ''
+        })
+    
+    def index_table_schemas(self, records: List[TableMetadata]) -> None:
+        """为表元数据生成检索向量（尽力而为）"""
+        schema_index = get_schema_index()
+        if schema_index is None or not records:
+            return
+        embeddings = schema_index.index([
+            (self.schema_documents(record), record.schema_embedding) for record in records
+        ])
+        if embeddings:
+            self.save_schema_embeddings({record.id: embedding for record, embedding in zip(records, embeddings)})
+    
+    def save_schema_embeddings(self, embeddings: Dict[int, Dict[str, Any]]) -> None:
+        """按表元数据ID保存检索向量"""
+        if not embeddings:
+            return
+        try:
+            for record in self.db.query(TableMetadata).filter(TableMetadata.id.in_(list(embeddings))).all():
+                record.schema_embedding = embeddings[record.id]
+            self.db.commit()
+        except Exception as e:
+            logger.warning(f"保存表检索向量失败: {str(e)}")
+            self.db.rollback()
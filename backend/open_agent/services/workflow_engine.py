@@ -2,14 +2,16 @@
 
 import asyncio
 import json
+import re
 import time
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable, Awaitable
 from sqlalchemy.orm import Session
 
 from ..models.workflow import Workflow, WorkflowExecution, NodeExecution, ExecutionStatus, NodeType
 from ..models.llm_config import LLMConfig
 from ..services.llm_service import LLMService
+from ..services.node_result_cache import NodeResultCacheService
 
 from ..db.database import get_db
 from ..utils.logger import get_logger
@@ -304,16 +306,46 @@ class WorkflowEngine:
         }
         
         try:
-            # 执行当前节点
-            output = await self._execute_single_node(execution, node, context)
+            # 执行当前节点，LLM节点的增量输出通过队列转发为 node_delta 事件
+            delta_queue: asyncio.Queue = asyncio.Queue()
+            
+            async def on_delta(delta: str):
+                delta_queue.put_nowait(delta)
+            
+            node_task = asyncio.create_task(
+                self._execute_single_node(execution, node, context, on_delta=on_delta)
+            )
+            node_task.add_done_callback(lambda _: delta_queue.put_nowait(None))
+            
+            try:
+                while True:
+                    delta = await delta_queue.get()
+                    if delta is None:
+                        break
+                    yield {
+                        'type': 'node_delta',
+                        'execution_id': execution.id,
+                        'node_id': node_id,
+                        'data': {
+                            'node_name': node.get('name', ''),
+                            'node_type': node.get('type', ''),
+                            'delta': delta
+                        },
+                        'timestamp': datetime.now().isoformat()
+                    }
+            finally:
+                if not node_task.done():
+                    node_task.cancel()
+            
+            output = await node_task
             context['node_outputs'][node_id] = output
             
-            # 发送节点完成的消息
+            # 发送节点完成的消息（命中结果缓存时状态为cached）
             yield {
                 'type': 'node_status',
                 'execution_id': execution.id,
                 'node_id': node_id,
-                'status': 'completed',
+                'status': 'cached' if node_id in context.get('cached_nodes', ()) else 'completed',
                 'data': {
                     'node_name': node.get('name', ''),
                     'node_type': node.get('type', ''),
@@ -346,30 +378,39 @@ class WorkflowEngine:
                 yield step_data
     
     async def _execute_node_recursive(self, execution: WorkflowExecution, node_id: str, 
-                                    node_graph: Dict[str, Dict[str, Any]], context: Dict[str, Any]):
-        """递归执行节点"""
+                                    node_graph: Dict[str, Dict[str, Any]], context: Dict[str, Any],
+                                    node_runner: Optional[Callable[..., Awaitable[Dict[str, Any]]]] = None):
+        """递归执行节点
+        
+        node_runner: 单节点执行函数，默认为 _execute_single_node（Map节点的子图使用自定义记录方式）
+        """
         if node_id in context['node_outputs']:
             # 节点已执行过
             return
         
+        node_runner = node_runner or self._execute_single_node
         node_info = node_graph[node_id]
         node = node_info['node']
         
         # 等待所有输入节点完成
         for input_node_id in node_info['inputs']:
-            await self._execute_node_recursive(execution, input_node_id, node_graph, context)
+            await self._execute_node_recursive(execution, input_node_id, node_graph, context, node_runner)
         
         # 执行当前节点
-        output = await self._execute_single_node(execution, node, context)
+        output = await node_runner(execution, node, context)
         context['node_outputs'][node_id] = output
         
         # 执行所有输出节点
         for output_node_id in node_info['outputs']:
-            await self._execute_node_recursive(execution, output_node_id, node_graph, context)
+            await self._execute_node_recursive(execution, output_node_id, node_graph, context, node_runner)
     
     async def _execute_single_node(self, execution: WorkflowExecution, node: Dict[str, Any], 
-                                 context: Dict[str, Any]) -> Dict[str, Any]:
-        """执行单个节点"""
+                                 context: Dict[str, Any],
+                                 on_delta: Optional[Callable[[str], Awaitable[None]]] = None) -> Dict[str, Any]:
+        """执行单个节点
+        
+        on_delta: 可选的增量输出回调，LLM节点会在生成过程中逐段回调
+        """
         node_id = node['id']
         node_type = node['type']
         node_name = node['name']
@@ -422,21 +463,23 @@ class WorkflowEngine:
             
 
             
-            # 根据节点类型执行
-            if node_type == 'start':
-                output_data = await self._execute_start_node(node, input_data)
-            elif node_type == 'end':
-                output_data = await self._execute_end_node(node, input_data)
-            elif node_type == 'llm':
-                output_data = await self._execute_llm_node(node, input_data)
-            elif node_type == 'condition':
-                output_data = await self._execute_condition_node(node, input_data)
-            elif node_type == 'code':
-                output_data = await self._execute_code_node(node, input_data)
-            elif node_type == 'http':
-                output_data = await self._execute_http_node(node, input_data)
+            # 开启了结果缓存的节点，命中时跳过执行
+            cache_service = None
+            cache_key = None
+            cached_output = None
+            if NodeResultCacheService.is_enabled(node):
+                cache_service = NodeResultCacheService(self.db)
+                cache_key = cache_service.build_key(node, input_data, self._get_node_model_version(node))
+                cached_output = cache_service.get(cache_key)
+            
+            if cached_output is not None:
+                output_data = cached_output
+                context.setdefault('cached_nodes', set()).add(node_id)
             else:
-                raise ValueError(f"不支持的节点类型: {node_type}")
+                # 根据节点类型执行
+                output_data = await self._run_node(execution, node, input_data, on_delta=on_delta)
+                if cache_service is not None:
+                    cache_service.set(cache_key, node, output_data)
             
             # 更新执行状态
             end_time = time.time()
@@ -464,13 +507,44 @@ class WorkflowEngine:
             
             raise
     
+    async def _run_node(self, execution: WorkflowExecution, node: Dict[str, Any], input_data: Dict[str, Any],
+                        on_delta: Optional[Callable[[str], Awaitable[None]]] = None) -> Dict[str, Any]:
+        """根据节点类型执行节点逻辑（不写节点执行记录）"""
+        node_type = node['type']
+        
+        if node_type == 'start':
+            return await self._execute_start_node(node, input_data)
+        elif node_type == 'end':
+            return await self._execute_end_node(node, input_data)
+        elif node_type == 'llm':
+            return await self._execute_llm_node(node, input_data, on_delta=on_delta)
+        elif node_type == 'condition':
+            return await self._execute_condition_node(node, input_data)
+        elif node_type == 'code':
+            return await self._execute_code_node(node, input_data)
+        elif node_type == 'http':
+            return await self._execute_http_node(node, input_data)
+        elif node_type == 'map':
+            return await self._execute_map_node(execution, node, input_data)
+        else:
+            raise ValueError(f"不支持的节点类型: {node_type}")
+    
+    @staticmethod
+    def _visible_outputs(context: Dict[str, Any]) -> Dict[str, Any]:
+        """节点可引用的上游输出：Map子图中为父工作流的输出加上子图已执行节点的输出（同名时子图优先）"""
+        parent_outputs = context.get('parent_outputs')
+        if not parent_outputs:
+            return context['node_outputs']
+        return {**parent_outputs, **context['node_outputs']}
+    
     def _prepare_node_input(self, node: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
         """准备节点输入数据"""
+        previous_outputs = self._visible_outputs(context)
         # 基础输入数据
         input_data = {
             'workflow_input': context['workflow_input'],
             'node_config': node.get('config', {}),
-            'previous_outputs': context['node_outputs']
+            'previous_outputs': previous_outputs
         }
         
         # 处理节点参数配置
@@ -497,8 +571,8 @@ class WorkflowEngine:
                     source_node_id = param.get('source_node_id')
                     source_param_name = param.get('source_param_name', 'data')
                     
-                    if source_node_id and source_node_id in context['node_outputs']:
-                        source_output = context['node_outputs'][source_node_id]
+                    if source_node_id and source_node_id in previous_outputs:
+                        source_output = previous_outputs[source_node_id]
                         if isinstance(source_output, dict):
                             resolved_inputs[param_name] = source_output.get(source_param_name, param_default)
                         else:
@@ -523,8 +597,9 @@ class WorkflowEngine:
                 source_node_id = parts[0]
                 
                 # 从previous_outputs中获取源节点的输出
-                if source_node_id in context['node_outputs']:
-                    source_output = context['node_outputs'][source_node_id]
+                previous_outputs = self._visible_outputs(context)
+                if source_node_id in previous_outputs:
+                    source_output = previous_outputs[source_node_id]
                     
                     if isinstance(source_output, dict):
                         # 从第二个部分开始遍历路径
@@ -627,11 +702,8 @@ class WorkflowEngine:
             'data': result_data
         }
     
-    async def _execute_llm_node(self, node: Dict[str, Any], input_data: Dict[str, Any]) -> Dict[str, Any]:
-        """执行LLM节点"""
-        config = input_data['node_config']
-        
-        # 获取LLM配置
+    def _resolve_llm_config(self, config: Dict[str, Any]) -> LLMConfig:
+        """根据节点配置获取大模型配置"""
         model_id = config.get('model_id')
         if not model_id:
             # 兼容前端的model字段（可能是ID或名称）
@@ -653,6 +725,30 @@ class WorkflowEngine:
         if not llm_config:
             raise ValueError(f"大模型配置 {model_id} 不存在")
         
+        return llm_config
+    
+    def _get_node_model_version(self, node: Dict[str, Any]) -> Optional[str]:
+        """获取节点依赖的模型版本，参与结果缓存键计算"""
+        if node.get('type') != 'llm':
+            return None
+        try:
+            llm_config = self._resolve_llm_config(node.get('config') or {})
+        except ValueError:
+            return None
+        return f"{llm_config.id}:{llm_config.model_name}@{llm_config.base_url}:{llm_config.updated_at}"
+    
+    async def _execute_llm_node(self, node: Dict[str, Any], input_data: Dict[str, Any],
+                              on_delta: Optional[Callable[[str], Awaitable[None]]] = None) -> Dict[str, Any]:
+        """执行LLM节点
+        
+        提供 on_delta 或配置了 early_stop_pattern 时使用流式调用；
+        early_stop_pattern 匹配到已生成内容后立即结束生成，下游节点（如分类）无需等待完整回答。
+        """
+        config = input_data['node_config']
+        
+        # 获取LLM配置
+        llm_config = self._resolve_llm_config(config)
+        
         # 准备提示词
         prompt_template = config.get('prompt', '')
         
@@ -669,22 +765,59 @@ class WorkflowEngine:
         input_data['processed_prompt'] = prompt
         input_data['original_prompt'] = prompt_template
         
+        early_stop_pattern = config.get('early_stop_pattern')
+        
         # 调用LLM服务
         try:
-            response = await self.llm_service.chat_completion(
+            if on_delta is None and not early_stop_pattern:
+                response = await self.llm_service.chat_completion(
+                    model_config=llm_config,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=config.get('temperature', 0.7),
+                    max_tokens=config.get('max_tokens')
+                )
+                
+                return {
+                    'success': True,
+                    'response': response,
+                    'prompt': prompt,
+                    'model': llm_config.model_name,
+                    'tokens_used': getattr(response, 'usage', {}).get('total_tokens', 0) if hasattr(response, 'usage') else 0
+                }
+            
+            early_stop = re.compile(early_stop_pattern) if early_stop_pattern else None
+            chunks = []
+            matched = None
+            
+            stream = self.llm_service.chat_completion_stream(
                 model_config=llm_config,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=config.get('temperature', 0.7),
                 max_tokens=config.get('max_tokens')
             )
+            try:
+                async for delta in stream:
+                    chunks.append(delta)
+                    if on_delta is not None:
+                        await on_delta(delta)
+                    if early_stop is not None:
+                        matched = early_stop.search(''.join(chunks))
+                        if matched:
+                            break
+            finally:
+                await stream.aclose()
             
-            return {
+            output = {
                 'success': True,
-                'response': response,
+                'response': ''.join(chunks),
                 'prompt': prompt,
                 'model': llm_config.model_name,
-                'tokens_used': getattr(response, 'usage', {}).get('total_tokens', 0) if hasattr(response, 'usage') else 0
+                'tokens_used': 0
             }
+            if early_stop is not None:
+                output['early_stopped'] = matched is not None
+                output['match'] = (matched.group(1) if matched.groups() else matched.group(0)) if matched else None
+            return output
             
         except Exception as e:
             logger.error(f"LLM调用失败: {str(e)}")
@@ -884,6 +1017,164 @@ class WorkflowEngine:
             logger.error(f"Python代码执行失败: {str(e)}")
             raise ValueError(f"Python代码执行失败: {str(e)}")
     
+    async def _execute_map_node(self, execution: WorkflowExecution, node: Dict[str, Any],
+                                input_data: Dict[str, Any]) -> Dict[str, Any]:
+        """执行Map节点：对上游输出的列表逐项执行单个节点或子图
+        
+        config:
+            items_variable: 列表来源变量，如 "node_1.result"（也可通过名为 items 的输入参数提供）
+            node: 对每个元素执行的单个节点定义
+            sub_workflow: 对每个元素执行的子图定义 {"nodes": [...], "connections": [...]}
+            concurrency: 最大并发数，默认5
+            failure_policy: fail_fast（默认，任一失败即终止）/ continue（失败项结果为None）/ skip（丢弃失败项）
+        
+        每个元素的节点执行记录在全部完成后批量写入。
+        """
+        config = input_data['node_config']
+        items = self._resolve_map_items(config, input_data)
+        
+        sub_definition = config.get('sub_workflow')
+        if not sub_definition:
+            item_node = config.get('node')
+            if not item_node:
+                raise ValueError("Map节点必须配置 node 或 sub_workflow")
+            sub_definition = {
+                'nodes': [{'id': f"{node['id']}_item", 'name': node.get('name', ''), **item_node}],
+                'connections': []
+            }
+        
+        sub_nodes = {sub_node['id']: sub_node for sub_node in sub_definition['nodes']}
+        sub_graph = self._build_node_graph(sub_nodes, sub_definition.get('connections', []))
+        
+        concurrency = max(int(config.get('concurrency', 5)), 1)
+        failure_policy = config.get('failure_policy', 'fail_fast')
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        results: List[Any] = [None] * len(items)
+        failed: Dict[int, str] = {}
+        traces: List[NodeExecution] = []
+        
+        async def run_item(index: int, item: Any):
+            async with semaphore:
+                try:
+                    results[index] = await self._execute_map_item(
+                        execution, node['id'], index, item, sub_graph, input_data, traces
+                    )
+                except Exception as e:
+                    failed[index] = str(e)
+                    if failure_policy == 'fail_fast':
+                        raise
+        
+        tasks = [asyncio.create_task(run_item(index, item)) for index, item in enumerate(items)]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            first_index = min(failed)
+            raise ValueError(f"Map第 {first_index} 项执行失败: {failed[first_index]}")
+        finally:
+            # 批量写入逐项执行记录
+            if traces:
+                self.db.add_all(traces)
+                self.db.commit()
+        
+        if failure_policy == 'skip':
+            results = [result for index, result in enumerate(results) if index not in failed]
+        
+        return {
+            'success': not failed,
+            'results': results,
+            'errors': [{'index': index, 'error': error} for index, error in sorted(failed.items())],
+            'total': len(items),
+            'succeeded': len(items) - len(failed),
+            'failed': len(failed)
+        }
+    
+    def _resolve_map_items(self, config: Dict[str, Any], input_data: Dict[str, Any]) -> List[Any]:
+        """解析Map节点的输入列表"""
+        resolved_inputs = input_data.get('resolved_inputs', {})
+        items = resolved_inputs.get('items')
+        
+        items_variable = config.get('items_variable')
+        if items is None and items_variable:
+            context = {'node_outputs': input_data['previous_outputs']}
+            items = self._resolve_variable_value(items_variable, context)
+            if items is None:
+                # 兼容 "node_id.output.field" 格式
+                parts = items_variable.split('.')
+                if len(parts) >= 3 and parts[1] == 'output':
+                    items = self._resolve_variable_value('.'.join([parts[0]] + parts[2:]), context)
+        
+        if isinstance(items, str):
+            try:
+                items = json.loads(items)
+            except json.JSONDecodeError:
+                raise ValueError("Map节点的输入不是有效的列表")
+        
+        if not isinstance(items, list):
+            raise ValueError("Map节点的输入必须是列表")
+        
+        return items
+    
+    async def _execute_map_item(self, execution: WorkflowExecution, map_node_id: str, index: int, item: Any,
+                                sub_graph: Dict[str, Dict[str, Any]], input_data: Dict[str, Any],
+                                traces: List[NodeExecution]) -> Any:
+        """对单个元素执行子图，返回结束节点（或末端节点）的输出
+        
+        子图的 node_outputs 从空开始，父工作流的输出放在 parent_outputs 中只用于变量引用，
+        子图节点ID与父节点相同（如 start、end）时也会正常执行。
+        """
+        context = {
+            'workflow_input': {**input_data['workflow_input'], 'item': item, 'index': index},
+            'node_outputs': {},
+            'parent_outputs': input_data['previous_outputs']
+        }
+        
+        async def run_traced(_execution: WorkflowExecution, sub_node: Dict[str, Any], sub_context: Dict[str, Any]):
+            trace = NodeExecution(
+                workflow_execution_id=execution.id,
+                node_id=f"{map_node_id}[{index}].{sub_node['id']}"[:50],
+                node_type=NodeType(sub_node['type']),
+                node_name=sub_node.get('name', ''),
+                status=ExecutionStatus.RUNNING,
+                started_at=datetime.now().isoformat()
+            )
+            traces.append(trace)
+            start_time = time.time()
+            try:
+                node_input = self._prepare_node_input(sub_node, sub_context)
+                trace.input_data = {'item': item, 'index': index, 'resolved_inputs': node_input.get('resolved_inputs', {})}
+                output = await self._run_node(execution, sub_node, node_input)
+                trace.status = ExecutionStatus.COMPLETED
+                trace.output_data = output
+                return output
+            except asyncio.CancelledError:
+                # fail_fast 时其他元素失败，正在执行的元素被取消
+                trace.status = ExecutionStatus.CANCELLED
+                trace.error_message = "其他元素执行失败，已取消"
+                raise
+            except Exception as e:
+                trace.status = ExecutionStatus.FAILED
+                trace.error_message = str(e)
+                raise
+            finally:
+                trace.completed_at = datetime.now().isoformat()
+                trace.duration_ms = int((time.time() - start_time) * 1000)
+        
+        for sub_node_id in sub_graph:
+            await self._execute_node_recursive(execution, sub_node_id, sub_graph, context, node_runner=run_traced)
+        
+        end_nodes = [sub_node_id for sub_node_id, info in sub_graph.items() if info['node']['type'] == 'end']
+        if end_nodes:
+            return context['node_outputs'][end_nodes[0]]
+        
+        sink_nodes = [sub_node_id for sub_node_id, info in sub_graph.items() if not info['outputs']]
+        if len(sink_nodes) == 1:
+            return context['node_outputs'][sink_nodes[0]]
+        return {sub_node_id: context['node_outputs'][sub_node_id] for sub_node_id in sink_nodes}
+    
     async def _execute_http_node(self, node: Dict[str, Any], input_data: Dict[str, Any]) -> Dict[str, Any]:
         """执行HTTP请求节点"""
         import aiohttp
@@ -0,0 +1,282 @@
+"""Background workflow execution runner."""
+
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, Optional, AsyncGenerator, Deque, Set
+
+from ..core.config import get_settings
+from ..db.database import get_db_session
+from ..models.workflow import Workflow, WorkflowExecution, NodeExecution, ExecutionStatus
+from ..utils.exceptions import ExecutorOverloadedError
+from ..utils.logger import get_logger
+
+logger = get_logger("workflow_runner")
+
+# 后台执行被取消（应用关闭）时写入执行记录的信息
+CANCELLED_MESSAGE = "工作流执行被取消"
+
+
+class ExecutionEventBuffer:
+    """单次工作流执行的事件环形缓冲区
+
+    每个事件分配一个递增的序号 ``seq``，客户端断线后可以通过 ``since`` 从指定序号之后继续接收。
+    """
+
+    def __init__(self, execution_id: int, owner_id: int, capacity: int):
+        self.execution_id = execution_id
+        self.owner_id = owner_id
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+        self.last_seq = 0
+        self.finished = False
+        self.finished_at: Optional[float] = None
+        self._condition = asyncio.Condition()
+
+    async def append(self, event: Dict[str, Any]) -> None:
+        """追加事件并唤醒所有订阅者"""
+        async with self._condition:
+            self.last_seq += 1
+            self.events.append({**event, 'seq': self.last_seq})
+            self._condition.notify_all()
+
+    async def close(self) -> None:
+        """标记执行结束"""
+        async with self._condition:
+            self.finished = True
+            self.finished_at = time.monotonic()
+            self._condition.notify_all()
+
+    async def subscribe(self, since: int = 0) -> AsyncGenerator[Dict[str, Any], None]:
+        """订阅序号大于 since 的事件，直到执行结束"""
+        cursor = max(since, 0)
+
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self.last_seq > cursor or self.finished)
+                pending = [event for event in self.events if event['seq'] > cursor]
+                finished = self.finished
+
+            # 客户端落后太多，部分事件已被环形缓冲区覆盖
+            if pending and pending[0]['seq'] > cursor + 1:
+                yield {
+                    'type': 'events_dropped',
+                    'execution_id': self.execution_id,
+                    'from_seq': cursor + 1,
+                    'to_seq': pending[0]['seq'] - 1,
+                    'timestamp': datetime.now().isoformat()
+                }
+
+            for event in pending:
+                cursor = event['seq']
+                yield event
+
+            if finished and cursor >= self.last_seq:
+                return
+
+
+class WorkflowRunner:
+    """后台工作流执行器
+
+    工作流在独立的后台任务和数据库会话中运行，与发起请求的HTTP连接解耦；
+    执行事件写入按执行ID索引的环形缓冲区，客户端可以随时接入或重连。
+    同时运行的执行数达到上限时直接拒绝新的提交（429），而不是让请求排队等待。
+    """
+
+    def __init__(self, max_concurrent: int = 20, buffer_size: int = 1000, retention_seconds: int = 600):
+        self.max_concurrent = max_concurrent
+        self.buffer_size = buffer_size
+        self.retention_seconds = retention_seconds
+        self._active = 0
+        self._buffers: Dict[int, ExecutionEventBuffer] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def check_admission(self) -> None:
+        """同时运行的执行数已达上限时抛出 ExecutorOverloadedError"""
+        if self._active >= self.max_concurrent:
+            raise ExecutorOverloadedError("workflow")
+
+    async def submit(self, workflow_id: int, input_data: Optional[Dict[str, Any]], user_id: int) -> int:
+        """
+        提交工作流到后台执行，返回执行ID
+
+        Raises:
+            ExecutorOverloadedError: 同时运行的执行数已达上限
+        """
+        self._evict_expired()
+        # 检查和占用名额之间没有await，在事件循环中是原子的
+        self.check_admission()
+        self._active += 1
+
+        ready = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(self._run(workflow_id, input_data, user_id, ready))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+
+        # shield: 提交请求被取消时不影响后台任务
+        return await asyncio.shield(ready)
+
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._active -= 1
+
+    def get_buffer(self, execution_id: int) -> Optional[ExecutionEventBuffer]:
+        """获取执行的事件缓冲区（已过期或不存在时返回None）"""
+        self._evict_expired()
+        return self._buffers.get(execution_id)
+
+    async def stream_events(self, execution_id: int, since: int = 0) -> AsyncGenerator[Dict[str, Any], None]:
+        """订阅执行事件"""
+        buffer = self.get_buffer(execution_id)
+        if buffer is None:
+            return
+        async for event in buffer.subscribe(since):
+            yield event
+
+    async def _run(self, workflow_id: int, input_data: Optional[Dict[str, Any]], user_id: int,
+                   ready: asyncio.Future) -> None:
+        """在后台任务中执行工作流"""
+        from .workflow_engine import WorkflowEngine
+
+        buffer: Optional[ExecutionEventBuffer] = None
+        db = get_db_session()
+
+        try:
+            workflow = db.query(Workflow).filter(Workflow.id == workflow_id).first()
+            if not workflow:
+                raise ValueError("工作流不存在")
+
+            workflow_start = {
+                'type': 'workflow_start',
+                'workflow_id': workflow_id,
+                'workflow_name': workflow.name,
+                'timestamp': datetime.now().isoformat()
+            }
+
+            engine = WorkflowEngine(db)
+            async for step_data in engine.execute_workflow_stream(
+                workflow=workflow,
+                input_data=input_data,
+                user_id=user_id,
+                db=db
+            ):
+                if buffer is None:
+                    # 第一条事件携带执行ID，据此注册缓冲区
+                    execution_id = step_data['execution_id']
+                    buffer = ExecutionEventBuffer(execution_id, user_id, self.buffer_size)
+                    self._buffers[execution_id] = buffer
+                    await buffer.append({**workflow_start, 'execution_id': execution_id})
+                    if not ready.done():
+                        ready.set_result(execution_id)
+
+                await buffer.append(step_data)
+
+            if buffer is not None:
+                await buffer.append({
+                    'type': 'workflow_complete',
+                    'execution_id': buffer.execution_id,
+                    'message': '工作流执行完成',
+                    'timestamp': datetime.now().isoformat()
+                })
+
+        except asyncio.CancelledError:
+            logger.warning(f"后台工作流执行被取消: workflow_id={workflow_id}")
+            if not ready.done():
+                ready.cancel()
+            if buffer is not None:
+                # 引擎只处理 Exception，取消时由这里结束执行记录并发布终止事件
+                completed_at = self._mark_cancelled(db, buffer.execution_id, user_id)
+                await buffer.append({
+                    'type': 'workflow_status',
+                    'execution_id': buffer.execution_id,
+                    'status': 'cancelled',
+                    'data': {
+                        'error_message': CANCELLED_MESSAGE,
+                        'completed_at': completed_at
+                    },
+                    'timestamp': datetime.now().isoformat()
+                })
+            raise
+
+        except Exception as e:
+            logger.error(f"后台工作流执行异常: {e}", exc_info=True)
+            if not ready.done():
+                ready.set_exception(e)
+            elif buffer is not None:
+                await buffer.append({
+                    'type': 'error',
+                    'execution_id': buffer.execution_id,
+                    'message': f'工作流执行失败: {str(e)}'
+                })
+
+        finally:
+            if not ready.done():
+                # 执行没有产生任何事件，避免提交方一直等待执行ID
+                ready.set_exception(RuntimeError("工作流执行未创建执行记录"))
+            if buffer is not None:
+                await buffer.close()
+            db.close()
+
+    @staticmethod
+    def _mark_cancelled(db, execution_id: int, user_id: int) -> str:
+        """把仍未结束的执行记录及其节点记录标记为已取消，返回完成时间"""
+        completed_at = datetime.now().isoformat()
+        unfinished = [ExecutionStatus.PENDING, ExecutionStatus.RUNNING]
+        try:
+            # 丢弃被中断的节点执行中尚未提交的修改
+            db.rollback()
+            execution = db.query(WorkflowExecution).filter(WorkflowExecution.id == execution_id).first()
+            if execution is not None and execution.status in unfinished:
+                execution.status = ExecutionStatus.CANCELLED
+                execution.error_message = CANCELLED_MESSAGE
+                execution.completed_at = completed_at
+                execution.set_audit_fields(user_id, is_update=True)
+            db.query(NodeExecution).filter(
+                NodeExecution.workflow_execution_id == execution_id,
+                NodeExecution.status.in_(unfinished)
+            ).update({
+                NodeExecution.status: ExecutionStatus.CANCELLED,
+                NodeExecution.error_message: CANCELLED_MESSAGE,
+                NodeExecution.completed_at: completed_at
+            }, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"更新被取消的执行记录失败: execution_id={execution_id}, {e}")
+        return completed_at
+
+    def _evict_expired(self) -> None:
+        """清理已结束且超过保留时长的执行缓冲区"""
+        now = time.monotonic()
+        expired = [
+            execution_id for execution_id, buffer in self._buffers.items()
+            if buffer.finished and now - buffer.finished_at > self.retention_seconds
+        ]
+        for execution_id in expired:
+            del self._buffers[execution_id]
+
+    async def shutdown(self) -> None:
+        """取消所有后台执行（应用关闭时调用），执行记录标记为已取消并向订阅者发布终止事件"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info(f"工作流执行器已关闭，取消了 {len(tasks)} 个执行")
+
+
+# 全局实例
+_workflow_runner: Optional[WorkflowRunner] = None
+
+
+def get_workflow_runner() -> WorkflowRunner:
+    """获取后台工作流执行器实例"""
+    global _workflow_runner
+    if _workflow_runner is None:
+        workflow_settings = get_settings().workflow
+        _workflow_runner = WorkflowRunner(
+            max_concurrent=workflow_settings.max_concurrent_executions,
+            buffer_size=workflow_settings.event_buffer_size,
+            retention_seconds=workflow_settings.event_retention_seconds
+        )
+    return _workflow_runner
@@ -11,6 +11,7 @@ from .exceptions import (
     UserNotFoundError,
     ChatServiceError,
     OpenAIError,
+    ExecutorOverloadedError,
     DatabaseError
 )
 
@@ -26,5 +27,6 @@ __all__ = [
     "UserNotFoundError",
     "ChatServiceError",
     "OpenAIError",
+    "ExecutorOverloadedError",
     "DatabaseError"
 ]
\ No newline at end of file
@@ -9,6 +9,7 @@ from starlette.status import (
     HTTP_403_FORBIDDEN,
     HTTP_404_NOT_FOUND,
     HTTP_422_UNPROCESSABLE_ENTITY,
+    HTTP_429_TOO_MANY_REQUESTS,
     HTTP_500_INTERNAL_SERVER_ERROR,
 )
 
@@ -93,6 +94,17 @@ class RateLimitError(ChatAgentException):
     pass
 
 
+class ExecutorOverloadedError(ChatAgentException):
+    """Executor pool queue is full."""
+    
+    def __init__(self, pool_name: str):
+        super().__init__(
+            f"Server is busy, {pool_name} executor queue is full, please retry later",
+            HTTP_429_TOO_MANY_REQUESTS,
+            {"pool": pool_name}
+        )
+
+
 class DatabaseError(ChatAgentException):
     """Database operation error exception."""
     
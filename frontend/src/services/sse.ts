@@ -3,13 +3,14 @@
  */
 
 export interface WorkflowExecutionMessage {
-  type: 'workflow_status' | 'node_status' | 'workflow_result' | 'error'
+  type: 'workflow_status' | 'node_status' | 'node_delta' | 'workflow_result' | 'error'
   execution_id?: number
   node_id?: string
   status?: string
   data?: any
   timestamp?: string
   message?: string
+  seq?: number
 }
 
 export interface WorkflowExecutionCallbacks {
@@ -18,6 +19,7 @@ export interface WorkflowExecutionCallbacks {
   onWorkflowFailed?: (data: any) => void
   onNodeStarted?: (nodeId: string, data: any) => void
   onNodeCompleted?: (nodeId: string, data: any) => void
+  onNodeDelta?: (nodeId: string, delta: string, data: any) => void
   onNodeFailed?: (nodeId: string, data: any) => void
   onWorkflowResult?: (data: any) => void
   onError?: (error: string) => void
@@ -28,6 +30,10 @@ export class WorkflowSSEService {
   private isConnected = false
   private abortController: AbortController | null = null
   private currentExecutionId: number | null = null
+  private lastSeq = 0
+  private workflowFinished = false
+  private reconnectAttempts = 0
+  private readonly maxReconnectAttempts = 5
 
   /**
    * 开始监听工作流执行
@@ -70,6 +76,10 @@ export class WorkflowSSEService {
       input_data: inputData
     }
 
+    this.lastSeq = 0
+    this.workflowFinished = false
+    this.reconnectAttempts = 0
+
     const response = await fetch(url, {
       method: 'POST',
       headers: {
@@ -91,13 +101,48 @@ export class WorkflowSSEService {
     }
 
     this.isConnected = true
-    this.processStream(reader)
+    this.processStream(reader, token)
+  }
+
+  /**
+   * 断线后重新接入后台执行的事件流（工作流在服务端继续执行，不会重新开始）
+   */
+  private async reconnect(token: string): Promise<void> {
+    if (!this.currentExecutionId || !this.abortController) {
+      return
+    }
+
+    const baseUrl = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000'
+    const url = `${baseUrl}/workflows/executions/${this.currentExecutionId}/events?since=${this.lastSeq}`
+
+    this.reconnectAttempts++
+    await new Promise(resolve => setTimeout(resolve, 1000 * this.reconnectAttempts))
+
+    const response = await fetch(url, {
+      headers: {
+        'Authorization': `Bearer ${token}`
+      },
+      signal: this.abortController.signal
+    })
+
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`)
+    }
+
+    const reader = response.body?.getReader()
+    if (!reader) {
+      throw new Error('无法获取响应流')
+    }
+
+    this.isConnected = true
+    this.reconnectAttempts = 0
+    this.processStream(reader, token)
   }
 
   /**
    * 处理流式响应
    */
-  private async processStream(reader: ReadableStreamDefaultReader<Uint8Array>): Promise<void> {
+  private async processStream(reader: ReadableStreamDefaultReader<Uint8Array>, token: string): Promise<void> {
     const decoder = new TextDecoder()
     let buffer = ''
 
@@ -123,6 +168,9 @@ export class WorkflowSSEService {
               if (line.startsWith('data: ')) {
                 const jsonData = line.substring(6)
                 const message: WorkflowExecutionMessage = JSON.parse(jsonData)
+                if (message.seq) {
+                  this.lastSeq = message.seq
+                }
                 this.handleMessage(message)
               }
             } catch (error) {
@@ -132,6 +180,14 @@ export class WorkflowSSEService {
         }
       }
     } catch (error) {
+      if (this.abortController && !this.workflowFinished && this.reconnectAttempts < this.maxReconnectAttempts) {
+        console.warn('SSE连接中断，尝试重新接入:', error)
+        this.reconnect(token).catch(reconnectError => {
+          console.error('重新接入SSE失败:', reconnectError)
+          this.callbacks.onError?.(reconnectError instanceof Error ? reconnectError.message : '处理SSE流失败')
+        })
+        return
+      }
       console.error('处理SSE流失败:', error)
       this.callbacks.onError?.(error instanceof Error ? error.message : '处理SSE流失败')
     } finally {
@@ -163,10 +219,19 @@ export class WorkflowSSEService {
       case 'node_status':
         this.handleNodeStatus(message)
         break
+      case 'node_delta':
+        if (message.node_id) {
+          this.callbacks.onNodeDelta?.(message.node_id, message.data?.delta || '', message.data)
+        }
+        break
       case 'workflow_result':
         this.handleWorkflowResult(message)
         break
+      case 'workflow_complete':
+        this.workflowFinished = true
+        break
       case 'error':
+        this.workflowFinished = true
         this.callbacks.onError?.(message.message || '工作流执行错误')
         break
       default:
@@ -206,6 +271,8 @@ export class WorkflowSSEService {
         this.callbacks.onNodeStarted?.(message.node_id, message.data)
         break
       case 'completed':
+      case 'cached':
+        // cached: 命中节点结果缓存，跳过了实际执行
         this.callbacks.onNodeCompleted?.(message.node_id, message.data)
         break
       case 'failed':